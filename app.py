@@ -1,16 +1,17 @@
-import json
 import os
-import csv
-import io
 import threading
-import time
 from datetime import datetime
 import sqlite3
 from flask import Flask, render_template, request, jsonify, send_file, Response
 import services          # Our Logic Layer
-import printer_backend   # Our Hardware Layer
-from threading import Lock
-FILE_LOCK = Lock()
+import result_cache
+import live_events       # Server-Sent Events hub
+import print_queue       # Background printer worker
+import limit_switch      # Limit switch state machine + GPIO simulator
+import settings_store    # Versioned global settings
+import exporter          # Streaming CSV/XLSX export
+import backup            # Online SQLite backups
+import qr_codes          # Cached QR matrices, preview PNG + label bitmap
 
 def get_real_ip():
     # Cloudflare / ngrok / proxies
@@ -49,20 +50,23 @@ except ImportError:
 
 app = Flask(__name__)
 
-# --- GLOBAL COUNTER ---
-# --- REPLACE "SESSION_PIPE_COUNT = 0" WITH THIS ---
-import os
-if os.path.exists("counter_memory.txt"):
-    with open("counter_memory.txt", "r") as f:
-        try:
-            SESSION_PIPE_COUNT = int(f.read().strip())
-        except:
-            SESSION_PIPE_COUNT = 0
-else:
-    SESSION_PIPE_COUNT = 0
+@app.teardown_appcontext
+def release_db(exc):
+    # Request threads hand their pooled SQLite connection back for reuse
+    services.release_db_connection()
+
+# --- PIPE COUNTER ---
+# Lives in the counters table (services.get_counter / mark_labels_printed).
+# Requests may name a counter per line/shift; the generate page uses "default".
+def counter_name(value=None):
+    return (value or services.DEFAULT_COUNTER).strip()[:40] or services.DEFAULT_COUNTER
 
 # --- LIMIT SWITCH CONFIGURATION ---
 SWITCH_PIN = 17
+SWITCH_DEBOUNCE_MS = 200           # LOW must hold this long to count as a pipe
+SWITCH_LOCKOUT_SECONDS = 60.0      # ignore the switch this long after a label (relay rebound)
+SWITCH_RELEASE_SETTLE_SECONDS = 1.0
+SWITCH_TRACE_FILE = None           # e.g. "switch_trace.txt" to record edges for benchmarks/check_switch_traces
 AUTO_PRINT_ACTIVE = False
 AUTO_PRINT_SETTINGS = {}
 
@@ -74,82 +78,121 @@ app.jinja_env.filters['format_datetime'] = format_datetime_filter
 
 ADMIN_PASS = "admin24"
 
-def limit_switch_listener():
-    # Ensure we refer to the module-level counter variable
-    global SESSION_PIPE_COUNT
-    if not GPIO_AVAILABLE: return
-
+def on_switch_trigger():
+    # Called by the limit switch thread for every debounced press.
+    # Returns True when a label was queued (starts the lockout).
+    if not (AUTO_PRINT_ACTIVE and AUTO_PRINT_SETTINGS):
+        return False
+    print("🔘 Switch Triggered! Printing Label...")
+
+    # Each pipe gets the counter's next free batch number
+    data_to_save = AUTO_PRINT_SETTINGS.copy()
+    counter = counter_name(data_to_save.get('counter'))
+    data_to_save['batch'] = f"#{services.reserve_batch_number(counter)}"
+    label_data = services.create_label_in_db(data_to_save)
+    label_data['pressure'] = data_to_save.get('pressure', '')
+    label_data['counter'] = counter
+
+    # Counter, printed_at and the log line follow in on_print_sent()
+    job_id = PRINT_WORKER.submit(label_data, source="switch")
+    print(f"🖨️ Queued ID: {label_data['id']} (job {job_id}). Locked for {SWITCH_LISTENER.machine.lockout_s:g}s")
+    return True
+
+
+def publish_print(label_ids, counter, count):
+    live_events.publish("label_printed", {"ids": label_ids, "counter": counter, "count": count})
+    live_events.publish("counter", {"name": counter, "count": count})
+
+def on_print_sent(job):
+    # Runs on the print worker once the printer accepted the label(s)
+    labels = job['payload'] if isinstance(job['payload'], list) else [job['payload']]
+    label_ids = [l['id'] for l in labels]
+    counter = counter_name(labels[0].get('counter'))
+    count = services.mark_labels_printed(label_ids, counter)
+    publish_print(label_ids, counter, count)
+    if len(label_ids) == 1:
+        print(f"🖨️ Printed ID: {label_ids[0]}")
+    else:
+        print(f"🖨️ Printed IDs: {label_ids[0]}-{label_ids[-1]} ({len(label_ids)} labels)")
+
+PRINT_WORKER = print_queue.PrintWorker(on_sent=on_print_sent)
+
+# Daily gzipped snapshot in backups/, newest backup.BACKUP_KEEP kept
+BACKUP_SCHEDULE_ENABLED = True
+BACKUP_SCHEDULER = backup.BackupScheduler()
+
+# Without a Pi the listener runs on the simulator (see /api/autoprint/simulate)
+SWITCH_GPIO = GPIO if GPIO_AVAILABLE else limit_switch.SimulatedGPIO()
+SWITCH_LISTENER = limit_switch.LimitSwitchListener(
+    SWITCH_GPIO, SWITCH_PIN, on_switch_trigger,
+    machine=limit_switch.SwitchStateMachine(SWITCH_DEBOUNCE_MS, SWITCH_LOCKOUT_SECONDS, SWITCH_RELEASE_SETTLE_SECONDS),
+    trace_path=SWITCH_TRACE_FILE)
+
+# --- BACKGROUND SERVICES ---
+# Print worker, backup scheduler and limit switch listener: one set per
+# database, however the app is served. The process running them holds the
+# lock file next to the database, so a second server process (or a second
+# import of this module) serves requests without them. Print jobs queued
+# there still land in print_jobs; the owner picks them up within
+# print_queue.IDLE_POLL_SECONDS.
+SERVICES_LOCK_FILE = os.path.splitext(services.DB_NAME)[0] + ".lock"
+BACKGROUND_SERVICES_RUNNING = False
+_services_lock = threading.Lock()
+_services_lock_file = None
+
+def _claim_services_lock():
+    global _services_lock_file
     try:
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(SWITCH_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        print(f"✅ Limit Switch Listener Started on GPIO {SWITCH_PIN}")
-    except Exception as e:
-        print(f"❌ GPIO Setup Failed: {e}")
-        return
-
-    last_state = GPIO.input(SWITCH_PIN) 
-
-    while True:
+        import fcntl
+    except ImportError:
+        return True  # Windows: no cross-process guard
+    f = open(SERVICES_LOCK_FILE, "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _services_lock_file = f
+    return True
+
+def start_background_services():
+    """Starts them unless they already run here or in another process. True if this call started them."""
+    global BACKGROUND_SERVICES_RUNNING
+    with _services_lock:
+        if BACKGROUND_SERVICES_RUNNING:
+            return False
+        if not _claim_services_lock():
+            print(f"⚠️ Printer, backups and GPIO already run in another process ({SERVICES_LOCK_FILE}). Serving requests only.")
+            return False
+        PRINT_WORKER.start()
+        if BACKUP_SCHEDULE_ENABLED:
+            BACKUP_SCHEDULER.start()
         try:
-            current_state = GPIO.input(SWITCH_PIN)
-            
-            # Check for PRESS (High -> Low)
-            if last_state == GPIO.HIGH and current_state == GPIO.LOW:
-                
-                # Double check to make sure it's not a tiny spark (0.2s check)
-                time.sleep(0.2)
-                if GPIO.input(SWITCH_PIN) == GPIO.HIGH:
-                    last_state = GPIO.HIGH
-                    continue
-
-                if AUTO_PRINT_ACTIVE and AUTO_PRINT_SETTINGS:
-                    print("🔘 Switch Triggered! Printing Label...")
-                    
-                    # Ensure batch reflects the next counter value
-                    data_to_save = AUTO_PRINT_SETTINGS.copy()
-                    data_to_save['batch'] = f"#{SESSION_PIPE_COUNT + 1}"
-                    label_data = services.create_label_in_db(data_to_save)
-                    label_data['pressure'] = data_to_save.get('pressure', '')
-                    
-                    success, msg = printer_backend.silent_print_label(label_data)
-                    
-                    if success:
-                        SESSION_PIPE_COUNT += 1
-                        # --- ADD THIS TO SAVE THE COUNT ---
-                        with FILE_LOCK:
-                            with open("counter_memory.txt", "w") as f:
-                                f.write(str(SESSION_PIPE_COUNT))
-                        # ----------------------------------
-                        
-                        services.mark_printed(label_data['id'])
-                        print(f"🖨️ Printed ID: {label_data['id']}")
-                    else:
-                        print(f"❌ Print Failed: {msg}")
-
-                    # ===================================================
-                    # 🔴 THE FIX: 60-SECOND LOCKOUT (HAMMER FIX)
-                    # ===================================================
-                    print("🛡️ Locking system for 60 seconds (Ignoring all bounce)...")
-                    time.sleep(60.0) 
-                    # ===================================================
-
-                    # --- NOW WAIT FOR RELAY TO TURN OFF ---
-                    print("⏳ Waiting for cycle to end...")
-                    while GPIO.input(SWITCH_PIN) == GPIO.LOW:
-                        time.sleep(1.0) 
-                    
-                    print("✅ Cycle Complete. Ready for next.")
-                    time.sleep(1.0) 
-
-            last_state = current_state
-            time.sleep(0.05) 
-            
+            SWITCH_LISTENER.start()
         except Exception as e:
-            print(f"Error in thread: {e}")
-            time.sleep(1)
-if GPIO_AVAILABLE:
-    t = threading.Thread(target=limit_switch_listener, daemon=True)
-    t.start()
+            print(f"❌ GPIO Setup Failed: {e}")
+        BACKGROUND_SERVICES_RUNNING = True
+        return True
+
+def stop_background_services(timeout=10):
+    """No new switch presses, the label being printed finishes, then backups stop."""
+    global BACKGROUND_SERVICES_RUNNING, _services_lock_file
+    with _services_lock:
+        if not BACKGROUND_SERVICES_RUNNING:
+            return
+        SWITCH_LISTENER.stop(timeout)
+        PRINT_WORKER.stop(timeout)
+        BACKUP_SCHEDULER.stop(timeout)
+        if GPIO_AVAILABLE:
+            try:
+                GPIO.cleanup(SWITCH_PIN)
+            except Exception:
+                pass
+        BACKGROUND_SERVICES_RUNNING = False
+        _services_lock_file.close()  # releases the lock
+        _services_lock_file = None
+
+start_background_services()
 
 # --- VIEWS ---
 @app.route('/')
@@ -197,10 +240,36 @@ def shipment_detail(shipment_id):
 @app.route('/api/labels', methods=['POST'])
 def create_label():
     d = request.json
+    if not d.get('batch'):
+        d['batch'] = f"#{services.reserve_batch_number(counter_name(d.get('counter')))}"
     label = services.create_label_in_db(d)
     label['pressure'] = d.get('pressure', '')
-    qr_img = services.generate_qr_for_label(label['id'], label['created_at'])
-    return jsonify({"success": True, "label": label, "qr_image": qr_img})
+    return jsonify({"success": True, "label": label, "qr_url": f"/api/labels/{label['id']}/qr.png"})
+
+@app.route('/api/labels/batch', methods=['POST'])
+def create_label_batch():
+    # N identical pipes: one INSERT transaction, one multi-page print job
+    d = request.json or {}
+    try:
+        count = int(d.get('count', 0))
+    except (TypeError, ValueError):
+        count = 0
+    if not 1 <= count <= services.MAX_BATCH_LABELS:
+        return jsonify({"success": False, "message": f"count must be 1-{services.MAX_BATCH_LABELS}"}), 400
+    missing = [k for k in ('pipe_name', 'size', 'color', 'weight_g') if d.get(k) in (None, '')]
+    if missing:
+        return jsonify({"success": False, "message": f"Missing: {', '.join(missing)}"}), 400
+
+    counter = counter_name(d.get('counter'))
+    labels = services.create_labels_batch(d, count, counter)
+    for label in labels:
+        label['pressure'] = d.get('pressure', '')
+        label['counter'] = counter
+    job_id = None
+    if d.get('print', True):
+        job_id = PRINT_WORKER.submit(labels, source="batch")
+    return jsonify({"success": True, "count": count, "job_id": job_id,
+                    "labels": [{"id": l['id'], "batch": l['batch']} for l in labels]})
 
 @app.route('/api/print', methods=['POST'])
 def trigger_print():
@@ -211,16 +280,31 @@ def trigger_print():
     if not label: return jsonify({"success": False}), 404
     label_for_print = label.copy()
     label_for_print['pressure'] = pressure
-    success, msg = printer_backend.silent_print_label(label_for_print)
-    if success: 
-        global SESSION_PIPE_COUNT
-        SESSION_PIPE_COUNT += 1
-        with FILE_LOCK:
-            with open("counter_memory.txt", "w") as f:
-                f.write(str(SESSION_PIPE_COUNT))
-        services.mark_printed(label_id)
-
-    return jsonify({"success": success, "message": msg})
+    label_for_print['counter'] = counter_name(req.get('counter'))
+    job_id = PRINT_WORKER.submit(label_for_print)
+    return jsonify({"success": True, "message": "Queued", "job_id": job_id, "state": "queued"})
+
+# --- PRINT JOBS ---
+@app.route('/api/print/jobs', methods=['GET'])
+def list_print_jobs():
+    state = request.args.get('state')
+    if state and state not in services.PRINT_JOB_STATES:
+        return jsonify({"error": f"state must be one of {', '.join(services.PRINT_JOB_STATES)}"}), 400
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify(services.get_print_jobs(state, limit))
+
+@app.route('/api/print/jobs/<int:job_id>', methods=['GET'])
+def get_print_job(job_id):
+    job = services.get_print_job(job_id)
+    if not job: return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/api/print/jobs/<int:job_id>/retry', methods=['POST'])
+def retry_print_job(job_id):
+    if not services.retry_print_job(job_id):
+        return jsonify({"success": False, "message": "Only failed jobs can be retried"}), 409
+    PRINT_WORKER.wake()
+    return jsonify({"success": True})
 
 @app.route('/api/autoprint/toggle', methods=['POST'])
 def toggle_autoprint():
@@ -239,11 +323,59 @@ def toggle_autoprint():
     print(msg)
     return jsonify({"success": True, "message": msg})
 
+@app.route('/api/autoprint/status', methods=['GET'])
+def autoprint_status():
+    return jsonify({"active": AUTO_PRINT_ACTIVE, "simulated": not GPIO_AVAILABLE,
+                    "switch": SWITCH_LISTENER.machine.snapshot()})
+
+@app.route('/api/autoprint/simulate', methods=['POST'])
+def simulate_switch():
+    # Drive the simulated switch: {"level": 0|1} or {"press_ms": 500}
+    if GPIO_AVAILABLE:
+        return jsonify({"success": False, "message": "Real GPIO in use"}), 409
+    if not is_allowed_internal_ip(get_real_ip()):
+        return "Forbidden", 403
+    d = request.json or {}
+    if 'press_ms' in d:
+        SWITCH_GPIO.set_level(SWITCH_PIN, limit_switch.LOW)
+        threading.Timer(float(d['press_ms']) / 1000.0, SWITCH_GPIO.set_level,
+                        (SWITCH_PIN, limit_switch.HIGH)).start()
+    else:
+        SWITCH_GPIO.set_level(SWITCH_PIN, int(d.get('level', limit_switch.HIGH)))
+    return jsonify({"success": True, "switch": SWITCH_LISTENER.machine.snapshot()})
+
 @app.route('/api/labels/<int:id>', methods=['GET'])
 def get_label(id):
     lbl = services.get_label_by_id(id)
     return jsonify(lbl) if lbl else (jsonify({"error": "Not found"}), 404)
 
+@app.route('/api/labels/<int:id>/qr.png', methods=['GET'])
+def get_label_qr(id):
+    # The QR only encodes the id, and ids are never reused: cache it for good
+    if not services.get_label_by_id(id):
+        return jsonify({"error": "Not found"}), 404
+    return Response(qr_codes.qr_png(qr_codes.label_payload(id)), mimetype="image/png",
+                    headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+MAX_LOOKUP_IDS = 5000
+
+@app.route('/api/labels/lookup', methods=['POST'])
+def lookup_labels():
+    """{"ids": [..]} -> {"labels": [rows, in request order], "missing": [ids not found]}"""
+    ids = (request.get_json(silent=True) or {}).get('ids')
+    if not isinstance(ids, list):
+        return jsonify({"error": "ids must be a list"}), 400
+    try:
+        ids = [int(i) for i in ids]
+    except (TypeError, ValueError):
+        return jsonify({"error": "ids must be integers"}), 400
+    if len(ids) > MAX_LOOKUP_IDS:
+        return jsonify({"error": f"At most {MAX_LOOKUP_IDS} ids per lookup"}), 400
+    found = services.get_labels_by_ids(ids)
+    ids = list(dict.fromkeys(ids))
+    return jsonify({"labels": [found[i] for i in ids if i in found],
+                    "missing": [i for i in ids if i not in found]})
+
 @app.route('/api/dispatch', methods=['POST'])
 def mark_dispatch():
     services.mark_dispatched(request.json['id'])
@@ -254,11 +386,6 @@ def mark_dispatch():
 def create_shipment():
     data = request.json
     
-    # DEBUG: Print incoming data to console
-    print("\n--- DEBUG: INCOMING SHIPMENT DATA ---")
-    print(data) 
-    print("-------------------------------------\n")
-    
     meta = data.get('meta', {})
     items = data.get('items', [])
     
@@ -276,9 +403,23 @@ def create_shipment():
     # Normalize data for service layer
     meta['challan_number'] = challan_val
 
+    print(f"🚚 Shipment: challan {challan_val}, {len(items)} pipes")
+
     try:
-        shipment_id, timestamp = services.create_shipment_record(meta, items)
-        return jsonify({"success": True, "message": f"Shipment {shipment_id} created.", "shipment_id": shipment_id})
+        # Only ids are taken from the client; stock, totals and rejects come from the DB
+        result = services.create_shipment_record(meta, items)
+        rejected = result["rejected"]
+        if result["shipment_id"] is None:
+            return jsonify({"success": False, "rejected": rejected,
+                            "message": f"None of the {len(items)} pipes can be dispatched (not in stock or already on a challan)."}), 409
+        message = f"Shipment {result['shipment_id']} created."
+        if rejected:
+            message += f" {len(rejected)} pipe(s) skipped: " + ", ".join(f"#{r['id']} ({r['reason']})" for r in rejected[:20])
+            if len(rejected) > 20:
+                message += ", ..."
+        return jsonify({"success": True, "message": message, "shipment_id": result["shipment_id"],
+                        "total_pipes": result["total_pipes"], "total_weight": result["total_weight"],
+                        "rejected": rejected})
     except sqlite3.IntegrityError:
         return jsonify({"success": False, "message": "Challan number already exists."}), 409
     except Exception as e:
@@ -309,56 +450,193 @@ def delete_shipment_api(shipment_id):
     success = services.delete_shipment(shipment_id)
     return jsonify({"success": True, "message": "Deleted"}) if success else (jsonify({"success": False}), 404)
 
+# --- RESPONSE CACHE (stats + grouped inventory) ---
+# Several admin tabs poll the same URLs. Responses are cached until the next
+# write (services data generation) or RESPONSE_CACHE_TTL, and polls carrying
+# a matching If-None-Match get a 304 without touching SQLite.
+RESPONSE_CACHE_TTL = 30
+RESPONSE_CACHE = result_cache.ResultCache(max_entries=64, ttl=RESPONSE_CACHE_TTL)
+
+def cached_json(endpoint, compute):
+    key = result_cache.make_key(endpoint, request.args)
+    generation = services.data_generation()
+
+    etag = RESPONSE_CACHE.peek_etag(key, generation)
+    if etag and etag in request.if_none_match:
+        RESPONSE_CACHE.record_not_modified()
+        return Response(status=304, headers={"ETag": f'"{etag}"', "Cache-Control": "no-cache"})
+
+    entry = RESPONSE_CACHE.get_or_compute(key, generation, lambda: jsonify(compute()).get_data())
+    if entry.etag in request.if_none_match:
+        RESPONSE_CACHE.record_not_modified()
+        return Response(status=304, headers={"ETag": f'"{entry.etag}"', "Cache-Control": "no-cache"})
+    return Response(entry.body, mimetype="application/json",
+                    headers={"ETag": f'"{entry.etag}"', "Cache-Control": "no-cache"})
+
 @app.route('/api/inventory', methods=['GET'])
 def get_inventory():
     auth = request.authorization
     if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
-    return jsonify(services.fetch_inventory_data(request.args))
+    try:
+        if request.args.get('grouped') == 'true':
+            return cached_json('inventory_grouped', lambda: services.fetch_inventory_data(request.args))
+        return jsonify(services.fetch_inventory_data(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 @app.route('/api/stats_summary', methods=['GET'])
 def get_stats_summary():
     auth = request.authorization
     if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
-    return jsonify(services.get_stats())
+    return cached_json('stats_summary', services.get_stats)
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    auth = request.authorization
+    if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"generation": services.data_generation(), "responses": RESPONSE_CACHE.stats(),
+                    "labels": services.LABEL_CACHE.stats(), "qr": qr_codes.QR_CACHE.stats()})
 
 @app.route('/api/export', methods=['GET'])
 def export_excel():
+    """
+    Streams the filtered labels (same filters as /api/inventory, all pages).
+    ?format=csv|xlsx (default csv), ?columns=id,pipe_name,... to pick columns.
+    """
     auth = request.authorization
     if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
-    data = services.fetch_inventory_data(request.args)
-    si = io.StringIO(); cw = csv.writer(si)
-    if data:
-        cw.writerow(data[0].keys())
-        for row in data: cw.writerow(row.values())
-    else: cw.writerow(["No Data"])
-    return Response(si.getvalue(), mimetype="text/csv", headers={"Content-Disposition": "attachment;filename=report.csv"})
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in ('csv', 'xlsx'):
+        return jsonify({"error": "format must be csv or xlsx"}), 400
+    available = services.export_columns(request.args)
+    columns = available
+    if request.args.get('columns'):
+        columns = [c.strip() for c in request.args['columns'].split(',') if c.strip()]
+        unknown = [c for c in columns if c not in available]
+        if unknown or not columns:
+            return jsonify({"error": f"Unknown columns: {', '.join(unknown)}", "available": available}), 400
+
+    rows = services.iter_export_rows(request.args.to_dict(), columns)
+    if fmt == 'xlsx':
+        body, mimetype = exporter.stream_xlsx(columns, rows), exporter.XLSX_MIMETYPE
+    else:
+        body, mimetype = exporter.stream_csv(columns, rows), "text/csv"
+    return Response(body, mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment;filename={exporter.export_filename(fmt)}",
+        "X-Accel-Buffering": "no",  # let proxies/tunnels pass chunks through as they come
+    })
 
 @app.route('/api/backup')
-def backup(): 
+def download_backup():
+    """Fresh consistent snapshot of the database and its archive as one tar, gzipped as it streams (?compress=0 for a plain .tar)."""
+    auth = request.authorization
+    if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
+    compress = request.args.get('compress', '1') != '0'
+    name = f"pvc_factory-{datetime.now():%Y%m%d-%H%M%S}.tar" + (".gz" if compress else "")
+    return Response(backup.stream_snapshot(compress), mimetype="application/gzip" if compress else "application/x-tar",
+                    headers={"Content-Disposition": f"attachment;filename={name}", "X-Accel-Buffering": "no"})
+
+@app.route('/api/backup/status')
+def backup_status():
     auth = request.authorization
     if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
-    return send_file(services.DB_NAME, as_attachment=True)
+    return jsonify({"progress": backup.progress(), "backups": backup.list_backups(),
+                    "next_in_s": round(BACKUP_SCHEDULER.seconds_until_due()) if BACKUP_SCHEDULE_ENABLED else None})
+
+@app.route('/api/backup/create', methods=['POST'])
+def backup_create():
+    auth = request.authorization
+    if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
+    try:
+        return jsonify({"success": True, **backup.create_backup()})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/backup/check')
+def backup_check():
+    """PRAGMA integrity_check on a stored backup (?name=..., default the newest)."""
+    auth = request.authorization
+    if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
+    name = request.args.get('name') or next((b['name'] for b in backup.list_backups()), None)
+    path = backup.backup_path(name) if name else None
+    if not path:
+        return jsonify({"error": "Backup not found"}), 404
+    ok, messages = backup.integrity_check(path)
+    return jsonify({"name": name, "ok": ok, "messages": messages})
+
+@app.route('/api/backup/files/<name>')
+def backup_file(name):
+    auth = request.authorization
+    if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
+    path = backup.backup_path(name)
+    if not path:
+        return jsonify({"error": "Backup not found"}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=name)
+
+# --- ARCHIVE (replaces the old 30-day delete) ---
+# Moves dispatched/rejected pipes older than ?days= (default
+# services.ARCHIVE_AFTER_DAYS) to the archive DB on a background thread;
+# progress is on /api/archive/status.
 @app.route('/api/cleanup', methods=['POST'])
 def cleanup():
-    services.run_cleanup()
-    return jsonify({"success": True})
+    auth = request.authorization
+    if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
+    days = request.args.get('days', services.ARCHIVE_AFTER_DAYS, type=int)
+    if days < 30:
+        return jsonify({"success": False, "error": "days must be at least 30"}), 400
+    if services.archive_running():
+        return jsonify({"success": False, "error": "Archive already running"}), 409
+
+    def run():
+        try:
+            result = services.archive_labels(days)
+            print(f"📦 Archived {result['moved']} labels (older than {result['horizon'][:10]})")
+        except Exception as e:
+            print(f"❌ Archive failed: {e}")
+    threading.Thread(target=run, name="archive", daemon=True).start()
+    return jsonify({"success": True, "started": True, "days": days}), 202
+
+@app.route('/api/archive/status')
+def archive_status():
+    auth = request.authorization
+    if not auth or auth.password != ADMIN_PASS: return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(services.get_archive_status())
+
+# --- LIVE UPDATES (SSE) ---
+# /api/events?topics=counter,settings -> text/event-stream
+# Payloads carry nothing the public GET endpoints don't already expose
+# (stats_changed is just a generation number), so no admin auth is needed
+# here; EventSource cannot send an Authorization header anyway.
+@app.route('/api/events')
+def live_event_stream():
+    topics = [t for t in request.args.get('topics', '').split(',') if t]
+    if not topics or any(t not in live_events.TOPICS for t in topics):
+        return jsonify({"error": f"topics must be a comma list of {', '.join(live_events.TOPICS)}"}), 400
+    if live_events.streams_full():
+        # EventSource gives up on a 503; the page falls back to polling
+        return jsonify({"error": "Too many live connections"}), 503
+    return Response(live_events.stream(topics), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route('/api/counter', methods=['GET'])
 def get_counter():
-    return jsonify({"count": SESSION_PIPE_COUNT})
+    name = counter_name(request.args.get('name'))
+    return jsonify({"name": name, "count": services.get_counter(name)})
 
 @app.route('/api/counter/reset', methods=['POST'])
 def reset_counter_api():
-    global SESSION_PIPE_COUNT
-    SESSION_PIPE_COUNT = 0
-    # --- ADD THIS TO ERASE THE MEMORY FILE ---
-    with FILE_LOCK:
-        with open("counter_memory.txt", "w") as f:
-            f.write("0")
-    # -----------------------------------------
+    d = request.get_json(silent=True) or {}
+    name = counter_name(d.get('name'))
+    old_value = services.reset_counter(name, reset_by=get_real_ip(), reason=d.get('reason'))
+    live_events.publish("counter", {"name": name, "count": 0})
     
-    return jsonify({"success": True, "count": 0})
+    return jsonify({"success": True, "name": name, "count": 0, "previous": old_value})
+
+@app.route('/api/counters', methods=['GET'])
+def list_counters():
+    return jsonify({"counters": services.get_counters(),
+                    "resets": services.get_counter_resets(request.args.get('name'),
+                                                          min(request.args.get('limit', 50, type=int), 500))})
 # --- ADD NEAR THE BOTTOM OF app.py (Before 'if __name__...') ---
 
 @app.route('/api/labels/<int:label_id>', methods=['DELETE'])
@@ -374,50 +652,37 @@ def reject_pipe(label_id):
         return jsonify({"error": "Pipe not found"}), 404
 # --- GLOBAL SETTINGS SYNC (THE CLOUD MEMORY) ---
 SETTINGS_FILE = "global_settings.json"
-# --- IS CODE KO 'get_global_settings' KI JAGAH PASTE KARO ---
+SETTINGS = settings_store.SettingsStore(SETTINGS_FILE)
+SETTINGS_LONG_POLL_SECONDS = 25
+
+# GET /api/settings/get                     -> settings (ETag = version)
+#     If-None-Match: "<version>"            -> 304 while unchanged
+#     ?since_version=<n>                    -> waits up to 25s for a newer version, else 304
 @app.route('/api/settings/get', methods=['GET'])
 def get_global_settings():
-    if os.path.exists(SETTINGS_FILE):
-        try:
-            with FILE_LOCK:
-                with open(SETTINGS_FILE, 'r') as f:
-                    content = f.read().strip()
-                # Agar file khali hai toh empty bhejo
-                if not content:
-                    return jsonify({})
-                return jsonify(json.loads(content))
-        except Exception as e:
-            # AGAR FILE KHARAB HAI, TOH USKO DELETE KAR DO (Auto-Repair)
-            print(f"⚠️ Settings file corrupted. Deleting it. Error: {e}")
-            try:
-                os.remove(SETTINGS_FILE)
-            except:
-                pass
-            return jsonify({})
-    return jsonify({})
+    since = request.args.get('since_version', type=int)
+    if since is not None:
+        version, settings = SETTINGS.wait_for_change(since, SETTINGS_LONG_POLL_SECONDS)
+    else:
+        version, settings = SETTINGS.get()
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "X-Settings-Version": str(version), "Cache-Control": "no-cache"}
+    if (since is not None and version <= since) or request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers=headers)
+    return jsonify(settings), 200, headers
 
 @app.route('/api/settings/update', methods=['POST'])
 def update_global_settings():
-    new_settings = request.json
+    new_settings = request.get_json(silent=True)
+    if not isinstance(new_settings, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
     try:
-        # Read existing to merge, or start fresh
-        existing = {}
-        if os.path.exists(SETTINGS_FILE):
-            with FILE_LOCK:
-                with open(SETTINGS_FILE, 'r') as f:
-                    existing = json.load(f)
-        
         # Update only the changed fields
-        existing.update(new_settings)
-        
-        with FILE_LOCK:
-            with open(SETTINGS_FILE, 'w') as f:
-                json.dump(existing, f)
-
-            
-        return jsonify({"success": True})
-    except Exception as e:
+        version, merged = SETTINGS.update(new_settings)
+    except OSError as e:
         return jsonify({"error": str(e)}), 500
+    live_events.publish("settings", merged)
+    return jsonify({"success": True, "version": version})
 
 # --- UNIQUE ROUTE: Search Challan ---
 @app.route('/api/dispatch/search_challan/<string:c_no>')
@@ -497,40 +762,56 @@ def reject_inventory():
             
             # THE TRICK: Set dispatched_by to 'rejected'
             conn.execute(f"UPDATE labels SET dispatched_by = 'rejected' WHERE id IN ({placeholders})", ids)
+        services.invalidate_labels(ids)
+        services.bump_data_generation()
             
         return jsonify({'success': True, 'message': f'Marked {len(ids)} records as rejected'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
-# --- ADD GLOBAL QUEUE ---
-from collections import deque
-ESP_QUEUE = deque()
+# --- ESP SCANS ---
+# Scans are kept in SQLite (services "ESP SCAN RING"); every page reads them
+# through its own cursor: /api/esp/fetch?consumer=dispatch&after=<seq>.
+def _esp_pipe_id(item):
+    # {"id": 3491} and {"id": {"id": 3491}} from older firmware, or a bare 3491
+    if isinstance(item, dict):
+        item = item.get("id")
+        if isinstance(item, dict):
+            item = item.get("id")
+    if isinstance(item, bool) or not isinstance(item, int) or item <= 0:
+        raise ValueError(f"Invalid ID format: {item!r}")
+    return item
 
 # --- ESP PUSH API ---
 @app.route('/api/esp/push', methods=['POST'])
 def esp_push():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         print("📥 RAW DATA:", data)
 
-        pipe_id = None
-
-        # Case 1: {"id": 3491}
-        if isinstance(data.get("id"), int):
-            pipe_id = data["id"]
-
-        # Case 2: {"id": {"id": 3491}}
-        elif isinstance(data.get("id"), dict):
-            pipe_id = data["id"].get("id")
-
-        if not pipe_id:
+        # Batched: {"ids": [3491, 3492]} or [3491, {"id": 3492}]; single: {"id": 3491}
+        if isinstance(data, list):
+            items, source = data, None
+        elif isinstance(data, dict):
+            items = data["ids"] if isinstance(data.get("ids"), list) else [data]
+            source = data.get("device")
+        else:
             return jsonify({"error": "Invalid ID format"}), 400
+        try:
+            pipe_ids = [_esp_pipe_id(item) for item in items]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not pipe_ids:
+            return jsonify({"error": "No IDs"}), 400
 
-        ESP_QUEUE.append(pipe_id)
+        result = services.push_esp_scans(pipe_ids, source)
+        if result["accepted"]:
+            # Doorbell for open scan pages; they read from their cursor via /api/esp/fetch
+            live_events.publish("esp_scans", {"last_seq": result["last_seq"], "accepted": result["accepted"]})
 
-        print(f"✅ Parsed ID: {pipe_id}")
-        return jsonify({"success": True})
+        print(f"✅ Parsed IDs: {pipe_ids} ({result['duplicates']} duplicate)")
+        return jsonify({"success": True, **result})
 
     except Exception as e:
         print("❌ ESP PUSH ERROR:", str(e))
@@ -539,12 +820,13 @@ def esp_push():
 # --- UI FETCH API ---
 @app.route('/api/esp/fetch', methods=['GET'])
 def esp_fetch():
-    items = []
-
-    while ESP_QUEUE:
-        items.append(ESP_QUEUE.popleft())
-
-    return jsonify(items)
+    consumer = request.args.get('consumer')
+    after = request.args.get('after', type=int)
+    if consumer is None and after is None:
+        # Old pages: plain list of IDs, shared "default" cursor
+        result = services.fetch_esp_scans("default")
+        return jsonify([item["id"] for item in result["items"]])
+    return jsonify(services.fetch_esp_scans((consumer or "default")[:64], after))
 
 # ── Verify Page Route ────────────────────────────────────────────────────────
 @app.route('/verify')   
@@ -565,7 +847,10 @@ def get_verify_pipes():
     Called by verify.html on page load.
     No admin auth needed — verify page is LAN-only.
     """
-    data = services.fetch_inventory_data(request.args)
+    try:
+        data = services.fetch_inventory_data(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify(data)
 
 
@@ -614,11 +899,26 @@ def get_verify_vouchers():
         return jsonify({"error": "Unauthorized"}), 401
     return jsonify(services.get_verification_vouchers())
 
-if __name__ == '__main__':
-    if not os.path.exists('templates'): os.makedirs('templates')
-    print("System Running on http://localhost:5000")
-    app.run(host='0.0.0.0', port=5000)
+# ── Voucher history per pipe / missing pipes per SKU ───────────────────────
+# Indexed lookups on the voucher item tables (services "VOUCHER ITEMS")
+@app.route('/api/labels/<int:label_id>/vouchers', methods=['GET'])
+def get_label_vouchers(label_id):
+    auth = request.authorization
+    if not auth or auth.password != ADMIN_PASS:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(services.get_pipe_voucher_history(label_id))
+
+
+@app.route('/api/verify/missing_by_sku', methods=['GET'])
+def get_missing_by_sku():
+    """?name=&size=&color=&pressure= narrow it to one SKU; ?limit= (default 50)"""
+    auth = request.authorization
+    if not auth or auth.password != ADMIN_PASS:
+        return jsonify({"error": "Unauthorized"}), 401
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 1000)
+    return jsonify(services.get_missing_by_sku(request.args, limit))
 
+# Development server. For the shop floor use serve.py (waitress, graceful SIGTERM).
 if __name__ == '__main__':
     if not os.path.exists('templates'): os.makedirs('templates')
     print("System Running on http://localhost:5000")
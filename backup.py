@@ -0,0 +1,331 @@
+import contextlib
+import datetime
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+
+import services
+
+# --- BACKUPS ---
+# Copying pvc_factory.db while the app runs can miss whatever still sits in
+# the -wal file, or catch a page half written. snapshot() uses the SQLite
+# online backup API instead, inside one read transaction: the copy is the
+# database as of that moment, and in WAL mode writers (printer, dispatch)
+# carry on while it runs.
+#
+#   /api/backup                 fresh snapshot of both files as one tar,
+#                               gzipped while it streams
+#   backups/pvc_factory-<time>.db.gz (+ pvc_factory-<time>_archive.db.gz)
+#                               BackupScheduler, every BACKUP_INTERVAL_HOURS,
+#                               newest BACKUP_KEEP kept
+#
+# The archive DB (services.ARCHIVE_DB, old labels moved out of labels) is
+# part of every backup: stock_summary in the main file still counts those
+# labels. It is copied right after the main file; a label an archive batch
+# moved in between is then in both copies, and is dropped from the archive
+# copy (the hot copy wins, as in services.archive_labels()). The two copies
+# are the pair as of the main snapshot.
+BACKUP_DIR = os.environ.get("PVC_BACKUP_DIR", "backups")
+BACKUP_PREFIX = "pvc_factory-"
+BACKUP_PAGES_PER_STEP = 1024   # 4 MB with the default page size; progress is reported per step
+BACKUP_INTERVAL_HOURS = 24
+BACKUP_KEEP = 14
+STREAM_CHUNK_BYTES = 256 * 1024
+
+_progress_lock = threading.Lock()
+_progress = {"running": False, "target": None, "pages_total": 0, "pages_done": 0,
+             "started_at": None, "finished_at": None, "last_error": None}
+
+
+def progress():
+    with _progress_lock:
+        return dict(_progress)
+
+
+def _set_progress(**values):
+    with _progress_lock:
+        _progress.update(values)
+
+
+def _copy_database(src_path, dest_path):
+    """Online backup of one database file into `dest_path`. Returns the page count."""
+    _set_progress(target=os.path.basename(dest_path), pages_total=0, pages_done=0)
+
+    def on_step(status, remaining, total):
+        _set_progress(pages_total=total, pages_done=total - remaining)
+
+    src = sqlite3.connect(src_path, timeout=services.DB_BUSY_TIMEOUT_MS / 1000)
+    dst = sqlite3.connect(dest_path)
+    try:
+        # Every step reads from this one transaction, so the copy cannot
+        # mix pages from before and after a write.
+        src.execute("BEGIN")
+        pages = src.execute("PRAGMA page_count").fetchone()[0]
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=on_step)
+        src.rollback()
+        dst.execute("PRAGMA journal_mode=DELETE")  # self-contained file, no -wal next to it
+    finally:
+        dst.close()
+        src.close()
+    _set_progress(pages_done=pages)
+    return pages
+
+
+def _drop_hot_rows(archive_path, main_path):
+    """Removes from an archive copy the labels its main copy still has."""
+    conn = sqlite3.connect(archive_path)
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='labels'").fetchone():
+            conn.execute("ATTACH DATABASE ? AS hot", (main_path,))
+            conn.execute("DELETE FROM labels WHERE id IN (SELECT id FROM hot.labels)")
+            conn.commit()
+            conn.execute("DETACH DATABASE hot")
+    finally:
+        conn.close()
+
+
+def archive_enabled():
+    return services.ARCHIVE_ENABLED and os.path.exists(services.ARCHIVE_DB)
+
+
+def snapshot(dest_path, archive_dest=None):
+    """
+    Writes a consistent copy of the live database to `dest_path`,
+    BACKUP_PAGES_PER_STEP pages at a time; with `archive_dest`, the archive
+    DB goes there (see the notes at the top). Returns the page count.
+    """
+    _set_progress(running=True, started_at=datetime.datetime.now().isoformat(), finished_at=None, last_error=None)
+    try:
+        pages = _copy_database(services.DB_NAME, dest_path)
+        if archive_dest:
+            pages += _copy_database(services.ARCHIVE_DB, archive_dest)
+            _drop_hot_rows(archive_dest, dest_path)
+    except Exception as e:
+        _set_progress(running=False, last_error=str(e))
+        raise
+    _set_progress(running=False, finished_at=datetime.datetime.now().isoformat())
+    return pages
+
+
+def archive_name(name):
+    """pvc_factory-<time>.db.gz -> pvc_factory-<time>_archive.db.gz (any path or .db name)."""
+    i = name.rindex(".db")
+    return name[:i] + "_archive" + name[i:]
+
+
+def integrity_check(db_path, archive_path=None):
+    """
+    (ok, messages) from PRAGMA integrity_check on a backup (.db or .db.gz)
+    and on its archive copy (`archive_path`, by default the _archive file
+    next to it when there is one). Also checks that stock_summary counts
+    exactly the labels the two files hold, which fails for a backup whose
+    archive copy is missing.
+    """
+    if archive_path is None and not db_path.endswith(("_archive.db", "_archive.db.gz")):
+        sibling = archive_name(db_path)
+        archive_path = sibling if os.path.exists(sibling) else None
+    if db_path.endswith(".gz"):
+        with _gunzipped(db_path) as plain:
+            return integrity_check(plain, archive_path or "")
+    if archive_path and archive_path.endswith(".gz"):
+        with _gunzipped(archive_path) as plain:
+            return integrity_check(db_path, plain)
+
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        messages = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+        labels = conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+        summary = None
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name='stock_summary'").fetchone():
+            summary = conn.execute("SELECT COALESCE(SUM(total), 0) FROM stock_summary").fetchone()[0]
+        archived = 0
+        if archive_path:
+            conn.execute("ATTACH DATABASE ? AS archive", (f"file:{archive_path}?mode=ro",))
+            messages += [f"archive: {r[0]}" for r in conn.execute("PRAGMA archive.integrity_check") if r[0] != "ok"]
+            if conn.execute("SELECT 1 FROM archive.sqlite_master WHERE name='labels'").fetchone():
+                archived = conn.execute("SELECT COUNT(*) FROM archive.labels").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        return False, [str(e)]
+    finally:
+        conn.close()
+    if summary is not None and summary != labels + archived:
+        messages.append(f"stock_summary counts {summary} labels, backup has {labels + archived}"
+                        + ("" if archive_path else " (no archive copy)"))
+    ok = messages == ["ok"]
+    return ok, messages if not ok else [f"ok ({labels} labels, {archived} archived)"]
+
+
+@contextlib.contextmanager
+def _gunzipped(gz_path):
+    fd, path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(gz_path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as out, gzip.open(gz_path, "rb") as src:
+            shutil.copyfileobj(src, out, STREAM_CHUNK_BYTES)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def _tar_blocks(members):
+    """A tar of [(name, path)], as chunks, without holding a whole file in memory."""
+    written = 0
+    for name, path in members:
+        info = tarfile.TarInfo(name)
+        info.size, info.mtime, info.mode = os.path.getsize(path), int(time.time()), 0o644
+        header = info.tobuf()
+        padding = b"\0" * (-info.size % tarfile.BLOCKSIZE)  # members fill whole blocks
+        written += len(header) + info.size + len(padding)
+        yield header
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+        yield padding
+    # End of archive: two zero blocks, padded to a whole record like tarfile writes it
+    end = b"\0" * (2 * tarfile.BLOCKSIZE)
+    yield end + b"\0" * (-(written + len(end)) % tarfile.RECORDSIZE)
+
+
+def stream_snapshot(compress=True):
+    """
+    Generator for /api/backup: snapshots the database and its archive into
+    temp files, then yields them as one tar (gzip-compressed unless
+    `compress` is False), named like the live files, and deletes them.
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="download-", suffix=".db", dir=BACKUP_DIR)
+    os.close(fd)
+    archive_path = archive_name(path) if archive_enabled() else None
+    try:
+        snapshot(path, archive_path)
+        members = [(os.path.basename(services.DB_NAME), path)]
+        if archive_path:
+            members.append((os.path.basename(services.ARCHIVE_DB), archive_path))
+        gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = gzip framing
+        for chunk in _tar_blocks(members):
+            chunk = gz.compress(chunk) if gz else chunk
+            if chunk:
+                yield chunk
+        if gz:
+            yield gz.flush()
+    finally:
+        for member in (path, archive_path):
+            if member and os.path.exists(member):
+                os.remove(member)
+
+
+# --- ROTATING LOCAL BACKUPS ---
+def list_backups():
+    """Newest first: [{"name", "size", "created_at", "archive", "archive_size"}], archive being the _archive copy (or None)."""
+    items = []
+    for path in sorted(glob.glob(os.path.join(BACKUP_DIR, BACKUP_PREFIX + "*.db.gz")), reverse=True):
+        if path.endswith("_archive.db.gz"):
+            continue
+        stat = os.stat(path)
+        archive = archive_name(path)
+        items.append({"name": os.path.basename(path), "size": stat.st_size,
+                      "created_at": datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                      "archive": os.path.basename(archive) if os.path.exists(archive) else None,
+                      "archive_size": os.path.getsize(archive) if os.path.exists(archive) else None})
+    return items
+
+
+def backup_path(name):
+    """Path of a listed backup or its archive copy, or None (also for anything that is not a plain backup name)."""
+    if os.path.basename(name) != name or not name.startswith(BACKUP_PREFIX) or not name.endswith(".db.gz"):
+        return None
+    path = os.path.join(BACKUP_DIR, name)
+    return path if os.path.exists(path) else None
+
+
+def _gzip_file(src_path, final):
+    with open(src_path, "rb") as src, gzip.open(final + ".tmp", "wb", compresslevel=6) as out:
+        shutil.copyfileobj(src, out, STREAM_CHUNK_BYTES)
+    os.replace(final + ".tmp", final)
+
+
+def create_backup(keep=BACKUP_KEEP):
+    """Snapshot (with the archive) -> integrity check -> backups/pvc_factory-<time>.db.gz (+ _archive), then rotation."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = f"{BACKUP_PREFIX}{datetime.datetime.now():%Y%m%d-%H%M%S}.db.gz"
+    fd, tmp_db = tempfile.mkstemp(prefix="snapshot-", suffix=".db", dir=BACKUP_DIR)
+    os.close(fd)
+    tmp_archive = archive_name(tmp_db) if archive_enabled() else None
+    try:
+        snapshot(tmp_db, tmp_archive)
+        ok, messages = integrity_check(tmp_db, tmp_archive or "")
+        if not ok:
+            raise RuntimeError("snapshot failed integrity_check: " + "; ".join(messages[:5]))
+        final = os.path.join(BACKUP_DIR, name)
+        if tmp_archive:
+            _gzip_file(tmp_archive, archive_name(final))  # first, so a listed backup always has its archive
+        _gzip_file(tmp_db, final)
+    finally:
+        for path in (tmp_db, tmp_archive):
+            if path and os.path.exists(path):
+                os.remove(path)
+    removed = prune_backups(keep)
+    size = os.path.getsize(final) + (os.path.getsize(archive_name(final)) if tmp_archive else 0)
+    return {"name": name, "archive": os.path.basename(archive_name(final)) if tmp_archive else None,
+            "size": size, "check": messages[0], "removed": removed}
+
+
+def prune_backups(keep=BACKUP_KEEP):
+    removed = []
+    for item in list_backups()[keep:]:
+        for name in (item["name"], item["archive"]):
+            if name:
+                os.remove(os.path.join(BACKUP_DIR, name))
+                removed.append(name)
+    return removed
+
+
+class BackupScheduler:
+    """Runs create_backup() every `interval_hours`, counting from the newest backup on disk."""
+
+    def __init__(self, interval_hours=BACKUP_INTERVAL_HOURS, keep=BACKUP_KEEP):
+        self.interval = interval_hours * 3600
+        self.keep = keep
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="backup-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def seconds_until_due(self):
+        newest = list_backups()[:1]
+        if not newest:
+            return 0
+        age = time.time() - os.path.getmtime(os.path.join(BACKUP_DIR, newest[0]["name"]))
+        return max(0, self.interval - age)
+
+    def _run(self):
+        # give startup (migrations, GPIO) a minute before the first backup
+        if self._stop.wait(60):
+            return
+        while not self._stop.is_set():
+            if self._stop.wait(self.seconds_until_due()):
+                break
+            try:
+                result = create_backup(self.keep)
+                print(f"💾 Backup {result['name']} ({result['size'] // 1024} KB, {result['check']})")
+            except Exception as e:
+                print(f"❌ Backup failed: {e}")
+                self._stop.wait(3600)  # try again in an hour
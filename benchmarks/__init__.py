@@ -0,0 +1,7 @@
+"""
+Benchmark scripts for the factory server.
+
+Run from the project root, e.g.:  python -m benchmarks.bench_db_pool
+Every benchmark works on a throwaway database (PVC_DB is pointed at a temp
+file before services/app are imported), never on the live pvc_factory.db.
+"""
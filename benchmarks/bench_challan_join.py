@@ -0,0 +1,79 @@
+"""
+Inventory detail query: how the challan number is attached to each row.
+
+    python -m benchmarks.bench_challan_join --labels 1000000
+
+Compares, at increasing page depths:
+  subquery - the old (SELECT challan_no FROM shipments WHERE id = ...) per row
+  join     - labels LEFT JOIN shipments
+  column   - the denormalized labels.challan_no the services query reads now
+"""
+import argparse
+import time
+
+from benchmarks.common import use_temp_db, remove_db, seed_labels, seed_shipments
+
+VARIANTS = {
+    "subquery": """
+        SELECT labels.*,
+               (SELECT challan_no FROM shipments WHERE id = labels.shipment_id) as challan_no
+        FROM labels WHERE {where}
+        ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?
+    """,
+    # shipments is narrowed to (sid, challan_no) so created_at/id in the filter stay unambiguous
+    "join": """
+        SELECT labels.*, s.challan_no
+        FROM labels LEFT JOIN (SELECT id AS sid, challan_no FROM shipments) s ON s.sid = labels.shipment_id
+        WHERE {where}
+        ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?
+    """,
+}
+
+
+def timed(conn, sql, params, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        elapsed = (time.perf_counter() - t0) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--labels", type=int, default=1000000)
+    ap.add_argument("--per-page", type=int, default=1000)
+    ap.add_argument("--pages", default="1,10,100")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    db_path = use_temp_db("pvc_join_")
+    import services
+    try:
+        conn = services.get_db_connection()
+        t0 = time.perf_counter()
+        seed_labels(conn, args.labels)
+        seed_shipments(conn)
+        conn.execute("ANALYZE main")
+        print(f"seeded {args.labels} labels in {time.perf_counter() - t0:.1f}s")
+
+        for status in ("dispatched", ""):
+            where, params = services.build_where_clause({"status": status})
+            queries = {name: sql.format(where=where) for name, sql in VARIANTS.items()}
+            queries["column"] = services._label_page_query(where, "LIMIT ? OFFSET ?")
+            print(f"\nstatus={status or 'all'}  per_page={args.per_page}   (best of {args.repeat}, ms)")
+            for page in (int(p) for p in args.pages.split(",")):
+                page_params = params + [args.per_page, (page - 1) * args.per_page]
+                results = {name: timed(conn, sql, page_params, args.repeat) for name, sql in queries.items()}
+                challans = {name: [r["challan_no"] for r in rows] for name, (_, rows) in results.items()}
+                same = all(c == challans["subquery"] for c in challans.values())
+                print(f"  page {page:>4}: " + "   ".join(f"{n} {ms:8.1f}" for n, (ms, _) in results.items())
+                      + ("" if same else "   (challan mismatch!)"))
+    finally:
+        services.close_all_connections()
+        remove_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Per-request DB overhead of GET /api/labels/<id>, with and without the
+per-thread connection pool in services.get_db_connection().
+
+    python -m benchmarks.bench_db_pool --labels 20000 --requests 4000 --workers 8
+
+--fresh-threads runs every request on a brand new thread, which is what the
+Werkzeug dev server does (threaded=True spawns one thread per request).
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import use_temp_db, remove_db, seed_labels, percentiles
+
+
+def run_lookups(client_factory, ids, workers, fresh_threads):
+    samples = []
+    lock = threading.Lock()
+
+    def one(label_id):
+        client = client_factory()
+        t0 = time.perf_counter()
+        res = client.get(f"/api/labels/{label_id}")
+        elapsed = (time.perf_counter() - t0) * 1000
+        assert res.status_code == 200, res.status_code
+        with lock:
+            samples.append(elapsed)
+
+    t_start = time.perf_counter()
+    if fresh_threads:
+        pending = list(ids)
+        while pending:
+            batch, pending = pending[:workers], pending[workers:]
+            threads = [threading.Thread(target=one, args=(i,)) for i in batch]
+            for t in threads: t.start()
+            for t in threads: t.join()
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(one, ids))
+    wall = time.perf_counter() - t_start
+
+    stats = percentiles(samples)
+    stats["req_per_s"] = round(len(ids) / wall, 1)
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--labels", type=int, default=20000)
+    ap.add_argument("--requests", type=int, default=4000)
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--fresh-threads", action="store_true")
+    args = ap.parse_args()
+
+    db_path = use_temp_db()
+    import services
+    import app as server
+
+    try:
+        with services.get_db_connection() as conn:
+            seed_labels(conn, args.labels)
+        services.close_all_connections()
+
+        rnd = random.Random(7)
+        ids = [rnd.randint(1, args.labels) for _ in range(args.requests)]
+        client_factory = server.app.test_client
+
+        results = {}
+        for label, enabled in (("connect-per-call", False), ("pooled", True)):
+            services.DB_POOL_ENABLED = enabled
+            run_lookups(client_factory, ids[:200], args.workers, args.fresh_threads)  # warm up
+            results[label] = run_lookups(client_factory, ids, args.workers, args.fresh_threads)
+            services.close_all_connections()
+
+        print(f"GET /api/labels/<id>  labels={args.labels} requests={args.requests} "
+              f"workers={args.workers} fresh_threads={args.fresh_threads}")
+        for label, s in results.items():
+            print(f"  {label:<17} p50={s['p50']:.3f}ms p95={s['p95']:.3f}ms "
+                  f"p99={s['p99']:.3f}ms mean={s['mean']:.3f}ms  {s['req_per_s']} req/s")
+    finally:
+        services.close_all_connections()
+        remove_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
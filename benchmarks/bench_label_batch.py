@@ -0,0 +1,90 @@
+"""
+Printing a run of N identical pipes: the one-at-a-time loop the generate
+page does (POST /api/labels + POST /api/print per pipe, one print job each)
+versus a single POST /api/labels/batch (one transaction, one multi-page job).
+
+    python -m benchmarks.bench_label_batch --count 50 --send-ms 150
+
+The clock stops when every label has printed_at set, i.e. the print worker
+has rendered and "sent" everything. Nothing reaches a real printer: the send
+step is replaced by a sleep of --send-ms per job, standing in for one `lp`
+invocation (process start + CUPS spooling).
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import use_temp_db, remove_db
+
+LABEL = {"pipe_name": "Gangotry", "size": "110mm", "color": "Blue", "weight_g": 21.5,
+         "pressure": "6kgf", "operator": "Shift-A"}
+
+
+def wait_printed(services, label_ids, timeout=600):
+    placeholders = ",".join("?" * len(label_ids))
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with services.get_db_connection() as conn:
+            done = conn.execute(f"SELECT COUNT(*) FROM labels WHERE printed_at IS NOT NULL AND id IN ({placeholders})",
+                                label_ids).fetchone()[0]
+        if done == len(label_ids):
+            return
+        time.sleep(0.01)
+    raise TimeoutError("print worker did not finish")
+
+
+def one_at_a_time(client, services, count):
+    ids = []
+    for _ in range(count):
+        label = client.post('/api/labels', json=LABEL).get_json()['label']
+        client.post('/api/print', json={"id": label['id'], "pressure": LABEL['pressure']})
+        ids.append(label['id'])
+    wait_printed(services, ids)
+
+
+def batch(client, services, count):
+    res = client.post('/api/labels/batch', json=dict(LABEL, count=count)).get_json()
+    wait_printed(services, [l['id'] for l in res['labels']])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--count", type=int, default=50)
+    ap.add_argument("--send-ms", type=float, default=150.0)
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+
+    db_path = use_temp_db()
+    import services
+    import app as server
+    jobs = []
+
+    def fake_send(rendered, printer):
+        jobs.append(len(rendered) if isinstance(rendered, list) else 1)
+        time.sleep(args.send_ms / 1000)
+        return True, "benchmark"
+    server.PRINT_WORKER.send = fake_send
+    client = server.app.test_client()
+
+    try:
+        results = {"count": args.count, "send_ms": args.send_ms}
+        for name, fn in (("one_at_a_time", one_at_a_time), ("batch", batch)):
+            timings = []
+            for _ in range(args.rounds):
+                jobs.clear()
+                t0 = time.perf_counter()
+                fn(client, services, args.count)
+                timings.append(time.perf_counter() - t0)
+            best = min(timings)
+            results[name] = {"seconds": round(best, 3), "labels_per_s": round(args.count / best, 1),
+                             "print_jobs": len(jobs)}
+        results["speedup"] = round(results["batch"]["labels_per_s"] / results["one_at_a_time"]["labels_per_s"], 2)
+        print(json.dumps(results, indent=2))
+    finally:
+        server.PRINT_WORKER.stop(timeout=5)
+        services.close_all_connections()
+        remove_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
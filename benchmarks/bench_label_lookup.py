@@ -0,0 +1,70 @@
+"""
+Resolving a truck load of scanned pipes: one GET /api/labels/<id> per pipe
+(what the scan pages did) versus a single POST /api/labels/lookup, each with
+the label cache off, cold, and warm.
+
+    python -m benchmarks.bench_label_lookup --labels 200000 --scans 300
+
+Runs through Flask's test client, so the numbers are server-side cost per
+load and leave out the network; on the shop Wi-Fi every GET also pays a
+round trip, which the lookup pays once.
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.common import use_temp_db, remove_db, seed_labels
+
+
+def per_pipe(client, ids):
+    for i in ids:
+        assert client.get(f'/api/labels/{i}').status_code == 200
+
+
+def bulk(client, ids):
+    res = client.post('/api/labels/lookup', json={"ids": ids}).get_json()
+    assert len(res['labels']) == len(ids)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--labels", type=int, default=200000)
+    ap.add_argument("--scans", type=int, default=300)
+    ap.add_argument("--rounds", type=int, default=5)
+    args = ap.parse_args()
+
+    db_path = use_temp_db()
+    import services
+    import app as server
+    try:
+        with services.get_db_connection() as conn:
+            seed_labels(conn, args.labels)
+        client = server.app.test_client()
+        ids = random.Random(2).sample(range(1, args.labels + 1), args.scans)
+
+        results = {"labels": args.labels, "scans": args.scans}
+        for name, fn in (("per_pipe_get", per_pipe), ("bulk_lookup", bulk)):
+            row = {}
+            for mode in ("no_cache", "cold", "warm"):
+                services.LABEL_CACHE_ENABLED = mode != "no_cache"
+                timings = []
+                for _ in range(args.rounds):
+                    if mode != "warm":
+                        services.invalidate_labels()
+                    t0 = time.perf_counter()
+                    fn(client, ids)
+                    timings.append((time.perf_counter() - t0) * 1000)
+                row[mode + "_ms"] = round(min(timings), 2)
+            results[name] = row
+        results["speedup_no_cache"] = round(results["per_pipe_get"]["no_cache_ms"] / results["bulk_lookup"]["no_cache_ms"], 1)
+        results["cache"] = services.LABEL_CACHE.stats()
+        print(json.dumps(results, indent=2))
+    finally:
+        server.PRINT_WORKER.stop(timeout=5)
+        services.close_all_connections()
+        remove_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
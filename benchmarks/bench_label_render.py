@@ -0,0 +1,82 @@
+"""
+Labels rendered per second by printer_backend, with the cached LabelTemplate
+(fonts and static layer built once) versus building it for every label the
+way silent_print_label used to.
+
+    python -m benchmarks.bench_label_render --labels 300
+
+Run it on the Pi itself for real numbers; --single-core pins the process to
+one CPU, which is closer to the Pi than a desktop with turbo and many cores.
+Only rendering is timed, nothing is sent to a printer.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import time
+
+from benchmarks.common import BRANDS, SIZES, COLORS, PRESSURES, percentiles
+
+
+def sample_labels(count):
+    return [{
+        "id": 100000 + i, "pipe_name": BRANDS[i % len(BRANDS)], "size": SIZES[i % len(SIZES)],
+        "color": COLORS[i % len(COLORS)], "pressure": PRESSURES[i % len(PRESSURES)] if i % 5 else "",
+        "operator": "Shift-A", "batch": f"#{i + 1}", "created_at": "2026-01-01T10:30:00",
+    } for i in range(count)]
+
+
+def run(render, labels):
+    samples = []
+    t_start = time.perf_counter()
+    for label in labels:
+        t0 = time.perf_counter()
+        render(label)
+        samples.append((time.perf_counter() - t0) * 1000)
+    wall = time.perf_counter() - t_start
+    stats = percentiles(samples)
+    stats["labels_per_s"] = round(len(labels) / wall, 1)
+    return stats
+
+
+def render_codes(label):
+    import barcode
+    import qrcode
+    from barcode.writer import ImageWriter
+    qrcode.make(json.dumps({"id": label["id"]})).resize((200, 200))
+    buffer = io.BytesIO()
+    barcode.get_barcode_class('code128')(str(label["id"]), writer=ImageWriter()).write(
+        buffer, options={"write_text": False, "module_height": 5.0, "quiet_zone": 1.0})
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--labels", type=int, default=300)
+    ap.add_argument("--single-core", action="store_true")
+    args = ap.parse_args()
+
+    if args.single_core and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {sorted(os.sched_getaffinity(0))[0]})
+
+    import printer_backend
+    labels = sample_labels(args.labels)
+    printer_backend.render_label(labels[0])  # warm-up: imports, first template build
+
+    results = {
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "labels": args.labels,
+        "per_label_template": run(lambda l: printer_backend.LabelTemplate().render(l), labels),
+        "cached_template": run(printer_backend.render_label, labels),
+        # Where the remaining time goes
+        "template_build_only": run(lambda l: printer_backend.LabelTemplate(), labels[:50]),
+        "qr_and_barcode_only": run(render_codes, labels),
+    }
+    results["speedup"] = round(results["cached_template"]["labels_per_s"] /
+                               results["per_label_template"]["labels_per_s"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
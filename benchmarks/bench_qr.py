@@ -0,0 +1,98 @@
+"""
+QR work per created label: the old path (qrcode.make -> PNG -> base64 inline
+in the POST /api/labels response, then a second qrcode.make + PIL resize for
+the print) against qr_codes (one matrix per label, the /api/labels/<id>/qr.png
+preview and the label bitmap both scaled from it with NumPy).
+
+    python -m benchmarks.bench_qr --labels 500
+
+Also checks that every new label bitmap is pixel-identical to the old
+qrcode.make(...).resize() output.
+"""
+import argparse
+import base64
+import io
+import json
+import time
+
+import numpy as np
+import qrcode
+
+from benchmarks.common import use_temp_db, remove_db
+
+
+def old_preview(label):
+    qr_img = qrcode.make(json.dumps({"id": label["id"], "created_at": label["created_at"]}))
+    buf = io.BytesIO()
+    qr_img.save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def old_print_qr(label, size):
+    return qrcode.make(json.dumps({"id": label["id"]})).resize(size)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--labels", type=int, default=500)
+    args = ap.parse_args()
+
+    db_path = use_temp_db()
+    import services
+    import qr_codes
+    import printer_backend
+    import app as server
+    try:
+        size = printer_backend.LABEL_LAYOUT["qr"]["size"]
+        client = server.app.test_client()
+        payload = {"pipe_name": "Gangotry", "size": "110mm", "color": "Blue", "weight_g": 21.5,
+                   "operator": "Shift-A", "batch": "#1", "pressure": "6kgf"}
+        labels = [client.post("/api/labels", json=payload).get_json()["label"] for _ in range(args.labels)]
+
+        t0 = time.perf_counter()
+        old_sizes = []
+        for label in labels:
+            body = json.dumps({"success": True, "label": label, "qr_image": old_preview(label)})
+            old_sizes.append(len(body))
+            old_print_qr(label, size)
+        old_ms = (time.perf_counter() - t0) * 1000 / len(labels)
+
+        qr_codes.QR_CACHE.clear()
+        t0 = time.perf_counter()
+        new_sizes = []
+        for label in labels:
+            body = json.dumps({"success": True, "label": label, "qr_url": f"/api/labels/{label['id']}/qr.png"})
+            new_sizes.append(len(body))
+            png = qr_codes.qr_png(qr_codes.label_payload(label["id"]))     # browser fetches the preview
+            qr_codes.qr_bitmap(qr_codes.label_payload(label["id"]), size)  # print worker, cache hit
+        new_ms = (time.perf_counter() - t0) * 1000 / len(labels)
+
+        t0 = time.perf_counter()
+        for label in labels:
+            qr_codes.qr_png(qr_codes.label_payload(label["id"]))
+        warm_preview_ms = (time.perf_counter() - t0) * 1000 / len(labels)
+
+        res = client.get(f"/api/labels/{labels[0]['id']}/qr.png")
+        identical = sum(
+            np.array_equal(np.array(old_print_qr(label, size)),
+                           np.array(qr_codes.qr_bitmap(qr_codes.label_payload(label["id"]), size)))
+            for label in labels)
+
+        print(json.dumps({
+            "labels": len(labels),
+            "old": {"create_response_bytes": round(sum(old_sizes) / len(old_sizes)), "qr_ms_per_label": round(old_ms, 3)},
+            "new": {"create_response_bytes": round(sum(new_sizes) / len(new_sizes)),
+                    "preview_png_bytes": len(png), "qr_ms_per_label": round(new_ms, 3),
+                    "warm_preview_ms": round(warm_preview_ms, 3)},
+            "qr_png_response": {"status": res.status_code, "cache_control": res.headers.get("Cache-Control")},
+            "identical_print_bitmaps": f"{identical}/{len(labels)}",
+            "cache": qr_codes.QR_CACHE.stats(),
+        }, indent=2))
+    finally:
+        server.PRINT_WORKER.stop(timeout=5)
+        services.close_all_connections()
+        remove_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Dev server (python app.py: Werkzeug, one thread per connection) against
+serve.py (waitress, fixed thread pool, keep-alive), each run as its own
+process on the same seeded database.
+
+    python -m benchmarks.bench_serving --labels 200000 --clients 1 8 32 64 --seconds 5
+
+Per server:
+  load        SERVING_MIX (scanner traffic, label GETs, cached stats) at each --clients
+              count: p50/p95/p99, requests/s, errors, peak server threads
+  keepalive   --keepalive-requests GETs over one client connection; the dev
+              server speaks HTTP/1.0 and needs a new connection every time
+  streams     --streams open /api/events connections (open pages), then 8
+              clients on GET /api/counter: how many streams got a thread,
+              and what that did to ordinary requests
+  shutdown    seconds from SIGTERM until the process exited, streams open
+"""
+import argparse
+import ast
+import http.client
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.common import use_temp_db, remove_db, seed_labels, seed_shipments, percentiles
+from benchmarks.loadgen import Context, drive
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Requests that are cheap for the database (scanners, scan pages, cached
+# stats), so the server, not SQLite, is what gets measured. The full MIX
+# writes labels, and every write makes the next stats request recompute.
+SERVING_MIX = {
+    "POST /api/esp/push": 30,
+    "GET /api/esp/fetch": 30,
+    "GET /api/labels/<id>": 30,
+    "GET /api/stats_summary": 10,
+}
+
+SERVERS = {
+    "dev": lambda port, threads: [sys.executable, "-c",
+                                  f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+    "waitress": lambda port, threads: [sys.executable, "serve.py", "--host", "127.0.0.1",
+                                       "--port", str(port), "--threads", str(threads)],
+}
+
+
+def admin_pass():
+    """ADMIN_PASS from app.py, read without importing it (that would start its services here)."""
+    with open(os.path.join(ROOT, "app.py"), encoding="utf-8") as f:
+        for node in ast.parse(f.read()).body:
+            if isinstance(node, ast.Assign) and getattr(node.targets[0], "id", None) == "ADMIN_PASS":
+                return node.value.value
+
+
+def start_server(kind, port, threads, env):
+    proc = subprocess.Popen(SERVERS[kind](port, threads), cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/counter", timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not come up on port {port}")
+
+
+class ThreadSampler:
+    """Peak thread count of a process while a phase runs (Linux /proc)."""
+
+    def __init__(self, pid):
+        self.path = f"/proc/{pid}/status"
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.1):
+            try:
+                with open(self.path) as f:
+                    for line in f:
+                        if line.startswith("Threads:"):
+                            self.peak = max(self.peak or 0, int(line.split()[1]))
+            except OSError:
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def keepalive_run(port, count):
+    samples = []
+    connects = 0
+    conn = None
+    start = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            connects += 1
+        conn.request("GET", f"/api/labels/{i % 1000 + 1}")
+        res = conn.getresponse()
+        res.read()
+        if res.will_close:
+            conn.close()
+            conn = None
+        samples.append((time.perf_counter() - t0) * 1000)
+    if conn:
+        conn.close()
+    result = percentiles(samples)
+    result.update(connections=connects, rps=round(count / (time.perf_counter() - start), 1))
+    return result
+
+
+def open_streams(port, count):
+    """Opens `count` /api/events streams; returns (accepted, refused, open responses)."""
+    accepted, refused, held = 0, 0, []
+    for _ in range(count):
+        try:
+            res = urllib.request.urlopen(f"http://127.0.0.1:{port}/api/events?topics=counter", timeout=5)
+            res.readline()
+            held.append(res)
+            accepted += 1
+        except urllib.error.HTTPError as e:
+            refused += e.code == 503
+        except OSError:
+            refused += 1
+    return accepted, refused, held
+
+
+def counter_load(port, clients, seconds):
+    samples, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        mine = []
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/api/counter", timeout=10).read()
+                mine.append((time.perf_counter() - t0) * 1000)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            samples.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = percentiles(samples)
+    result.update(errors=errors[0], rps=round(len(samples) / seconds, 1))
+    return result
+
+
+def bench_server(kind, port, db_path, env, args):
+    results = {}
+    proc = start_server(kind, port, args.threads, env)
+    try:
+        base = f"http://127.0.0.1:{port}"
+        results["load"] = {}
+        for clients in args.clients:
+            ctx = Context(db_path, admin_pass(), 20, f"{kind}{clients}")
+            with ThreadSampler(proc.pid) as sampler:
+                row = drive(base, ctx, SERVING_MIX, clients, args.seconds)["total"]
+            row["server_threads_peak"] = sampler.peak
+            results["load"][str(clients)] = row
+            print(f"  {kind} {clients} clients: {row['rps']} req/s, p95 {row['p95']} ms", file=sys.stderr)
+
+        results["keepalive"] = keepalive_run(port, args.keepalive_requests)
+        print(f"  {kind} keep-alive: {results['keepalive']['rps']} req/s", file=sys.stderr)
+
+        accepted, refused, held = open_streams(port, args.streams)
+        with ThreadSampler(proc.pid) as sampler:
+            row = counter_load(port, 8, args.seconds)
+        results["streams"] = {"opened": args.streams, "accepted": accepted, "refused_503": refused,
+                              "server_threads_peak": sampler.peak, "counter_under_streams": row}
+        print(f"  {kind} streams: {accepted} open, {refused} refused", file=sys.stderr)
+
+        t0 = time.perf_counter()
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+            results["shutdown_seconds"] = round(time.perf_counter() - t0, 2)
+        except subprocess.TimeoutExpired:
+            results["shutdown_seconds"] = None  # did not exit; killed below
+        results["exit_code"] = proc.returncode
+        for res in held:
+            res.close()
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--labels", type=int, default=200000)
+    ap.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32, 64])
+    ap.add_argument("--seconds", type=float, default=5.0)
+    ap.add_argument("--threads", type=int, default=24, help="serve.py --threads")
+    ap.add_argument("--streams", type=int, default=20, help="open /api/events connections")
+    ap.add_argument("--keepalive-requests", type=int, default=1000)
+    ap.add_argument("--port", type=int, default=5190)
+    ap.add_argument("--servers", nargs="+", default=list(SERVERS), choices=list(SERVERS))
+    args = ap.parse_args()
+
+    db_path = use_temp_db("pvc_serving_")
+    backup_dir = tempfile.mkdtemp(prefix="pvc_serving_backups_")
+    env = dict(os.environ, PVC_DB=db_path, PVC_BACKUP_DIR=backup_dir)
+    import services
+    try:
+        with services.get_db_connection() as conn:
+            seed_labels(conn, args.labels)
+            seed_shipments(conn)
+            conn.execute("ANALYZE main")
+        services.close_all_connections()
+        results = {"labels": args.labels, "threads": args.threads, "seconds": args.seconds}
+        for n, kind in enumerate(args.servers):
+            results[kind] = bench_server(kind, args.port + n, db_path, env, args)
+        print(json.dumps(results, indent=2))
+    finally:
+        remove_db(db_path)
+        shutil.rmtree(backup_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Creating a shipment (POST /api/shipments/create): the old per-item
+executemany UPDATE with client-side totals against the set-based
+services.create_shipment_record (temp table, one validating join, one
+aggregate, one UPDATE ... WHERE id IN (SELECT ...)).
+
+    python -m benchmarks.bench_shipments --labels 200000 --pipes 1000 --shipments 10
+
+Each run dispatches --shipments trucks of --pipes in-stock pipes. A last
+truck mixes in pipes that are already on a challan, rejected and unknown:
+the old code would dispatch them again, the new one lists them as rejected.
+"""
+import argparse
+import datetime
+import json
+import random
+import time
+
+from benchmarks.common import use_temp_db, remove_db, seed_labels, seed_shipments, percentiles
+
+
+def old_create_shipment(services, meta, items):
+    """create_shipment_record as it was: client weights, one UPDATE per item."""
+    timestamp = datetime.datetime.now().isoformat()
+    total_qty = len(items)
+    total_wt = sum(float(i['weight_g']) for i in items)
+    with services.get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO shipments (customer_name, vehicle_no, customer_address, customer_mobile, driver_mobile, challan_no, total_pipes, total_weight, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (meta.get('customer'), meta.get('vehicle'), meta.get('address'), meta.get('customer_mobile'),
+              meta.get('driver_mobile'), meta.get('challan_no'), total_qty, total_wt, timestamp))
+        shipment_id = cur.lastrowid
+        update_data = [(timestamp, 'DispatchHub', shipment_id, meta.get('challan_no'), i['id']) for i in items]
+        cur.executemany("""
+            UPDATE labels SET dispatched_at=?, dispatched_by=?, shipment_id=?, challan_no=? WHERE id=?
+        """, update_data)
+        conn.commit()
+        services.invalidate_labels([i['id'] for i in items])
+        services.bump_data_generation()
+        return shipment_id, timestamp
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--labels", type=int, default=200000)
+    ap.add_argument("--pipes", type=int, default=1000, help="pipes per shipment")
+    ap.add_argument("--shipments", type=int, default=10, help="shipments per variant")
+    args = ap.parse_args()
+
+    db_path = use_temp_db("pvc_shipments_")
+    import services
+    try:
+        conn = services.get_db_connection()
+        seed_labels(conn, args.labels)
+        seed_shipments(conn)
+        conn.execute("UPDATE labels SET dispatched_by = 'rejected' WHERE id % 97 = 0 AND dispatched_at IS NULL")
+        conn.commit()
+        conn.execute("ANALYZE main")
+        stock = [dict(r) for r in conn.execute(f"SELECT id, weight_g FROM labels l WHERE {services._SHIPPABLE}")]
+        random.Random(5).shuffle(stock)
+        needed = args.pipes * (2 * args.shipments + 1)
+        if len(stock) < needed:
+            raise SystemExit(f"only {len(stock)} pipes in stock, need {needed}: raise --labels")
+        trucks = [stock[i * args.pipes:(i + 1) * args.pipes] for i in range(2 * args.shipments + 1)]
+
+        results = {"labels": args.labels, "pipes_per_shipment": args.pipes, "shipments": args.shipments}
+        for name, create in (("old", lambda meta, items: old_create_shipment(services, meta, items)),
+                             ("new", services.create_shipment_record)):
+            offset = 0 if name == "old" else args.shipments
+            samples = []
+            for n in range(args.shipments):
+                meta = {"challan_no": f"BENCH-{name}-{n}", "vehicle": "RJ14-1"}
+                t0 = time.perf_counter()
+                create(meta, trucks[offset + n])
+                samples.append((time.perf_counter() - t0) * 1000)
+            results[name] = percentiles(samples)
+
+        # Mixed truck: fresh pipes plus pipes the old code would have dispatched twice
+        on_challan = [dict(r) for r in conn.execute(
+            "SELECT id, weight_g FROM labels WHERE shipment_id IS NOT NULL ORDER BY id LIMIT 30")]
+        rejected = [dict(r) for r in conn.execute(
+            "SELECT id, weight_g FROM labels WHERE dispatched_by = 'rejected' LIMIT 10")]
+        unknown = [{"id": args.labels * 10 + i, "weight_g": 20.0} for i in range(10)]
+        fresh = trucks[-1][:args.pipes - 50]
+        mixed = fresh + on_challan + rejected + unknown
+        outcome = services.create_shipment_record({"challan_no": "BENCH-mixed"}, mixed)
+        expected_weight = round(sum(p["weight_g"] for p in fresh), 3)
+        reasons = {}
+        for r in outcome["rejected"]:
+            reasons[r["reason"]] = reasons.get(r["reason"], 0) + 1
+        moved = conn.execute("SELECT COUNT(*) FROM labels WHERE challan_no = 'BENCH-mixed'").fetchone()[0]
+        results["mixed_truck"] = {
+            "sent": len(mixed), "dispatched": outcome["total_pipes"], "labels_on_challan": moved,
+            "weight_matches_db": round(outcome["total_weight"], 3) == expected_weight,
+            "rejected": reasons,
+        }
+        print(json.dumps(results, indent=2))
+    finally:
+        services.close_all_connections()
+        remove_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Voucher questions before and after the voucher item tables: the old
+JSON-per-voucher layout (load every voucher, json.loads its id lists)
+against the indexed lookups in services.
+
+    python -m benchmarks.bench_voucher_history --labels 200000 --returns 5000 --verifications 2000
+
+  pipe_history    every voucher one pipe appears on (--lookups random pipes)
+  missing_by_sku  how often each SKU went missing in verifications
+
+Then the migration itself: the same vouchers put back as the old JSON
+tables, services.ensure_vouchers() timed, and the return_vouchers /
+verification_vouchers views checked against the originals.
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.common import (use_temp_db, remove_db, seed_labels, seed_shipments, percentiles,
+                               seed_return_vouchers, seed_verification_vouchers)
+
+ID_LISTS = ("expected_ids", "scanned_ids", "missing_ids", "extra_ids")
+
+
+def old_pipe_history(conn, pipe_id):
+    returns = [dict(r) for r in conn.execute("SELECT * FROM legacy_return_vouchers ORDER BY id DESC")
+               if pipe_id in json.loads(r["pipe_ids_json"])]
+    checks = []
+    for r in conn.execute("SELECT * FROM legacy_verification_vouchers ORDER BY id DESC"):
+        kinds = [col[:-4] for col in ID_LISTS if pipe_id in json.loads(r[col] or "[]")]
+        if kinds:
+            checks.append(dict(r, kinds=kinds))
+    return {"returns": returns, "verifications": checks}
+
+
+def old_missing_by_sku(conn, services):
+    missing = {}
+    for r in conn.execute("SELECT missing_ids FROM legacy_verification_vouchers"):
+        for pipe_id in json.loads(r["missing_ids"] or "[]"):
+            missing[pipe_id] = missing.get(pipe_id, 0) + 1
+    counts = {}
+    for label in services.get_labels_by_ids(list(missing)).values():
+        key = (label["pipe_name"], label["size"], label["color"], label["pressure_class"])
+        counts[key] = counts.get(key, 0) + missing[label["id"]]
+    return sorted(counts.items(), key=lambda kv: -kv[1])
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return (time.perf_counter() - t0) * 1000, result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--labels", type=int, default=200000)
+    ap.add_argument("--returns", type=int, default=5000)
+    ap.add_argument("--verifications", type=int, default=2000)
+    ap.add_argument("--lookups", type=int, default=50)
+    args = ap.parse_args()
+
+    db_path = use_temp_db("pvc_vouchers_")
+    import services
+    try:
+        conn = services.get_db_connection()
+        seed_labels(conn, args.labels)
+        seed_shipments(conn)
+        seed_return_vouchers(conn, args.returns)
+        seed_verification_vouchers(conn, args.verifications)
+        conn.execute("ANALYZE main")
+        # The old layout, built from the views (same rows, same JSON)
+        conn.execute("CREATE TABLE legacy_return_vouchers AS SELECT * FROM return_vouchers")
+        conn.execute("CREATE TABLE legacy_verification_vouchers AS SELECT * FROM verification_vouchers")
+        conn.commit()
+        items = conn.execute("SELECT (SELECT COUNT(*) FROM return_voucher_items) + "
+                             "(SELECT COUNT(*) FROM verification_voucher_items)").fetchone()[0]
+
+        rnd = random.Random(11)
+        touched = [r[0] for r in conn.execute(
+            "SELECT pipe_id FROM verification_voucher_items WHERE kind = 'missing' "
+            "UNION SELECT pipe_id FROM return_voucher_items")]
+        pipes = rnd.sample(touched, min(args.lookups, len(touched)))
+
+        results = {"labels": args.labels, "returns": args.returns, "verifications": args.verifications,
+                   "voucher_items": items}
+        old_ms, new_ms, same = [], [], 0
+        for pipe_id in pipes:
+            ms_old, old = timed(old_pipe_history, conn, pipe_id)
+            ms_new, new = timed(services.get_pipe_voucher_history, pipe_id)
+            old_ms.append(ms_old)
+            new_ms.append(ms_new)
+            same += ([v["id"] for v in old["returns"]] == [v["id"] for v in new["returns"]]
+                     and [(v["id"], v["kinds"]) for v in old["verifications"]]
+                     == [(v["id"], v["kinds"]) for v in new["verifications"]])
+        results["pipe_history"] = {"old": percentiles(old_ms), "new": percentiles(new_ms),
+                                   "same_answer": f"{same}/{len(pipes)}"}
+
+        ms_old, old = timed(old_missing_by_sku, conn, services)
+        ms_new, new = timed(services.get_missing_by_sku, None, 1000000)
+        new_counts = {(r["pipe_name"], r["size"], r["color"], r["pressure_class"]): r["missing"] for r in new}
+        results["missing_by_sku"] = {"old_ms": round(ms_old, 2), "new_ms": round(ms_new, 2),
+                                     "same_answer": dict(old) == new_counts}
+
+        # --- Migration: back to the JSON tables, then ensure_vouchers() ---
+        expected = {name: [dict(r) for r in conn.execute(f"SELECT * FROM {name} ORDER BY id")]
+                    for name in ("return_vouchers", "verification_vouchers")}
+        conn.execute("BEGIN IMMEDIATE")
+        for name in ("return_vouchers", "verification_vouchers"):
+            conn.execute(f"DROP VIEW {name}")
+            conn.execute(f"ALTER TABLE legacy_{name} RENAME TO {name}")
+        for table in ("return_voucher_items", "return_voucher_headers",
+                      "verification_voucher_items", "verification_voucher_headers"):
+            conn.execute(f"DELETE FROM {table}")
+        conn.commit()
+        ms, _ = timed(services.ensure_vouchers)
+        migrated = {name: [dict(r) for r in conn.execute(f"SELECT * FROM {name} ORDER BY id")] for name in expected}
+        results["migration"] = {"ms": round(ms, 1), "views_match_original": migrated == expected}
+        print(json.dumps(results, indent=2))
+    finally:
+        services.close_all_connections()
+        remove_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Checks code128 (the label barcode, drawn straight at the box size) against
+the old python-barcode ImageWriter PNG -> PIL resize, by scanning both with
+a small reference decoder, and times the two.
+
+    python -m benchmarks.check_code128 --ids 3000     # exit 1 if a new barcode misreads
+
+For every ID: does the new barcode scan as the ID (it must), does the old one,
+is the new symbol module-for-module python-barcode's, and how many grey
+(neither black nor white) pixels each one has. IDs 1..--ids plus random large
+ones. Old misreads are split into the "99" prefixed IDs python-barcode
+encoded wrongly and the ones the resize blurred.
+"""
+import argparse
+import io
+import json
+import random
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+PATTERNS = None  # value by bar/space widths, filled from code128.PATTERNS
+
+
+def decode_row(row):
+    """
+    Reference decoder: one scan line (grey 0-255) -> text, or None if it does
+    not read. Each symbol is 6 runs over 11 modules, so the module size is
+    taken per symbol, the way a scanner tolerates print growth.
+    """
+    dark = np.asarray(row) < 128
+    edges = np.flatnonzero(np.diff(dark.astype(np.int8))) + 1
+    bounds = np.concatenate(([0], edges, [len(dark)]))
+    runs = list(np.diff(bounds))
+    if dark[0]:
+        return None  # no quiet zone on the left
+    runs = runs[1:]
+
+    values = []
+    while len(runs) >= 6:
+        group, runs = runs[:6], runs[6:]
+        unit = sum(group) / 11
+        key = "".join(str(min(4, max(1, round(w / unit)))) for w in group)
+        if key == "233111":  # stop
+            break
+        if key not in PATTERNS:
+            return None
+        values.append(PATTERNS[key])
+    else:
+        return None
+    if len(values) < 2 or values[0] not in (104, 105):
+        return None  # Start A: never used for labels
+    *data, check = values
+    if (data[0] + sum(i * v for i, v in enumerate(data[1:], start=1))) % 103 != check:
+        return None
+
+    charset = "B" if data[0] == 104 else "C"
+    text = ""
+    for v in data[1:]:
+        if charset == "C" and v < 100:
+            text += f"{v:02d}"
+        elif charset == "B" and v < 96:
+            text += chr(v + 32)
+        elif (charset, v) in (("C", 100), ("B", 99)):
+            charset = "B" if v == 100 else "C"
+        else:
+            return None
+    return text
+
+
+def scan(img):
+    """Decodes the middle row of a barcode image."""
+    grey = np.array(img.convert("L"))
+    return decode_row(grey[grey.shape[0] // 2])
+
+
+def old_barcode(label_id, size):
+    import barcode
+    from barcode.writer import ImageWriter
+    buffer = io.BytesIO()
+    barcode.get_barcode_class('code128')(str(label_id), writer=ImageWriter()).write(
+        buffer, options={"write_text": False, "module_height": 5.0, "quiet_zone": 1.0})
+    buffer.seek(0)
+    return Image.open(buffer).resize(size)
+
+
+def grey_share(img):
+    grey = np.array(img.convert("L"))
+    return float(np.mean((grey > 0) & (grey < 255)))
+
+
+def main():
+    global PATTERNS
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--ids", type=int, default=3000)
+    ap.add_argument("--random", type=int, default=1000, help="extra random IDs up to 10^9")
+    args = ap.parse_args()
+
+    import barcode
+    import code128
+    import printer_backend
+    PATTERNS = {p: v for v, p in enumerate(code128.PATTERNS)}
+    size = printer_backend.LABEL_LAYOUT["barcode"]["size"]
+
+    rnd = random.Random(7)
+    ids = list(range(1, args.ids + 1)) + [rnd.randrange(10 ** 9) for _ in range(args.random)]
+    results = {"ids": len(ids), "new_reads": 0, "old_reads": 0, "same_symbol_as_python_barcode": 0,
+               "old_misread_99_prefix": 0, "old_misread_other": 0, "new_misreads": []}
+    old_grey, new_grey = [], []
+    for label_id in ids:
+        text = str(label_id)
+        new = code128.barcode_bitmap(label_id, size)
+        old = old_barcode(label_id, size)
+        if scan(new) == text:
+            results["new_reads"] += 1
+        else:
+            results["new_misreads"].append(label_id)
+        if scan(old) == text:
+            results["old_reads"] += 1
+        elif text.startswith("99"):
+            results["old_misread_99_prefix"] += 1
+        else:
+            results["old_misread_other"] += 1  # resampling smeared a bar past the threshold
+        symbol = "".join("1" if b else "0" for b in code128.modules(label_id))
+        results["same_symbol_as_python_barcode"] += symbol == barcode.get('code128', text).build()[0]
+        old_grey.append(grey_share(old))
+        new_grey.append(grey_share(new))
+
+    # The barcode box of a whole rendered label must scan too
+    label = {"id": 1234567, "pipe_name": "Gangotry", "size": "110mm", "color": "Blue", "operator": "Shift-A",
+             "batch": "#12", "created_at": "2026-01-01T10:30:00", "pressure": "6kgf"}
+    (bx, by), (bw, bh) = printer_backend.LABEL_LAYOUT["barcode"]["xy"], size
+    page = printer_backend.render_label(label)
+    results["label_barcode_reads"] = scan(page.crop((bx, by, bx + bw, by + bh))) == "1234567"
+
+    sample = ids[:500]
+    t0 = time.perf_counter()
+    for label_id in sample:
+        old_barcode(label_id, size)
+    old_ms = (time.perf_counter() - t0) * 1000 / len(sample)
+    t0 = time.perf_counter()
+    for label_id in sample:
+        code128.barcode_bitmap(label_id, size)
+    new_ms = (time.perf_counter() - t0) * 1000 / len(sample)
+
+    results["grey_pixel_share"] = {"old": round(float(np.mean(old_grey)), 4), "new": round(float(np.mean(new_grey)), 4)}
+    results["ms_per_barcode"] = {"old": round(old_ms, 3), "new": round(new_ms, 3)}
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if results["new_misreads"] or not results["label_barcode_reads"] else 0)
+
+
+if __name__ == "__main__":
+    main()
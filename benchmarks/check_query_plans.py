@@ -0,0 +1,128 @@
+"""
+Query-plan regression check for services.build_where_clause.
+
+For every report_type / status / date-filter combination this
+  1. runs EXPLAIN QUERY PLAN on the count, detail and grouped queries and
+     fails if any of them falls back to a bare full scan of `labels`, and
+  2. checks that the rows matched are exactly the ones the old
+     date(col)/strftime() predicates matched.
+
+    python -m benchmarks.check_query_plans            # exits 1 on regression
+    python -m benchmarks.check_query_plans --verbose  # print every plan
+"""
+import argparse
+import datetime
+import itertools
+import sys
+
+from benchmarks.common import use_temp_db, remove_db, seed_labels
+
+REPORT_TYPES = ["inventory", "production", "dispatch"]
+STATUSES = ["", "stock", "dispatched", "rejected"]
+TIME_RANGES = ["", "09-17", "20-08"]
+
+
+def legacy_where_clause(args):
+    """The pre-index implementation, kept here as the semantic reference."""
+    conditions = ["1=1"]; params = []
+    for key, col in (('name', 'pipe_name'), ('size', 'size'), ('color', 'color'), ('pressure', 'pressure_class')):
+        if args.get(key): conditions.append(f"{col}=?"); params.append(args.get(key))
+    if args.get('weight'): conditions.append("weight_g = ?"); params.append(args.get('weight'))
+    report_type = args.get('report_type', 'inventory')
+    target_date = args.get('date'); from_date = args.get('from_date'); to_date = args.get('to_date')
+    time_range = args.get('time_range'); status = args.get('status')
+    if target_date and report_type == 'inventory':
+        if status == 'stock':
+            conditions += ["date(created_at) <= ?", "(dispatched_at IS NULL OR date(dispatched_at) > ?)",
+                           "(dispatched_by IS NULL OR dispatched_by != 'rejected')"]
+            params += [target_date, target_date]
+        elif status == 'dispatched':
+            conditions += ["date(dispatched_at) = ?", "(dispatched_by IS NULL OR dispatched_by != 'rejected')"]
+            params.append(target_date)
+        elif status == 'rejected':
+            conditions += ["dispatched_by = 'rejected'", "date(created_at) <= ?"]; params.append(target_date)
+        else:
+            conditions.append("date(created_at) <= ?"); params.append(target_date)
+    else:
+        if status == 'stock': conditions.append("dispatched_at IS NULL AND (dispatched_by IS NULL OR dispatched_by != 'rejected')")
+        elif status == 'dispatched': conditions.append("dispatched_at IS NOT NULL AND (dispatched_by IS NULL OR dispatched_by != 'rejected')")
+        elif status == 'rejected': conditions.append("dispatched_by = 'rejected'")
+        f = "dispatched_at" if report_type == 'dispatch' else "created_at"
+        if from_date and to_date:
+            conditions.append(f"date({f}) >= ? AND date({f}) <= ?"); params += [from_date, to_date]
+        elif target_date:
+            conditions.append(f"date({f}) = ?"); params.append(target_date)
+    if time_range:
+        f = "dispatched_at" if (report_type == 'dispatch' or status == 'dispatched') else "created_at"
+        s, e = map(int, time_range.split('-'))
+        op = "AND" if s < e else "OR"
+        conditions.append(f"(CAST(strftime('%H', {f}) AS INT) >= ? {op} CAST(strftime('%H', {f}) AS INT) < ?)")
+        params += [s, e]
+    if report_type == 'dispatch': conditions.append("dispatched_at IS NOT NULL")
+    return " AND ".join(conditions), params
+
+
+def combinations(day):
+    week_ago = (datetime.date.fromisoformat(day) - datetime.timedelta(days=7)).isoformat()
+    date_modes = [{"date": day}, {"from_date": week_ago, "to_date": day}, {"from_date": day, "to_date": day}]
+    for report_type, status, time_range, dates in itertools.product(REPORT_TYPES, STATUSES, TIME_RANGES, date_modes):
+        args = {"report_type": report_type, "status": status, "time_range": time_range, **dates}
+        yield {k: v for k, v in args.items() if v}
+
+
+def full_scans(conn, sql, params):
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    return plan, [p for p in plan if p.strip() == "SCAN labels"]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--labels", type=int, default=20000)
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+
+    db_path = use_temp_db("pvc_plans_")
+    import services
+    failures = 0
+    try:
+        conn = services.get_db_connection()
+        seed_labels(conn, args.labels, days=60)
+        conn.execute("UPDATE labels SET dispatched_by = 'rejected' WHERE id % 37 = 0")
+        conn.commit()
+        conn.execute("ANALYZE main")
+
+        day = (datetime.date.today() - datetime.timedelta(days=3)).isoformat()
+        checked = 0
+        for combo in combinations(day):
+            where, params = services.build_where_clause(combo)
+            queries = {
+                "count": f"SELECT COUNT(*) FROM labels WHERE {where}",
+                "detail": f"SELECT * FROM labels WHERE {where} ORDER BY created_at DESC LIMIT 100",
+                "grouped": f"SELECT pipe_name, size, COUNT(*) FROM labels WHERE {where} "
+                           f"GROUP BY pipe_name, size, color, pressure_class, weight_g",
+            }
+            for name, sql in queries.items():
+                plan, scans = full_scans(conn, sql, params)
+                if args.verbose:
+                    print(f"{combo} [{name}]\n    " + "\n    ".join(plan))
+                if scans:
+                    failures += 1
+                    print(f"FULL SCAN  {combo} [{name}]\n    " + "\n    ".join(plan))
+
+            new_ids = {r[0] for r in conn.execute(f"SELECT id FROM labels WHERE {where}", params)}
+            old_where, old_params = legacy_where_clause(combo)
+            old_ids = {r[0] for r in conn.execute(f"SELECT id FROM labels WHERE {old_where}", old_params)}
+            if new_ids != old_ids:
+                failures += 1
+                print(f"MISMATCH   {combo}: {len(old_ids)} rows before, {len(new_ids)} now")
+            checked += 1
+
+        print(f"{checked} filter combinations checked, {failures} failure(s)")
+    finally:
+        services.close_all_connections()
+        remove_db(db_path)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
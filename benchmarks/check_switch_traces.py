@@ -0,0 +1,108 @@
+"""
+Replays limit-switch traces through limit_switch.SwitchStateMachine and
+checks the number of pipes counted against each trace's "# expect:" line.
+
+    python -m benchmarks.check_switch_traces                 # all of benchmarks/traces, exit 1 on failure
+    python -m benchmarks.check_switch_traces my_trace.txt --lockout-s 5
+    python -m benchmarks.check_switch_traces --realtime      # through SimulatedGPIO + the listener thread
+
+Trace files hold "<milliseconds> <0|1>" lines (set SWITCH_TRACE_FILE in
+app.py to record real ones on the Pi). "# config: debounce_ms=.. lockout_s=..
+release_settle_s=.." sets the machine up; command-line options override it.
+Default replay is in virtual time (instant); --realtime plays the trace with
+sleeps against the real listener thread.
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import sys
+import time
+
+import limit_switch
+
+TRACE_DIR = os.path.join(os.path.dirname(__file__), "traces")
+
+
+def read_header(path):
+    config, expect = {}, None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("# config:"):
+                for pair in line[len("# config:"):].split():
+                    key, value = pair.split("=")
+                    config[key] = float(value)
+            elif line.startswith("# expect:"):
+                expect = int(line[len("# expect:"):])
+    return config, expect
+
+
+def make_machine(config):
+    return limit_switch.SwitchStateMachine(
+        debounce_ms=config.get("debounce_ms", limit_switch.DEBOUNCE_MS),
+        lockout_s=config.get("lockout_s", limit_switch.LOCKOUT_SECONDS),
+        release_settle_s=config.get("release_settle_s", limit_switch.RELEASE_SETTLE_SECONDS))
+
+
+def run_virtual(trace, config):
+    triggers, machine = limit_switch.simulate(trace, make_machine(config))
+    return [round(t, 3) for t in triggers], machine.snapshot()
+
+
+def run_realtime(trace, config, speed):
+    gpio = limit_switch.SimulatedGPIO()
+    fired = []
+
+    def on_trigger():
+        fired.append(time.monotonic())
+        return True
+    listener = limit_switch.LimitSwitchListener(gpio, 17, on_trigger, machine=make_machine(config))
+    with contextlib.redirect_stdout(sys.stderr):  # keep stdout pure JSON
+        listener.start()
+    start = time.monotonic()
+    gpio.replay(17, trace, speed)
+    # let the last debounce/settle timers run out
+    tail = (config.get("debounce_ms", limit_switch.DEBOUNCE_MS) / 1000.0 +
+            config.get("release_settle_s", limit_switch.RELEASE_SETTLE_SECONDS)) / speed
+    time.sleep(tail + 0.1)
+    listener.stop(timeout=1)
+    triggers = [round((t - start) * speed, 3) for t in fired]
+    return triggers, listener.machine.snapshot()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("traces", nargs="*")
+    ap.add_argument("--debounce-ms", type=float)
+    ap.add_argument("--lockout-s", type=float)
+    ap.add_argument("--release-settle-s", type=float)
+    ap.add_argument("--realtime", action="store_true")
+    ap.add_argument("--speed", type=float, default=1.0, help="realtime playback speed-up (timings scale too)")
+    args = ap.parse_args()
+
+    paths = args.traces or sorted(glob.glob(os.path.join(TRACE_DIR, "*.txt")))
+    overrides = {k: v for k, v in (("debounce_ms", args.debounce_ms), ("lockout_s", args.lockout_s),
+                                   ("release_settle_s", args.release_settle_s)) if v is not None}
+    failed = 0
+    results = {}
+    for path in paths:
+        config, expect = read_header(path)
+        config.update(overrides)
+        trace = limit_switch.load_trace(path)
+        if args.realtime:
+            # scale the windows with the playback speed so the outcome is unchanged
+            scaled = {k: v / args.speed for k, v in config.items()}
+            triggers, snapshot = run_realtime(trace, scaled, args.speed)
+        else:
+            triggers, snapshot = run_virtual(trace, config)
+        ok = expect is None or bool(overrides) or len(triggers) == expect
+        failed += not ok
+        results[os.path.basename(path)] = {"ok": ok, "expect": expect, "triggers_at_s": triggers, "machine": snapshot}
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Golden-file check for printer_backend.render_zpl(): renders a fixed set of
+labels and compares the ZPL byte-for-byte with benchmarks/golden/*.zpl.
+
+    python -m benchmarks.check_zpl_golden            # exit 1 on any difference
+    python -m benchmarks.check_zpl_golden --update   # after an intended change
+
+Review the diff of the golden files (and a test print) before committing an
+update: they are exactly what the printer receives.
+"""
+import argparse
+import difflib
+import os
+import sys
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+
+BASE = {"pipe_name": "Gangotry", "size": "110mm", "color": "Blue", "operator": "Shift-A",
+        "batch": "#12", "created_at": "2026-01-01T10:30:00", "pressure": "6kgf"}
+
+CASES = {
+    "label_basic": dict(BASE, id=1),
+    "label_no_pressure": dict(BASE, id=4821, pressure=""),
+    "label_large_id": dict(BASE, id=1234567, pipe_name="KissanGreen", size="200mm", color="Grey"),
+    # ^ ~ _ are ZPL control characters and must arrive as ^FH hex escapes
+    "label_special_chars": dict(BASE, id=77, pipe_name="Ultra^Plast_~", operator="A_B"),
+}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--update", action="store_true")
+    args = ap.parse_args()
+
+    import printer_backend
+    failed = 0
+    for name, label in CASES.items():
+        path = os.path.join(GOLDEN_DIR, name + ".zpl")
+        actual = printer_backend.render_zpl(label).decode("utf-8")
+        if args.update:
+            os.makedirs(GOLDEN_DIR, exist_ok=True)
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                f.write(actual)
+            print(f"updated  {name}")
+            continue
+        try:
+            with open(path, encoding="utf-8", newline="") as f:
+                expected = f.read()
+        except FileNotFoundError:
+            expected = ""
+        if actual == expected:
+            print(f"ok       {name}")
+            continue
+        failed += 1
+        print(f"MISMATCH {name}")
+        sys.stdout.writelines(difflib.unified_diff(expected.splitlines(True), actual.splitlines(True),
+                                                   "golden/" + name + ".zpl", "render_zpl()"))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
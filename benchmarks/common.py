@@ -0,0 +1,141 @@
+"""Shared helpers for the benchmark scripts."""
+import json
+import os
+import random
+import statistics
+import tempfile
+import datetime
+
+BRANDS = ["Gangotry", "UltraPlast", "KissanGreen", "Casing"]
+SIZES = ["63mm", "75mm", "90mm", "110mm", "140mm", "160mm", "180mm", "200mm"]
+COLORS = ["Blue", "Grey"]
+PRESSURES = ["4kgf", "6kgf", "10kgf"]
+
+
+def use_temp_db(prefix="pvc_bench_"):
+    """Points PVC_DB at a fresh temp file. Call BEFORE importing services/app."""
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=".db")
+    os.close(fd)
+    os.remove(path)
+    os.environ["PVC_DB"] = path
+    return path
+
+
+def remove_db(path):
+    base = os.path.splitext(path)[0]
+    archive = base + "_archive.db"  # services.ARCHIVE_DB next to it
+    for name in (path, path + "-wal", path + "-shm", archive, archive + "-journal",
+                 base + ".lock"):  # app.SERVICES_LOCK_FILE
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+
+
+def seed_labels(conn, count, days=365, dispatched_ratio=0.6, seed=1):
+    """Bulk inserts `count` synthetic labels spread over the last `days` days."""
+    rnd = random.Random(seed)
+    now = datetime.datetime.now()
+    rows = []
+    for i in range(count):
+        created = now - datetime.timedelta(seconds=rnd.randint(0, days * 86400))
+        dispatched_at = dispatched_by = None
+        if rnd.random() < dispatched_ratio:
+            dispatched_at = (created + datetime.timedelta(hours=rnd.randint(1, 240))).isoformat()
+            dispatched_by = "DispatchHub"
+        rows.append((
+            rnd.choice(BRANDS), rnd.choice(SIZES), rnd.choice(COLORS),
+            round(rnd.uniform(10, 40), 1), "6m", f"#{i % 500 + 1}", "Shift-A",
+            created.isoformat(), created.isoformat(), dispatched_at, dispatched_by,
+            rnd.choice(PRESSURES),
+        ))
+        if len(rows) >= 50000:
+            _insert_labels(conn, rows)
+            rows = []
+    if rows:
+        _insert_labels(conn, rows)
+    conn.commit()
+
+
+def _insert_labels(conn, rows):
+    conn.executemany("""
+        INSERT INTO labels (pipe_name, size, color, weight_g, length_m, batch, operator,
+                            created_at, printed_at, dispatched_at, dispatched_by, pressure_class)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+    """, rows)
+
+
+def percentiles(samples_ms):
+    """Returns p50/p95/p99/mean (milliseconds) for a list of samples."""
+    if not samples_ms:
+        return {"p50": 0, "p95": 0, "p99": 0, "mean": 0, "n": 0}
+    ordered = sorted(samples_ms)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 3)
+    return {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99),
+            "mean": round(statistics.fmean(ordered), 3), "n": len(ordered)}
+
+
+def seed_shipments(conn, per_shipment=200):
+    """Groups the dispatched labels into shipments of ~per_shipment pipes."""
+    conn.execute("""
+        UPDATE labels SET shipment_id = id / ? + 1, challan_no = 'CH-' || (id / ? + 1)
+        WHERE dispatched_at IS NOT NULL
+    """, (per_shipment, per_shipment))
+    conn.execute("""
+        INSERT INTO shipments (id, customer_name, vehicle_no, challan_no, total_pipes, total_weight, created_at)
+        SELECT shipment_id, 'Customer ' || shipment_id, 'RJ14-' || shipment_id, 'CH-' || shipment_id,
+               COUNT(*), SUM(weight_g), MAX(dispatched_at)
+        FROM labels WHERE shipment_id IS NOT NULL GROUP BY shipment_id
+    """)
+    conn.commit()
+
+
+def seed_return_vouchers(conn, count, per_voucher=5, seed=3):
+    """
+    `count` return vouchers of `per_voucher` pipes each. The pipes are taken
+    from stock, as a processed return leaves them (dispatch fields cleared).
+    Written to the voucher header/item tables (services.ensure_vouchers).
+    """
+    rnd = random.Random(seed)
+    stock = [r[0] for r in conn.execute(
+        "SELECT id FROM labels WHERE dispatched_at IS NULL ORDER BY id LIMIT ?", (count * per_voucher,))]
+    challans = [r[0] for r in conn.execute("SELECT challan_no FROM shipments LIMIT 1000")] or ["Unknown"]
+    now = datetime.datetime.now()
+    for n in range(count):
+        ids = stock[n * per_voucher:(n + 1) * per_voucher]
+        if not ids:
+            break
+        created = now - datetime.timedelta(seconds=rnd.randint(0, 365 * 86400))
+        cur = conn.execute("""
+            INSERT INTO return_voucher_headers (created_at, total_pipes, challan_source) VALUES (?,?,?)
+        """, (created.isoformat(), len(ids), rnd.choice(challans)))
+        conn.executemany("INSERT INTO return_voucher_items (voucher_id, position, pipe_id) VALUES (?,?,?)",
+                         [(cur.lastrowid, k, pipe_id) for k, pipe_id in enumerate(ids)])
+    conn.commit()
+
+
+def seed_verification_vouchers(conn, count, per_voucher=100, seed=4):
+    """`count` stock checks over `per_voucher` in-stock pipes, a few missing and extra each."""
+    rnd = random.Random(seed)
+    stock = [r[0] for r in conn.execute("SELECT id FROM labels WHERE dispatched_at IS NULL")]
+    if not stock:
+        return
+    now = datetime.datetime.now()
+    for _ in range(count):
+        expected = rnd.sample(stock, min(per_voucher, len(stock)))
+        missing = expected[:rnd.randint(0, 3)]
+        extra = rnd.sample(stock, rnd.randint(0, 2))
+        scanned = expected[len(missing):] + extra
+        created = now - datetime.timedelta(seconds=rnd.randint(0, 365 * 86400))
+        cur = conn.execute("""
+            INSERT INTO verification_voucher_headers
+            (created_at, filter_info, expected_count, scanned_count, missing_count, extra_count, notes)
+            VALUES (?,?,?,?,?,?,?)
+        """, (created.isoformat(), json.dumps({"size": rnd.choice(SIZES), "status": "stock"}),
+              len(expected), len(scanned), len(missing), len(extra), ""))
+        lists = {"expected": expected, "scanned": scanned, "missing": missing, "extra": extra}
+        conn.executemany("INSERT INTO verification_voucher_items (voucher_id, kind, position, pipe_id) VALUES (?,?,?,?)",
+                         [(cur.lastrowid, kind, k, pipe_id) for kind, ids in lists.items() for k, pipe_id in enumerate(ids)])
+    conn.commit()
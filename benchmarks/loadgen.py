@@ -0,0 +1,415 @@
+"""
+Load generator for the HTTP API. It seeds a synthetic factory database
+(labels over a year, shipments, return and verification vouchers). It then
+starts the real app on a local port and drives it with concurrent clients.
+
+    python -m benchmarks.loadgen --labels 2000000 --clients 8 --seconds 20
+    python -m benchmarks.loadgen --db /tmp/year.db        # seeds once, reused on later runs
+    python -m benchmarks.loadgen --db /tmp/year.db --url http://127.0.0.1:8000 --admin-pass ...
+    python -m benchmarks.loadgen --compare old.json new.json
+
+Each endpoint first runs alone ("isolated") with --clients clients for
+--seconds. All of them then run together in the MIX of a busy dispatch
+shift ("mixed"). The results are written to benchmarks/results/ (or --out)
+as JSON. Per endpoint they hold p50/p95/p99 latency in ms, requests/s and
+error counts.
+
+Every request opens a new connection, as the scan pages do against the
+dev server. The printer is stubbed in-process: the print worker "sends" a
+job by sleeping --send-ms. With --url the server is started elsewhere, e.g.
+on another WSGI server, and /api/print reaches whatever printer it has.
+Use --skip "POST /api/print" there. --db must then name the database that
+server runs on; label ids are read from it.
+"""
+import argparse
+import base64
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.common import (use_temp_db, remove_db, seed_labels, seed_shipments,
+                               seed_return_vouchers, seed_verification_vouchers,
+                               percentiles, SIZES, BRANDS, COLORS, PRESSURES)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+REQUEST_TIMEOUT = 30
+
+# A dispatch shift: scanners and scan pages dominate, labels trickle in
+# from the generate page, a truck leaves now and then, the office watches.
+MIX = {
+    "POST /api/esp/push": 30,
+    "GET /api/esp/fetch": 30,
+    "POST /api/labels": 8,
+    "POST /api/print": 8,
+    "GET /api/inventory": 8,
+    "GET /api/stats_summary": 8,
+    "POST /api/shipments/create": 2,
+}
+
+
+class Context:
+    """What the request builders share: label ids, the stock pool, auth."""
+
+    def __init__(self, db_path, admin_pass, shipment_pipes, run_tag):
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            self.max_id = conn.execute("SELECT MAX(id) FROM labels").fetchone()[0] or 1
+            self.stock = conn.execute(
+                "SELECT id, weight_g FROM labels WHERE dispatched_at IS NULL").fetchall()
+        finally:
+            conn.close()
+        random.Random(5).shuffle(self.stock)
+        self.auth = "Basic " + base64.b64encode(f"admin:{admin_pass}".encode()).decode()
+        self.shipment_pipes = shipment_pipes
+        self.run_tag = run_tag
+        self._lock = threading.Lock()
+        self._shipments = 0
+
+    def take_stock(self):
+        """Pipes for one truck, never handed out twice, or None when stock ran out."""
+        with self._lock:
+            if len(self.stock) < self.shipment_pipes:
+                return None
+            items = self.stock[-self.shipment_pipes:]
+            del self.stock[-self.shipment_pipes:]
+            self._shipments += 1
+            return items, f"LOAD-{self.run_tag}-{self._shipments}"
+
+
+# --- REQUEST BUILDERS ---
+# (ctx, rnd, client_no) -> (method, path, json body or None, admin?) or None to skip
+def req_create_label(ctx, rnd, client):
+    return "POST", "/api/labels", {
+        "pipe_name": rnd.choice(BRANDS), "size": rnd.choice(SIZES), "color": rnd.choice(COLORS),
+        "weight_g": round(rnd.uniform(10, 40), 1), "length_m": "6m", "batch": "#1",
+        "operator": "Load", "pressure": rnd.choice(PRESSURES)}, False
+
+
+def req_get_label(ctx, rnd, client):
+    return "GET", f"/api/labels/{rnd.randint(1, ctx.max_id)}", None, False
+
+
+def req_print(ctx, rnd, client):
+    return "POST", "/api/print", {"id": rnd.randint(1, ctx.max_id), "pressure": "6kgf",
+                                  "counter": "load"}, False
+
+
+def req_create_shipment(ctx, rnd, client):
+    taken = ctx.take_stock()
+    if taken is None:
+        return None
+    items, challan = taken
+    return "POST", "/api/shipments/create", {
+        "meta": {"customer": "Load Test", "vehicle": "RJ14-LOAD", "challan_no": challan},
+        "items": [{"id": i, "weight_g": w} for i, w in items]}, False
+
+
+def req_inventory(ctx, rnd, client):
+    today = datetime.date.today()
+    month_ago = today - datetime.timedelta(days=30)
+    quarter_ago = today - datetime.timedelta(days=90)
+    query = rnd.choice([
+        "status=stock&grouped=true",
+        f"status=stock&size={rnd.choice(SIZES)}&page=1&per_page=100",
+        f"report_type=dispatch&status=dispatched&from_date={month_ago}&to_date={today}&page=1&per_page=100",
+        f"status=stock&date={quarter_ago}&grouped=true",
+    ])
+    return "GET", "/api/inventory?" + query, None, True
+
+
+def req_stats(ctx, rnd, client):
+    return "GET", "/api/stats_summary", None, True
+
+
+def req_esp_push(ctx, rnd, client):
+    return "POST", "/api/esp/push", {"ids": [rnd.randint(1, ctx.max_id)],
+                                     "device": f"load-{client}"}, False
+
+
+def req_esp_fetch(ctx, rnd, client):
+    return "GET", f"/api/esp/fetch?consumer=load-{client}", None, False
+
+
+ENDPOINTS = {
+    "POST /api/labels": req_create_label,
+    "GET /api/labels/<id>": req_get_label,
+    "POST /api/print": req_print,
+    "POST /api/shipments/create": req_create_shipment,
+    "GET /api/inventory": req_inventory,
+    "GET /api/stats_summary": req_stats,
+    "POST /api/esp/push": req_esp_push,
+    "GET /api/esp/fetch": req_esp_fetch,
+}
+
+
+def send(base_url, method, path, body, auth):
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    if auth:
+        headers["Authorization"] = auth
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=REQUEST_TIMEOUT) as res:
+            res.read()
+            return res.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+
+
+def drive(base_url, ctx, weights, clients, seconds, seed=0):
+    """
+    Runs `clients` threads for `seconds`, each picking endpoints by `weights`.
+    Returns {endpoint: {p50, p95, p99, mean, n, errors, skipped, rps}}.
+    """
+    names = list(weights)
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    skipped = {name: 0 for name in names}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + seconds
+
+    def client(n):
+        rnd = random.Random(seed * 1000 + n)
+        mine = {name: [] for name in names}
+        failed = {name: 0 for name in names}
+        missed = {name: 0 for name in names}
+        while time.perf_counter() < deadline:
+            name = rnd.choices(names, [weights[k] for k in names])[0]
+            req = ENDPOINTS[name](ctx, rnd, n)
+            if req is None:
+                missed[name] += 1
+                if len(names) == 1:
+                    break
+                continue
+            method, path, body, admin = req
+            t0 = time.perf_counter()
+            try:
+                status = send(base_url, method, path, body, ctx.auth if admin else None)
+            except OSError:
+                status = None
+            elapsed = (time.perf_counter() - t0) * 1000
+            if status is not None and status < 400:
+                mine[name].append(elapsed)
+            else:
+                failed[name] += 1
+        with lock:
+            for name in names:
+                samples[name].extend(mine[name])
+                errors[name] += failed[name]
+                skipped[name] += missed[name]
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    results = {}
+    for name in names:
+        row = percentiles(samples[name])
+        row.update(errors=errors[name], skipped=skipped[name], rps=round(len(samples[name]) / wall, 1))
+        results[name] = row
+    if len(names) > 1:
+        everything = [ms for name in names for ms in samples[name]]
+        total = percentiles(everything)
+        total.update(errors=sum(errors.values()), rps=round(len(everything) / wall, 1))
+        results["total"] = total
+    return results
+
+
+def database_counts(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        counts = {}
+        for table in ("labels", "shipments", "return_vouchers", "verification_vouchers"):
+            try:
+                counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            except sqlite3.OperationalError:
+                counts[table] = 0
+        return counts
+    finally:
+        conn.close()
+
+
+def seed(db_path, args):
+    import services
+    started = time.perf_counter()
+    with services.get_db_connection() as conn:
+        seed_labels(conn, args.labels, days=args.days)
+        seed_shipments(conn, args.shipment_size)
+        seed_return_vouchers(conn, args.returns)
+        seed_verification_vouchers(conn, args.verifications)
+        conn.execute("ANALYZE main")
+        conn.commit()
+    services.bump_data_generation()
+    return round(time.perf_counter() - started, 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def reset_print_queue(services):
+    """
+    Counts the jobs by state, then drops the ones the stub printer has not
+    reached. /api/print queues far faster than a printer prints, and without
+    this the backlog of one phase would keep writing through the next.
+    """
+    with services.get_db_connection() as conn:
+        states = dict(conn.execute("SELECT state, COUNT(*) FROM print_jobs GROUP BY state").fetchall())
+        conn.execute("DELETE FROM print_jobs")
+    return states
+
+
+def compare(old_path, new_path):
+    """p95 and requests/s of two result files, side by side."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    out = {}
+    for phase, endpoints in new["phases"].items():
+        for name, row in endpoints.items():
+            before = old.get("phases", {}).get(phase, {}).get(name)
+            if not before:
+                continue
+            out.setdefault(phase, {})[name] = {
+                "p95_ms": [before["p95"], row["p95"]],
+                "rps": [before["rps"], row["rps"]],
+                "rps_change": round(row["rps"] / before["rps"], 2) if before["rps"] else None,
+            }
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--labels", type=int, default=200000)
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--shipment-size", type=int, default=200, help="pipes per seeded shipment")
+    ap.add_argument("--returns", type=int, default=500)
+    ap.add_argument("--verifications", type=int, default=200)
+    ap.add_argument("--db", help="database file; seeded if it has no labels yet, kept afterwards")
+    ap.add_argument("--url", help="drive a server that is already running instead of starting one")
+    ap.add_argument("--admin-pass", help="admin password for --url (defaults to the app's)")
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=10.0, help="per phase")
+    ap.add_argument("--shipment-pipes", type=int, default=50, help="pipes per shipment created under load")
+    ap.add_argument("--send-ms", type=float, default=150.0, help="stub printer time per job")
+    ap.add_argument("--skip", action="append", default=[], help='endpoint to leave out, e.g. "POST /api/print"')
+    ap.add_argument("--no-isolated", action="store_true", help="run only the mixed phase")
+    ap.add_argument("--out", help="result file (default benchmarks/results/load-<time>.json)")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = ap.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        return
+    if args.url and not (args.db and os.path.exists(args.db)):
+        ap.error("--url needs --db: the database that server runs on")
+    if args.url and not args.admin_pass:
+        ap.error("--url needs --admin-pass")
+    unknown = [name for name in args.skip if name not in ENDPOINTS]
+    if unknown:
+        ap.error(f"unknown endpoint(s) {unknown}; choose from {list(ENDPOINTS)}")
+
+    if args.db:
+        db_path = os.path.abspath(args.db)
+        os.environ["PVC_DB"] = db_path
+    else:
+        db_path = use_temp_db("pvc_load_")
+
+    meta = {"started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(), "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version, "platform": platform.platform(),
+            "clients": args.clients, "seconds_per_phase": args.seconds,
+            "shipment_pipes": args.shipment_pipes, "server": args.url or "werkzeug threaded (app.run)"}
+    server = services = httpd = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+            admin_pass = args.admin_pass
+        else:
+            from werkzeug.serving import make_server
+            import logging
+            import services
+            import app as server
+            server.BACKUP_SCHEDULER.stop()  # no snapshot in the middle of a phase
+
+            if database_counts(db_path)["labels"] == 0:
+                print(f"Seeding {args.labels} labels into {db_path} ...", file=sys.stderr)
+                meta["seed_seconds"] = seed(db_path, args)
+
+            def stub_send(rendered, printer):
+                time.sleep(args.send_ms / 1000)
+                return True, "stub"
+            server.PRINT_WORKER.send = stub_send
+            meta["send_ms"] = args.send_ms
+
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+            httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+            threading.Thread(target=httpd.serve_forever, name="loadgen-http", daemon=True).start()
+            base_url = f"http://127.0.0.1:{httpd.server_port}"
+            admin_pass = server.ADMIN_PASS
+
+        meta["database"] = database_counts(db_path)
+        ctx = Context(db_path, admin_pass, args.shipment_pipes, datetime.datetime.now().strftime("%H%M%S"))
+        endpoints = [name for name in ENDPOINTS if name not in args.skip]
+
+        phases = {}
+        print_jobs = {}
+        # the app prints on every ESP push and shipment; keep that out of the report
+        with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+            if not args.no_isolated:
+                phases["isolated"] = {}
+                for n, name in enumerate(endpoints):
+                    print(f"  {name} ...", file=sys.stderr)
+                    phases["isolated"][name] = drive(base_url, ctx, {name: 1}, args.clients, args.seconds, n)[name]
+                    if services is not None and name == "POST /api/print":
+                        print_jobs["isolated"] = reset_print_queue(services)
+            print("  mixed ...", file=sys.stderr)
+            phases["mixed"] = drive(base_url, ctx, {k: v for k, v in MIX.items() if k in endpoints},
+                                    args.clients, args.seconds, len(endpoints))
+            if server is not None:
+                server.PRINT_WORKER.stop(timeout=5)
+                print_jobs["mixed"] = reset_print_queue(services)
+
+        results = {"meta": meta, "phases": phases}
+        if "POST /api/print" in endpoints and print_jobs:
+            results["print_jobs"] = print_jobs  # per phase; "sent" is what the stub printer got through
+
+        out = args.out or os.path.join(RESULTS_DIR, f"load-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(json.dumps(results, indent=2))
+        print(f"Saved {out}", file=sys.stderr)
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+        if server is not None:
+            server.PRINT_WORKER.stop(timeout=5)
+        if services is not None:
+            services.close_all_connections()
+        if not args.db:
+            remove_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
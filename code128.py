@@ -0,0 +1,116 @@
+import numpy as np
+from PIL import Image
+
+# --- CODE 128 ---
+# The label barcode, encoded here and drawn straight onto the label: text ->
+# symbol values -> bar/space widths in modules -> one row of pixels at the
+# box width, repeated down the box height. Whole pixels per module, so every
+# bar of the same width prints the same width.
+#
+# Charset choice follows python-barcode (what the labels used to be made
+# with): start in C for digit pairs, B for the rest, back to C for runs of 4+
+# digits. Label IDs give exactly the same symbol as before, and the same
+# module count render_zpl() sizes the printer's own barcode with. One
+# exception: python-barcode drops a leading "99" (it mistakes the value for
+# a charset switch), so IDs 99, 990-999, 9900-9999, ... were printed with a
+# barcode that scanned as the wrong number. Those are encoded correctly here.
+# Charset A (control characters) is not needed for labels and not supported.
+
+# Bar/space widths of each symbol value, bar first (11 modules each)
+PATTERNS = (
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312", "132212", "221213",
+    "221312", "231212", "112232", "122132", "122231", "113222", "123122", "123221", "223211", "221132",
+    "221231", "213212", "223112", "312131", "311222", "321122", "321221", "312212", "322112", "322211",
+    "212123", "212321", "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121", "313121", "211331",
+    "231131", "213113", "213311", "213131", "311123", "311321", "331121", "312113", "312311", "332111",
+    "314111", "221411", "431111", "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112", "421211", "212141",
+    "214121", "412121", "111143", "111341", "131141", "114113", "114311", "411113", "411311", "113141",
+    "114131", "311141", "411131", "211412", "211214", "211232",
+)
+STOP_PATTERN = "2331112"   # stop symbol and its closing bar, 13 modules
+START_B, START_C = 104, 105
+CODE_B, CODE_C = 100, 99   # charset switches (CODE_B as seen from C, CODE_C from B)
+QUIET_ZONE_MODULES = 5     # each side; the old image had a 1 mm quiet zone at 0.2 mm modules
+
+
+def symbols(text):
+    """Symbol values for `text`: start, data, checksum (stop not included)."""
+    text = str(text)
+    if not text or any(not " " <= c <= "\x7f" for c in text):
+        raise ValueError(f"Code128 (B/C) cannot encode {text!r}")
+
+    def digit_run(pos):
+        run = 0
+        for c in text[pos:pos + 10]:
+            if not c.isdigit():
+                break
+            run += 1
+        return run
+
+    values = [START_C]
+    charset, pending = "C", ""
+    for pos, c in enumerate(text):
+        if charset == "C" and not c.isdigit():
+            values.append(CODE_B)
+            charset = "B"
+            if pending:
+                values.append(ord(pending) - 32)
+                pending = ""
+        elif charset == "B" and digit_run(pos) > 3:
+            values.append(CODE_C)
+            charset = "C"
+
+        if charset == "B":
+            values.append(ord(c) - 32)
+        elif pending:
+            values.append(int(pending + c))
+            pending = ""
+        else:
+            pending = c
+    if pending:
+        values += [CODE_B, ord(pending) - 32]
+
+    if values[1] == CODE_B:  # text starts in B: Start B instead of Start C + Code B
+        values[:2] = [START_B]
+    values.append((values[0] + sum(i * v for i, v in enumerate(values[1:], start=1))) % 103)
+    return values
+
+
+def module_widths(text):
+    """Bar/space widths in modules, bar first, stop included."""
+    widths = [int(w) for value in symbols(text) for w in PATTERNS[value]]
+    return widths + [int(w) for w in STOP_PATTERN]
+
+
+def modules(text):
+    """The symbol as one bool per module, True = bar. No quiet zone."""
+    widths = module_widths(text)
+    bars = np.arange(len(widths)) % 2 == 0
+    return np.repeat(bars, widths)
+
+
+def bar_row(text, width, quiet=QUIET_ZONE_MODULES):
+    """
+    One row of `width` pixels, True = white: the symbol centred with its
+    quiet zone, each module a whole number of pixels (as wide as fits).
+    Falls back to nearest-pixel sampling if even 1 px per module is too wide.
+    """
+    bars = np.pad(modules(text), quiet)
+    px = width // len(bars)
+    if px:
+        bars = np.repeat(bars, px)
+        left = (width - len(bars)) // 2
+        bars = np.pad(bars, (left, width - len(bars) - left))
+    else:
+        bars = bars[((np.arange(width) + 0.5) * len(bars) / width).astype(np.intp)]
+    return ~bars
+
+
+def barcode_bitmap(text, size):
+    """Mode "1" image of `size` (w, h) for pasting onto the label."""
+    width, height = size
+    row = bar_row(text, width)
+    return Image.fromarray(np.repeat(row[np.newaxis, :], height, axis=0))
@@ -0,0 +1,87 @@
+"""
+Maintenance commands for pvc_factory.db.
+
+    python db_tools.py summary-verify     # compare stock_summary with labels
+    python db_tools.py summary-rebuild    # recompute stock_summary from labels
+    python db_tools.py backup             # snapshot into backups/ now (with rotation)
+    python db_tools.py backup-check [file] # integrity_check a backup (default: newest)
+    python db_tools.py archive [days]     # move old dispatched/rejected labels to the archive DB
+    python db_tools.py archive-status     # hot/archived counts and recent archive runs
+"""
+import sys
+import backup
+import services
+
+
+def summary_verify():
+    problems = services.verify_stock_summary()
+    for p in problems:
+        print("❌", p)
+    if problems:
+        print(f"stock_summary is out of sync ({len(problems)} difference(s)). Run: python db_tools.py summary-rebuild")
+        return 1
+    print("✅ stock_summary matches labels")
+    return 0
+
+
+def summary_rebuild():
+    buckets = services.rebuild_stock_summary()
+    print(f"✅ stock_summary rebuilt ({buckets} buckets)")
+    return 0
+
+
+def backup_now():
+    result = backup.create_backup()
+    print(f"✅ {result['name']} ({result['size'] // 1024} KB, {result['check']})")
+    if result["archive"]:
+        print(f"   + {result['archive']}")
+    for name in result["removed"]:
+        print(f"   removed {name}")
+    return 0
+
+
+def backup_check():
+    if len(sys.argv) > 2:
+        path = sys.argv[2]
+    else:
+        newest = backup.list_backups()[:1]
+        if not newest:
+            print("❌ No backups in", backup.BACKUP_DIR)
+            return 1
+        path = backup.backup_path(newest[0]["name"])
+    ok, messages = backup.integrity_check(path)
+    for m in messages[:20]:
+        print(("✅ " if ok else "❌ ") + m)
+    return 0 if ok else 1
+
+
+def archive():
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else services.ARCHIVE_AFTER_DAYS
+    result = services.archive_labels(days)
+    print(f"✅ Archived {result['moved']} labels older than {result['horizon'][:10]} (run #{result['run_id']})")
+    return 0
+
+
+def archive_status():
+    status = services.get_archive_status()
+    print(f"labels: {status['hot_labels']} hot, {status['archived_labels']} archived in {status['archive_db']}")
+    for run in status["runs"]:
+        print(f"  #{run['id']} {run['state']:8} horizon {run['horizon'][:10]}  moved {run['moved']}"
+              + (f"  error: {run['error']}" if run['error'] else ""))
+    return 0
+
+
+COMMANDS = {
+    "summary-verify": summary_verify,
+    "summary-rebuild": summary_rebuild,
+    "backup": backup_now,
+    "backup-check": backup_check,
+    "archive": archive,
+    "archive-status": archive_status,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(__doc__)
+        sys.exit(2)
+    sys.exit(COMMANDS[sys.argv[1]]())
@@ -8,7 +8,7 @@ import urllib.request
 import urllib.error
 
 # --- CONFIGURATION ---
-APP_SCRIPT = "app.py"
+APP_SCRIPT = "serve.py"  # waitress; "app.py" runs the dev server
 GENERATE_PAGE_URL = "http://localhost:5000/generate" 
 
 # Cloudflare command (Agar use kar rahe ho to)
@@ -0,0 +1,305 @@
+import queue
+import threading
+import time
+
+# --- LIMIT SWITCH ---
+# The switch pulls the pin LOW while a pipe presses it (PUD_UP, active low).
+#
+#   IDLE --LOW edge--> TRIGGERED --still LOW after debounce--> PRINTING
+#     ^                    |                                       |
+#     |               HIGH again (bounce)                   label queued
+#     |                    v                                       v
+#     +------------------ IDLE        WAITING_RELEASE <------------+
+#     |                                      |
+#     +--- lockout over AND pin HIGH for release_settle ---+
+#
+# Edges come from GPIO.add_event_detect; all timing lives in
+# SwitchStateMachine, which never sleeps and takes `now` as an argument, so
+# the simulator below can replay a recorded trace in virtual time.
+IDLE = "idle"
+TRIGGERED = "triggered"
+PRINTING = "printing"
+WAITING_RELEASE = "waiting_release"
+
+LOW, HIGH = 0, 1
+
+DEBOUNCE_MS = 200            # LOW must hold this long to count as a pipe
+LOCKOUT_SECONDS = 60.0       # no new pipe this soon after the last one
+RELEASE_SETTLE_SECONDS = 1.0 # pin must stay HIGH this long before re-arming
+POLL_FALLBACK_SECONDS = 0.02 # only used when edge detection is unavailable
+
+
+class SwitchStateMachine:
+    def __init__(self, debounce_ms=DEBOUNCE_MS, lockout_s=LOCKOUT_SECONDS,
+                 release_settle_s=RELEASE_SETTLE_SECONDS):
+        self.debounce_s = debounce_ms / 1000.0
+        self.lockout_s = lockout_s
+        self.release_settle_s = release_settle_s
+        self.state = IDLE
+        self.level = HIGH
+        self.level_since = 0.0
+        self.triggered_at = None
+        self.lockout_until = None
+        self.lockout_over = False
+        self.stats = {"edges": 0, "triggers": 0, "labels_queued": 0, "rejected_bounces": 0,
+                      "edges_ignored": 0, "last_cycle_s": None, "last_release_wait_s": None}
+
+    def config(self):
+        return {"debounce_ms": round(self.debounce_s * 1000), "lockout_s": self.lockout_s,
+                "release_settle_s": self.release_settle_s}
+
+    def edge(self, level, now):
+        """A pin change. Returns True when a label should be printed."""
+        self.stats["edges"] += 1
+        if level != self.level:
+            self.level, self.level_since = level, now
+
+        if self.state == IDLE:
+            if level == LOW:
+                self.state, self.triggered_at = TRIGGERED, now
+            return False
+        if self.state == TRIGGERED:
+            if level == HIGH:
+                self.state = IDLE
+                self.stats["rejected_bounces"] += 1
+            return False
+        self.stats["edges_ignored"] += 1
+        return False
+
+    def deadline(self):
+        """When poll() next needs to run, or None while nothing is pending."""
+        if self.state == TRIGGERED:
+            return self.triggered_at + self.debounce_s
+        if self.state == WAITING_RELEASE:
+            if self.level == HIGH:
+                return max(self.lockout_until, self.level_since + self.release_settle_s)
+            # still pressed: wake at the end of the lockout, then wait for the release edge
+            return None if self.lockout_over else self.lockout_until
+        return None
+
+    def poll(self, level, now):
+        """Timer tick with the real pin level. Returns True when a label should be printed."""
+        if level != self.level:
+            self.level, self.level_since = level, now
+
+        if self.state == TRIGGERED and now >= self.triggered_at + self.debounce_s:
+            if level == LOW:
+                self.state = PRINTING
+                self.stats["triggers"] += 1
+                return True
+            self.state = IDLE
+            self.stats["rejected_bounces"] += 1
+        elif self.state == WAITING_RELEASE and now >= self.lockout_until:
+            self.lockout_over = True
+            if level == HIGH and now - self.level_since >= self.release_settle_s:
+                self.stats["last_cycle_s"] = round(now - self.triggered_at, 3)
+                self.stats["last_release_wait_s"] = round(now - self.lockout_until, 3)
+                self.state = IDLE
+        return False
+
+    def handed_off(self, now, queued=True):
+        """
+        The trigger was handled. After a queued label the lockout starts;
+        otherwise (auto-print off) the switch only has to be released.
+        """
+        self.state = WAITING_RELEASE
+        self.lockout_until = now + (self.lockout_s if queued else 0.0)
+        self.lockout_over = False
+        if queued:
+            self.stats["labels_queued"] += 1
+
+    def snapshot(self):
+        return {"state": self.state, "level": self.level, **self.config(), **self.stats}
+
+
+class LimitSwitchListener:
+    """
+    Feeds GPIO edges into a SwitchStateMachine on its own thread and calls
+    on_trigger() for every accepted pipe. on_trigger should only queue work
+    and return whether it did (False = ignored, no lockout). With
+    `trace_path` every edge is appended to that file in load_trace() format.
+    """
+
+    def __init__(self, gpio, pin, on_trigger, machine=None, clock=time.monotonic, trace_path=None):
+        self.gpio = gpio
+        self.pin = pin
+        self.on_trigger = on_trigger
+        self.machine = machine or SwitchStateMachine()
+        self.clock = clock
+        self.trace_path = trace_path
+        self._trace = None
+        self._trace_start = None
+        self.edge_detection = False
+        self._events = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        gpio = self.gpio
+        gpio.setmode(gpio.BCM)
+        gpio.setup(self.pin, gpio.IN, pull_up_down=gpio.PUD_UP)
+        self.machine.level = gpio.input(self.pin)
+        self.machine.level_since = self._trace_start = self.clock()
+        if self.trace_path:
+            self._trace = open(self.trace_path, "a", buffering=1)
+            self._trace.write(f"# recorded {time.strftime('%Y-%m-%d %H:%M:%S')} GPIO {self.pin}\n0 {self.machine.level}\n")
+        try:
+            # No bouncetime: it would also swallow the release edge. The
+            # state machine does the debouncing.
+            gpio.add_event_detect(self.pin, gpio.BOTH, callback=self._on_edge)
+            self.edge_detection = True
+        except RuntimeError as e:
+            print(f"⚠️ Edge detection unavailable ({e}); polling GPIO {self.pin} instead")
+        self._thread = threading.Thread(target=self._run, name="limit-switch", daemon=True)
+        self._thread.start()
+        print(f"✅ Limit Switch Listener Started on GPIO {self.pin} ({'edges' if self.edge_detection else 'polling'})")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._events.put(None)
+        if self.edge_detection:
+            try:
+                self.gpio.remove_event_detect(self.pin)
+            except Exception:
+                pass
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _on_edge(self, channel):
+        # Runs on the GPIO library's thread: just timestamp and hand over
+        now, level = self.clock(), self.gpio.input(self.pin)
+        self._events.put((now, level))
+        self._record(now, level)
+
+    def _record(self, now, level):
+        if self._trace:
+            self._trace.write(f"{(now - self._trace_start) * 1000:.1f} {level}\n")
+
+    def _run(self):
+        last_polled = self.machine.level
+        while not self._stop.is_set():
+            deadline = self.machine.deadline()
+            timeout = None if deadline is None else max(0.0, deadline - self.clock())
+            if not self.edge_detection:
+                timeout = POLL_FALLBACK_SECONDS if timeout is None else min(timeout, POLL_FALLBACK_SECONDS)
+            try:
+                event = self._events.get(timeout=timeout)
+            except queue.Empty:
+                event = ()
+            if event is None:
+                break
+            try:
+                if event:
+                    fire = self.machine.edge(event[1], event[0])
+                else:
+                    now, level = self.clock(), self.gpio.input(self.pin)
+                    fire = False
+                    if not self.edge_detection and level != last_polled:
+                        self._record(now, level)
+                        fire = self.machine.edge(level, now)
+                    last_polled = level
+                    fire = self.machine.poll(level, now) or fire
+                if fire:
+                    self._trigger()
+            except Exception as e:
+                print(f"Error in limit switch thread: {e}")
+
+    def _trigger(self):
+        queued = False
+        try:
+            queued = bool(self.on_trigger())
+        finally:
+            self.machine.handed_off(self.clock(), queued)
+
+
+# --- SIMULATOR ---
+class SimulatedGPIO:
+    """
+    The subset of RPi.GPIO the listener uses. set_level() fires the edge
+    callback like the real library does; replay() plays a trace in real time.
+    """
+    BCM, IN, PUD_UP = "BCM", "IN", "PUD_UP"
+    LOW, HIGH = LOW, HIGH
+    FALLING, RISING, BOTH = "FALLING", "RISING", "BOTH"
+
+    def __init__(self, level=HIGH):
+        self.levels = {}
+        self.callbacks = {}
+        self.default_level = level
+        self._lock = threading.Lock()
+
+    def setmode(self, mode): pass
+    def setwarnings(self, flag): pass
+    def cleanup(self, *args): self.callbacks.clear()
+
+    def setup(self, pin, direction, pull_up_down=None):
+        self.levels.setdefault(pin, self.default_level)
+
+    def input(self, pin):
+        return self.levels.get(pin, self.default_level)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def set_level(self, pin, level):
+        with self._lock:
+            changed = self.levels.get(pin, self.default_level) != level
+            self.levels[pin] = level
+        if changed and self.callbacks.get(pin):
+            self.callbacks[pin](pin)
+
+    def replay(self, pin, trace, speed=1.0):
+        """trace: [(t_seconds, level), ...] from load_trace(); blocks while playing."""
+        start = time.monotonic()
+        for t, level in trace:
+            delay = start + t / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.set_level(pin, level)
+
+
+def load_trace(path):
+    """
+    A recorded switch trace: one "<milliseconds> <0|1>" pair per line,
+    '#' starts a comment. Returns [(seconds, level), ...].
+    """
+    trace = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                ms, level = line.split()
+                trace.append((float(ms) / 1000.0, int(level)))
+    return trace
+
+
+def simulate(trace, machine=None, initial_level=HIGH):
+    """
+    Runs a trace through a state machine in virtual time (no sleeping).
+    Returns (trigger times in seconds, final machine).
+    """
+    machine = machine or SwitchStateMachine()
+    machine.level, machine.level_since = initial_level, 0.0
+    level, triggers = initial_level, []
+    events = list(trace) + [(float("inf"), None)]
+    now = 0.0
+    for t, new_level in events:
+        # fire every timer that falls before the next edge
+        while True:
+            deadline = machine.deadline()
+            if deadline is None or deadline > t:
+                break
+            now = max(now, deadline)
+            if machine.poll(level, now):
+                triggers.append(now)
+                machine.handed_off(now)
+        if new_level is None:
+            break
+        now, level = t, new_level
+        if machine.edge(level, now):
+            triggers.append(now)
+            machine.handed_off(now)
+    return triggers, machine
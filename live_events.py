@@ -0,0 +1,83 @@
+import json
+import queue
+import threading
+
+# --- LIVE EVENTS (Server-Sent Events) ---
+# Pages subscribe to topics on /api/events instead of polling. Publishers
+# never block: a subscriber that stops reading just loses events once its
+# queue is full, and the browser's EventSource reconnects on its own.
+TOPICS = ("counter", "settings", "esp_scans", "stats_changed", "label_printed")
+KEEPALIVE_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 100
+# Every open stream holds a server thread. serve.py caps them below its
+# thread pool; past the cap /api/events answers 503 and the page polls.
+MAX_STREAMS = None
+
+_subscribers = []
+_lock = threading.Lock()
+_event_id = 0
+
+
+class Subscription:
+    def __init__(self, topics):
+        self.topics = set(topics)
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+
+def publish(topic, data=None):
+    """Sends `data` (anything JSON-serializable) to every subscriber of `topic`."""
+    global _event_id
+    with _lock:
+        _event_id += 1
+        event = (_event_id, topic, json.dumps(data))
+        targets = [s for s in _subscribers if topic in s.topics]
+    for sub in targets:
+        try:
+            sub.queue.put_nowait(event)
+        except queue.Full:
+            pass
+
+
+def subscriber_count(topic=None):
+    with _lock:
+        return sum(1 for s in _subscribers if topic is None or topic in s.topics)
+
+
+def streams_full():
+    return MAX_STREAMS is not None and subscriber_count() >= MAX_STREAMS
+
+
+def close_all():
+    """Ends every open stream (server shutdown); the browsers reconnect to whatever comes up next."""
+    with _lock:
+        targets = list(_subscribers)
+    for sub in targets:
+        try:
+            sub.queue.put_nowait(None)
+        except queue.Full:
+            sub.closed = True
+
+
+def stream(topics):
+    """Generator of SSE frames for a Flask streaming Response."""
+    sub = Subscription(t for t in topics if t in TOPICS)
+    with _lock:
+        _subscribers.append(sub)
+    try:
+        # Tell EventSource to wait 3s before reconnecting, and open the stream right away
+        yield "retry: 3000\n\n"
+        while not sub.closed:
+            try:
+                event = sub.queue.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                break
+            event_id, topic, payload = event
+            yield f"id: {event_id}\nevent: {topic}\ndata: {payload}\n\n"
+    finally:
+        with _lock:
+            if sub in _subscribers:
+                _subscribers.remove(sub)
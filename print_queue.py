@@ -0,0 +1,95 @@
+import datetime
+import threading
+import traceback
+
+import services
+import printer_backend
+
+# --- PRINT QUEUE ---
+# /api/print and the limit switch only queue a job (services.enqueue_print_job)
+# and return. One PrintWorker thread renders and sends the jobs in order, so a
+# slow or offline CUPS queue holds up the worker, never a Flask request.
+RETRY_BASE_SECONDS = 2      # 2s, 4s, 8s, ... between attempts
+RETRY_MAX_SECONDS = 60
+MAX_ATTEMPTS = 5
+IDLE_POLL_SECONDS = 5       # longest sleep between queue checks
+
+
+def retry_delay(attempts):
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+class PrintWorker:
+    def __init__(self, on_sent=None, render=None, send=None):
+        # on_sent(job) runs after the printer accepted the label
+        self.on_sent = on_sent
+        self.render = render or printer_backend.render_for_printer
+        self.send = send or printer_backend.send_to_printer
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        requeued = services.requeue_interrupted_print_jobs()
+        if requeued:
+            print(f"🖨️ Re-queued {requeued} interrupted print job(s)")
+        self._thread = threading.Thread(target=self._run, name="print-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def submit(self, label, printer=printer_backend.DEFAULT_PRINTER, source="api"):
+        """Queues a label for printing and returns the job id."""
+        job_id = services.enqueue_print_job(label, printer, source, MAX_ATTEMPTS)
+        self.wake()
+        return job_id
+
+    def wake(self):
+        """Checks the queue now instead of at the next idle poll."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = services.claim_print_job()
+                due = services.next_print_job_due() if job is None else 0
+            except Exception as e:
+                print(f"Print queue error: {e}")
+                job, due = None, None
+            if job is None:
+                # Sleep until the next backoff expires or a new job arrives
+                self._wake.wait(IDLE_POLL_SECONDS if due is None else min(due, IDLE_POLL_SECONDS))
+                self._wake.clear()
+                continue
+            self._process(job)
+        services.release_db_connection()
+
+    def _process(self, job):
+        try:
+            rendered = self.render(job['payload'], job['printer'])
+            success, msg = self.send(rendered, job['printer'])
+        except Exception as e:
+            success, msg = False, str(e)
+
+        if success:
+            services.complete_print_job(job['id'])
+            if self.on_sent:
+                try:
+                    self.on_sent(job)
+                except Exception:
+                    traceback.print_exc()
+            return
+
+        if job['attempts'] < job['max_attempts']:
+            retry_at = datetime.datetime.now() + datetime.timedelta(seconds=retry_delay(job['attempts']))
+            services.fail_print_job(job['id'], msg, retry_at)
+            print(f"❌ Print job {job['id']} failed (attempt {job['attempts']}): {msg}. Retrying at {retry_at:%H:%M:%S}")
+        else:
+            services.fail_print_job(job['id'], msg)
+            print(f"❌ Print job {job['id']} failed after {job['attempts']} attempts: {msg}")
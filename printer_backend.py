@@ -1,13 +1,12 @@
-import json
-import qrcode
-import io
 import os
 import sys
 import subprocess
+import socket
 import tempfile
-import barcode
-from barcode.writer import ImageWriter
+import threading
 from PIL import Image, ImageDraw, ImageFont
+import code128
+import qr_codes
 
 # Windows check
 if sys.platform == "win32":
@@ -17,115 +16,257 @@ if sys.platform == "win32":
         import win32ui
     except ImportError: pass
 
-def silent_print_label(label_data, printer_name="ZPL"):
+DEFAULT_PRINTER = "ZPL"
+LP_TIMEOUT = 30  # seconds; an lp that hangs must not stall the print worker forever
+
+# --- PER-PRINTER OUTPUT ---
+# Printers listed here get native ZPL (a few hundred bytes, no image, no temp
+# file); every other printer gets the rendered PNG through CUPS as before.
+#   "format":    "zpl" or "png"
+#   "transport": "cups"   -> lp -d <printer> -o raw   (default)
+#                "socket" -> raw TCP, "address": ("192.168.1.50", 9100)
+#                "file"   -> append to "path", e.g. /dev/usb/lp0
+# Example: "ZPL": {"format": "zpl", "transport": "cups"},
+PRINTER_CONFIG = {
+}
+
+def printer_format(printer_name):
+    return PRINTER_CONFIG.get(printer_name, {}).get("format", "png")
+
+def silent_print_label(label_data, printer_name=DEFAULT_PRINTER):
     try:
-        # --- 1. Canvas Setup (Paper Size) ---
-        # 880 = Width, 400 = Height
-        W, H = 880, 400
-        img = Image.new('RGB', (W, H), 'white')
-        draw = ImageDraw.Draw(img)
-        
-        # ====================================================================
-        #                     FONT SETTINGS (SIZE YAHAN BADHAYEIN)
-        # ====================================================================
+        job = render_for_printer(label_data, printer_name)
+        return send_to_printer(job, printer_name)
+    except Exception as e: 
+        return False, str(e)
+
+def render_for_printer(label_data, printer_name=DEFAULT_PRINTER):
+    """
+    ZPL bytes for ZPL printers, otherwise the PNG label image. A list of
+    labels renders as one job: concatenated ZPL, or a list of page images.
+    """
+    labels = label_data if isinstance(label_data, list) else [label_data]
+    if printer_format(printer_name) == "zpl":
         try:
-            if sys.platform != "win32":
-                # --- RASPBERRY PI FONTS ---
-                font_bold = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
-                font_norm = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-                
-                # 1. BRAND NAME (Sabse upar wala) - Abhi 38 hai
-                font_header = ImageFont.truetype(font_bold, 40) 
+            return b"".join(render_zpl(label) for label in labels)
+        except Exception as e:
+            print(f"ZPL Error, printing image instead: {e}")
+    if isinstance(label_data, list):
+        return [render_label(label) for label in labels]
+    return render_label(label_data)
 
-                # 2. DETAILS (Size, Color, Pressure) - Abhi 32 hai
-                font_main = ImageFont.truetype(font_norm, 38)   
+# ====================================================================
+#                     LABEL LAYOUT (SIZE / POSITION YAHAN BADLEIN)
+#       (X = Left se kitna dur, Y = Upar se kitna niche)
+# ====================================================================
+# Font name -> (file, size). Loaded once per process, not once per label.
+if sys.platform != "win32":
+    # --- RASPBERRY PI FONTS ---
+    _FONT_BOLD = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+    _FONT_NORM = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+    LABEL_FONTS = {
+        "header": (_FONT_BOLD, 40),  # 1. BRAND NAME (Sabse upar wala)
+        "main":   (_FONT_NORM, 38),  # 2. DETAILS (Size, Color, Pressure)
+        "sub":    (_FONT_NORM, 32),  # 3. INFO (Operator, Batch, Time)
+        "id":     (_FONT_BOLD, 48),  # 4. BOTTOM ID (Niche wala ID number)
+        "mfg":    (_FONT_BOLD, 28),  # 5. MANUFACTURER (Bhaiji Products)
+    }
+else:
+    # --- WINDOWS FONTS (Backup) ---
+    LABEL_FONTS = {
+        "header": ("arialbd.ttf", 38),
+        "main":   ("arial.ttf", 28),
+        "sub":    ("arial.ttf", 22),
+        "id":     ("arialbd.ttf", 34),
+        "mfg":    ("arialbd.ttf", 25),
+    }
 
-                # 3. INFO (Operator, Batch, Time) - Abhi 24 hai
-                font_sub = ImageFont.truetype(font_norm, 32)    
+LABEL_LAYOUT = {
+    # 880 = Width, 400 = Height
+    "size": (880, 400),
+    # Same on every label: drawn once into the cached base image
+    "static": [
+        {"line": (40, 60, 400, 60), "width": 3},                 # Brand ke niche line
+    ],
+    # Per-label text. {created_time} is HH:MM from created_at; "if" skips
+    # the field when that value is empty.
+    "fields": [
+        {"text": "{pipe_name}", "xy": (40, 15), "font": "header"},
+        {"text": "{size} | {color}", "xy": (40, 70), "font": "main"},
+        {"text": "Pres: {pressure}", "xy": (40, 110), "font": "main", "if": "pressure"},
+        {"text": "Op: {operator}", "xy": (40, 160), "font": "sub"},
+        {"text": "{batch}   Time: {created_time}", "xy": (40, 190), "font": "sub"},
+        {"text": "ID: {id}", "xy": (40, 280), "font": "id"},
+    ],
+    "qr": {"xy": (620, 20), "size": (200, 200)},           # Right side, top
+    # Static text that sits on top of the QR's white border, so it is pasted
+    # after the QR from a cached mask
+    "overlay": [
+        {"text": "Bhaiji Products", "xy": (550, 200), "font": "mfg"},  # QR ke niche
+    ],
+    "barcode": {"xy": (380, 260), "size": (450, 60)},
+}
 
-                # 4. BOTTOM ID (Niche wala ID number) - Abhi 28 hai
-                font_id = ImageFont.truetype(font_bold, 48)     
 
-                # 5. MANUFACTURER (Bhaiji Products) - Abhi 28 hai
-                font_mfg = ImageFont.truetype(font_bold, 28) 
-            else:
-                # --- WINDOWS FONTS (Backup) ---
-                font_header = ImageFont.truetype("arialbd.ttf", 38) # Brand
-                font_main = ImageFont.truetype("arial.ttf", 28)     # Details
-                font_sub = ImageFont.truetype("arial.ttf", 22)      # Info
-                font_id = ImageFont.truetype("arialbd.ttf", 34)     # ID
-                font_mfg = ImageFont.truetype("arialbd.ttf", 25)    # Mfg Name
-        except:
+class LabelTemplate:
+    """
+    A LABEL_LAYOUT with its fonts loaded and its static parts pre-rendered.
+    render() copies the cached base and draws only the per-label parts.
+    """
+
+    def __init__(self, layout=LABEL_LAYOUT, fonts=LABEL_FONTS):
+        self.layout = layout
+        self.fonts = self._load_fonts(fonts)
+
+        self.base = Image.new('RGB', layout["size"], 'white')
+        draw = ImageDraw.Draw(self.base)
+        for item in layout["static"]:
+            draw.line(item["line"], fill="black", width=item.get("width", 1))
+
+        self.overlay_mask = Image.new('L', layout["size"], 0)
+        mask_draw = ImageDraw.Draw(self.overlay_mask)
+        for item in layout["overlay"]:
+            mask_draw.text(item["xy"], item["text"], font=self.fonts[item["font"]], fill=255)
+        self.overlay_box = self.overlay_mask.getbbox()
+        if self.overlay_box:
+            self.overlay_mask = self.overlay_mask.crop(self.overlay_box)
+
+    @staticmethod
+    def _load_fonts(fonts):
+        try:
+            return {name: ImageFont.truetype(path, size) for name, (path, size) in fonts.items()}
+        except Exception:
             # Agar koi font na mile to Default use karega
-            font_header = font_main = font_sub = font_id = font_mfg = ImageFont.load_default()
-
-        # ====================================================================
-        #                     PRINTING & POSITIONING
-        #       (X = Left se kitna dur, Y = Upar se kitna niche)
-        # ====================================================================
-
-        # --- A. Brand Name ---
-        # X=40, Y=15 (Thoda upar rakha hai)
-        draw.text((40, 15), str(label_data['pipe_name']), font=font_header, fill="black")
-        
-        # --- B. Underline (Brand ke niche line) ---
-        draw.line((40, 60, 400, 60), fill="black", width=3)
-
-        # --- C. Size & Color ---
-        # X=40, Y=70
-        draw.text((40, 70), f"{label_data['size']} | {label_data['color']}", font=font_main, fill="black")
-        
-        # --- D. Pressure ---
-        pressure_val = label_data.get('pressure', '')
-        if pressure_val:
-            # X=40, Y=110
-            draw.text((40, 110), f"Pres: {pressure_val}", font=font_main, fill="black")
-
-        # --- E. Operator Info ---
-        # X=40, Y=160
-        draw.text((40, 160), f"Op: {label_data['operator']}", font=font_sub, fill="black")
-        
-        # --- F. Batch & Time ---
-        # X=40, Y=190
-        batch_str = label_data.get('batch', '')
-        draw.text((40, 190), f"{batch_str}   Time: {label_data['created_at'][11:16]}", font=font_sub, fill="black")
-
-        # --- G. QR CODE ---
-        qr = qrcode.make(json.dumps({"id": label_data['id']}))
-        # Size Yahan Change karein: (170, 170)
-        qr = qr.resize((200, 200))
-        # Position: X=620 (Right Side), Y=20 (Top)
-        img.paste(qr, (620, 20)) 
-
-        # --- H. MANUFACTURER NAME (Bhaiji Products) ---
-        # X=550, Y=200 (QR ke niche)
-        draw.text((550, 200), "Bhaiji Products", font=font_mfg, fill="black")
-
-        # --- I. BOTTOM MANUAL ID ---
-        # X=40, Y=280 (Niche Left side)
-        draw.text((40, 280), f"ID: {label_data['id']}", font=font_id, fill="black")
-
-        # --- J. BARCODE ---
+            default = ImageFont.load_default()
+            return {name: default for name in fonts}
+
+    def render(self, label_data):
+        """Draws the label and returns the PIL image. Raises on bad label data."""
+        img = self.base.copy()
+        draw = ImageDraw.Draw(img)
+
+        values = dict(label_data)
+        values.setdefault('pressure', '')
+        values.setdefault('batch', '')
+        values['created_time'] = label_data['created_at'][11:16]
+        for field in self.layout["fields"]:
+            if "if" in field and not values.get(field["if"]):
+                continue
+            draw.text(field["xy"], field["text"].format(**values), font=self.fonts[field["font"]], fill="black")
+
+        # --- QR CODE --- (cached matrix, see qr_codes)
+        qr = qr_codes.qr_bitmap(qr_codes.label_payload(label_data['id']), self.layout["qr"]["size"])
+        img.paste(qr, self.layout["qr"]["xy"])
+
+        if self.overlay_box:
+            img.paste("black", self.overlay_box, self.overlay_mask)
+
+        # --- BARCODE --- (drawn at the box size, see code128)
         try:
-            barcode_class = barcode.get_barcode_class('code128')
-            my_barcode = barcode_class(str(label_data['id']), writer=ImageWriter())
-            buffer = io.BytesIO()
-            my_barcode.write(buffer, options={"write_text": False, "module_height": 5.0, "quiet_zone": 1.0})
-            buffer.seek(0)
-            
-            # Barcode ka Size Yahan Change karein: (Width=450, Height=60)
-            barcode_img = Image.open(buffer).resize((450, 60))
-            
-            # Barcode ki Position: X=380, Y=260
-            img.paste(barcode_img, (380, 260))
+            bars = code128.barcode_bitmap(label_data['id'], self.layout["barcode"]["size"])
+            img.paste(bars, self.layout["barcode"]["xy"])
         except Exception as e:
             print(f"Barcode Error: {e}")
 
+        return img
+
+
+_template = None
+_template_lock = threading.Lock()
+
+def get_label_template():
+    """The process-wide LabelTemplate, built on first use."""
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                _template = LabelTemplate()
+    return _template
+
+def render_label(label_data):
+    """Draws the label and returns the PIL image. Raises on bad label data."""
+    return get_label_template().render(label_data)
+
+# --- NATIVE ZPL ---
+# The same LABEL_LAYOUT as the image, in printer dots (1 px = 1 dot, so the
+# 880x400 label maps onto a 203 dpi 4x2" roll). Text uses the scalable font 0
+# at the layout's font size; QR and Code128 are drawn by the printer itself.
+ZPL_DARKNESS = 21    # ~SD, same as the Darkness=21 CUPS option
+ZPL_PRINT_RATE = 4   # ^PR, same as zePrintRate=4
+_ZPL_SPECIAL = {"_": "_5F", "^": "_5E", "~": "_7E"}
+
+def _zpl_text(x, y, text, font_size):
+    text = str(text)
+    field = "^FD"
+    if any(c in text for c in _ZPL_SPECIAL):
+        # ^FH lets ^ ~ _ appear in field data as _XX hex escapes
+        text = "".join(_ZPL_SPECIAL.get(c, c) for c in text)
+        field = "^FH^FD"
+    return f"^FO{x},{y}^A0N,{font_size},{font_size}{field}{text}^FS"
+
+def render_zpl(label_data, layout=LABEL_LAYOUT, fonts=LABEL_FONTS):
+    """The label as a ZPL II program (bytes)."""
+    width, height = layout["size"]
+    out = ["^XA", "^CI28", f"^PW{width}", f"^LL{height}", f"~SD{ZPL_DARKNESS}", f"^PR{ZPL_PRINT_RATE}"]
+
+    for item in layout["static"]:
+        x1, y1, x2, y2 = item["line"]
+        thickness = item.get("width", 1)
+        out.append(f"^FO{x1},{y1 - thickness // 2}^GB{x2 - x1 + 1},{thickness},{thickness}^FS")
+
+    values = dict(label_data)
+    values.setdefault('pressure', '')
+    values.setdefault('batch', '')
+    values['created_time'] = label_data['created_at'][11:16]
+    for field in layout["fields"]:
+        if "if" in field and not values.get(field["if"]):
+            continue
+        x, y = field["xy"]
+        out.append(_zpl_text(x, y, field["text"].format(**values), fonts[field["font"]][1]))
+    for item in layout["overlay"]:
+        x, y = item["xy"]
+        out.append(_zpl_text(x, y, item["text"], fonts[item["font"]][1]))
+
+    # QR: same data and error correction (M) as the image; scaled to fit the
+    # box with the quiet zone the image version has
+    qr_data = qr_codes.label_payload(label_data['id'])
+    (qx, qy), (qw, _) = layout["qr"]["xy"], layout["qr"]["size"]
+    magnification = max(1, min(10, qw // qr_codes.qr_matrix(qr_data).shape[0]))  # quiet zone included
+    quiet = qr_codes.QR_BORDER * magnification
+    out.append(f"^FO{qx + quiet},{qy + quiet}^BQN,2,{magnification}^FDMA,{qr_data}^FS")
+
+    # Code128: widest module that keeps the symbol inside the box
+    (bx, by), (bw, bh) = layout["barcode"]["xy"], layout["barcode"]["size"]
+    modules = len(code128.modules(label_data['id']))
+    module_width = max(1, min(10, bw // modules))
+    out.append(f"^FO{bx},{by}^BY{module_width}^BCN,{bh},N,N,N,A^FD{label_data['id']}^FS")
+
+    out.append("^XZ")
+    return ("\n".join(out) + "\n").encode("utf-8")
+
+def send_to_printer(job, printer_name=DEFAULT_PRINTER):
+    """
+    Hands rendered output to the printer as ONE print job: a PIL image, a
+    list of images (one page each) or ZPL bytes. Returns (success, message).
+    """
+    if isinstance(job, bytes):
+        return send_raw(job, printer_name)
+    pages = job if isinstance(job, list) else [job]
+    W, H = pages[0].size
+    try:
         # --- PRINTING COMMANDS (DO NOT CHANGE) ---
         if sys.platform != "win32":
-            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_file:
-                img.save(tmp_file.name)
-                tmp_path = tmp_file.name
+            if len(pages) == 1:
+                with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_file:
+                    pages[0].save(tmp_file.name)
+                    tmp_path = tmp_file.name
+            else:
+                # Multi-page PDF; 1-bit pages are stored losslessly (CCITT G4)
+                # instead of as JPEG, which would smear the barcode edges
+                bilevel = [page.convert("1", dither=Image.Dither.NONE) for page in pages]
+                with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp_file:
+                    bilevel[0].save(tmp_file, "PDF", save_all=True, append_images=bilevel[1:], resolution=203)
+                    tmp_path = tmp_file.name
             cmd = [
     "lp",
     "-d", printer_name,
@@ -135,20 +276,54 @@ def silent_print_label(label_data, printer_name="ZPL"):
     tmp_path
 ]
 
-            subprocess.run(cmd, check=True)
-            os.remove(tmp_path)
+            try:
+                subprocess.run(cmd, check=True, timeout=LP_TIMEOUT)
+            finally:
+                os.remove(tmp_path)
             return True, "Sent to CUPS"
         else:
             if not printer_name: printer_name = win32print.GetDefaultPrinter()
             hDC = win32ui.CreateDC()
             hDC.CreatePrinterDC(printer_name)
             hDC.StartDoc("PVC Label")
-            hDC.StartPage()
-            ImageWin.Dib(img).draw(hDC.GetHandleOutput(), (0, 0, W, H))
-            hDC.EndPage()
+            for page in pages:
+                hDC.StartPage()
+                ImageWin.Dib(page).draw(hDC.GetHandleOutput(), (0, 0, W, H))
+                hDC.EndPage()
             hDC.EndDoc()
             hDC.DeleteDC()
             return True, "Printed on Windows"
 
     except Exception as e: 
+        return False, str(e)
+
+def send_raw(data, printer_name=DEFAULT_PRINTER):
+    """Sends printer-native bytes (ZPL) untouched. Returns (success, message)."""
+    config = PRINTER_CONFIG.get(printer_name, {})
+    transport = config.get("transport", "cups")
+    try:
+        if transport == "socket":
+            with socket.create_connection(tuple(config["address"]), timeout=LP_TIMEOUT) as conn:
+                conn.sendall(data)
+            return True, "Sent to printer socket"
+        if transport == "file":
+            with open(config["path"], "ab") as f:
+                f.write(data)
+            return True, "Written to printer device"
+        if sys.platform != "win32":
+            subprocess.run(["lp", "-d", printer_name, "-o", "raw"], input=data, check=True, timeout=LP_TIMEOUT)
+            return True, "Sent to CUPS (raw)"
+        else:
+            if not printer_name: printer_name = win32print.GetDefaultPrinter()
+            handle = win32print.OpenPrinter(printer_name)
+            try:
+                win32print.StartDocPrinter(handle, 1, ("PVC Label", None, "RAW"))
+                win32print.StartPagePrinter(handle)
+                win32print.WritePrinter(handle, data)
+                win32print.EndPagePrinter(handle)
+                win32print.EndDocPrinter(handle)
+            finally:
+                win32print.ClosePrinter(handle)
+            return True, "Printed on Windows (raw)"
+    except Exception as e:
         return False, str(e)
\ No newline at end of file
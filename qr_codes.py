@@ -0,0 +1,67 @@
+import io
+import json
+
+import numpy as np
+import qrcode
+from PIL import Image
+
+import result_cache
+
+# --- QR CODES ---
+# One QR per label, {"id": N}, as the scanners read it off the printed label.
+# The module matrix is built once per payload and kept in a bounded LRU.
+# The generate-page preview (/api/labels/<id>/qr.png) and the label bitmap
+# are both scaled from that matrix with NumPy index arrays, no PIL resize.
+#
+# Same symbol as qrcode.make(): error correction M, 4-module quiet zone,
+# best mask. qr_bitmap() reproduces the old qrcode.make(...).resize(size)
+# pixel for pixel (nearest neighbour on the 10 px/module image).
+QR_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_M
+QR_BORDER = 4
+QR_BOX_SIZE = 10          # px per module of the qrcode.make() image the label used to resize
+QR_PREVIEW_SCALE = 8      # px per module of the preview PNG
+QR_CACHE_SIZE = 4096
+
+QR_CACHE = result_cache.RowCache(QR_CACHE_SIZE)
+
+
+def label_payload(label_id):
+    return json.dumps({"id": label_id})
+
+
+def qr_matrix(payload):
+    """Dark modules as True, quiet zone included. Read-only; shared through QR_CACHE."""
+    found, missing = QR_CACHE.get_many([payload])
+    if found:
+        return found[payload]
+    epoch = QR_CACHE.epoch()
+    qr = qrcode.QRCode(error_correction=QR_ERROR_CORRECTION, border=QR_BORDER)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    matrix = np.array(qr.get_matrix(), dtype=bool)
+    matrix.setflags(write=False)
+    QR_CACHE.put_many({payload: matrix}, epoch)
+    return matrix
+
+
+def qr_bitmap(payload, size):
+    """Mode "1" image of `size` (w, h) for pasting onto the label."""
+    matrix = qr_matrix(payload)
+    source_px = matrix.shape[0] * QR_BOX_SIZE
+
+    def modules(length):
+        # PIL NEAREST: destination pixel x samples source pixel int((x + 0.5) * src / dst)
+        return ((np.arange(length) + 0.5) * source_px / length).astype(np.intp) // QR_BOX_SIZE
+
+    width, height = size
+    white = ~matrix[np.ix_(modules(height), modules(width))]
+    return Image.fromarray(white)
+
+
+def qr_png(payload, scale=QR_PREVIEW_SCALE):
+    """1-bit PNG, `scale` px per module."""
+    white = ~qr_matrix(payload)
+    white = np.repeat(np.repeat(white, scale, axis=0), scale, axis=1)
+    buf = io.BytesIO()
+    Image.fromarray(white).save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
@@ -0,0 +1,169 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(endpoint, args):
+    """endpoint + query args, order-independent and ignoring empty values."""
+    items = []
+    for name, values in args.lists():
+        values = tuple(v for v in values if v != '')
+        if values:
+            items.append((name, values))
+    return (endpoint, tuple(sorted(items)))
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "generation", "created")
+
+    def __init__(self, body, generation):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.generation = generation
+        self.created = time.monotonic()
+
+
+class ResultCache:
+    """
+    Bounded LRU of rendered responses. An entry is served while it is younger
+    than `ttl` seconds AND the data generation it was built from is still the
+    current one (services.data_generation(), bumped by every write).
+    """
+
+    def __init__(self, max_entries=64, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def _fresh(self, key, generation):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.generation != generation or time.monotonic() - entry.created > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def peek_etag(self, key, generation):
+        """ETag of a still-valid entry, or None. Never computes anything."""
+        with self._lock:
+            entry = self._fresh(key, generation)
+            return entry.etag if entry else None
+
+    def get_or_compute(self, key, generation, compute):
+        """Returns a CacheEntry, calling compute() -> bytes on a miss."""
+        with self._lock:
+            entry = self._fresh(key, generation)
+            if entry:
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = CacheEntry(compute(), generation)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class RowCache:
+    """
+    Bounded LRU of rows by primary key, dropped key by key by the write paths
+    (invalidate/clear). A read that raced a write must not put the old row
+    back: take epoch() before querying and hand it to put_many(), which skips
+    the store if any invalidation happened in between.
+    """
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def epoch(self):
+        return self._epoch
+
+    def get_many(self, keys):
+        """Returns ({key: row} for cached keys, [keys not cached])."""
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                row = self._rows.get(key)
+                if row is None:
+                    missing.append(key)
+                else:
+                    self._rows.move_to_end(key)
+                    found[key] = row
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, rows, epoch):
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            self._rows.update(rows)
+            for key in rows:
+                self._rows.move_to_end(key)
+            while len(self._rows) > self.max_entries:
+                self._rows.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += 1
+            for key in keys:
+                self._rows.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += 1
+            self._rows.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._rows),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
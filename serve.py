@@ -0,0 +1,105 @@
+import argparse
+import os
+import signal
+import sys
+
+import live_events
+
+# --- PRODUCTION SERVER ---
+# `python serve.py` runs the app under waitress: a fixed pool of request
+# threads behind one event loop that holds the connections (keep-alive,
+# slow clients and idle sockets cost no thread). It is ONE process on
+# purpose: the SSE hub, the response/label caches and the print worker
+# live in memory and would split across processes.
+#
+# SIGTERM (systemd, launcher.py closing) or Ctrl+C:
+#   1. open /api/events streams are ended, so their threads come free
+#   2. no new connections; requests in progress get SHUTDOWN_GRACE_SECONDS
+#   3. switch listener off, the label on the printer finishes, backups stop
+#
+# Without waitress installed it falls back to the threaded dev server.
+try:
+    import waitress
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    waitress = None
+    WAITRESS_AVAILABLE = False
+
+SERVE_HOST = os.environ.get("PVC_HOST", "0.0.0.0")
+SERVE_PORT = int(os.environ.get("PVC_PORT", 5000))
+SERVE_THREADS = int(os.environ.get("PVC_THREADS", 24))
+CONNECTION_LIMIT = 200          # open sockets, including idle keep-alive ones
+KEEPALIVE_TIMEOUT_SECONDS = 60  # idle keep-alive connections are closed after this
+STREAM_SHARE = 0.5              # at most this share of the threads may sit in /api/events
+SHUTDOWN_GRACE_SECONDS = 5
+
+
+def max_streams(threads):
+    return max(1, int(threads * STREAM_SHARE))
+
+
+def _stop_on_signal(signum, frame):
+    live_events.close_all()
+    # Unwinds the server loop on the main thread; both servers clean up from there
+    raise SystemExit(0)
+
+
+def run_waitress(app, args):
+    server = waitress.create_server(
+        app, host=args.host, port=args.port, threads=args.threads,
+        connection_limit=args.connection_limit, channel_timeout=args.keepalive,
+        # get_real_ip() reads X-Forwarded-For itself (Cloudflare tunnel); waitress
+        # would otherwise strip it and tunnel traffic would look like localhost
+        clear_untrusted_proxy_headers=False,
+        ident="pvc-factory")
+    print(f"System Running on http://localhost:{args.port} (waitress, {args.threads} threads)")
+    try:
+        server.run()  # returns after SystemExit; waits for the running requests
+    finally:
+        server.task_dispatcher.shutdown(cancel_pending=True, timeout=SHUTDOWN_GRACE_SECONDS)
+        server.close()
+
+
+def run_dev_server(app, args):
+    from werkzeug.serving import make_server
+    httpd = make_server(args.host, args.port, app, threaded=True)
+    print(f"⚠️ waitress not installed (pip install waitress). Using the dev server on http://localhost:{args.port}")
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Serve the factory app (production).")
+    ap.add_argument("--host", default=SERVE_HOST)
+    ap.add_argument("--port", type=int, default=SERVE_PORT)
+    ap.add_argument("--threads", type=int, default=SERVE_THREADS, help="request threads")
+    ap.add_argument("--connection-limit", type=int, default=CONNECTION_LIMIT)
+    ap.add_argument("--keepalive", type=int, default=KEEPALIVE_TIMEOUT_SECONDS,
+                    help="seconds an idle keep-alive connection stays open")
+    args = ap.parse_args(argv)
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # templates, static, pvc_factory.db
+    signal.signal(signal.SIGTERM, _stop_on_signal)
+    signal.signal(signal.SIGINT, _stop_on_signal)
+
+    import app as factory  # starts the background services (once, see app.start_background_services)
+    live_events.MAX_STREAMS = max_streams(args.threads)
+    try:
+        if WAITRESS_AVAILABLE:
+            run_waitress(factory.app, args)
+        else:
+            run_dev_server(factory.app, args)
+    except SystemExit:
+        pass
+    finally:
+        print("Shutting down: stopping printer, backups and GPIO...")
+        factory.stop_background_services()
+        factory.services.close_all_connections()
+        print("👋 Server stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
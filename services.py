@@ -1,17 +1,145 @@
 import sqlite3
+import contextlib
 import datetime
 import json
-import io
-import qrcode
+import os
+import atexit
+import threading
+import time
+import urllib.request
 import base64
+import live_events
+import result_cache
 
-DB_NAME = "pvc_factory.db"
+DB_NAME = os.environ.get("PVC_DB", "pvc_factory.db")
+# Old dispatched/rejected labels move here (see ARCHIVE); attached read-only
+# as "archive" on every pooled connection.
+ARCHIVE_DB = os.environ.get("PVC_ARCHIVE_DB") or os.path.splitext(DB_NAME)[0] + "_archive.db"
+ARCHIVE_ENABLED = True
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# --- CONNECTION POOL ---
+# Each worker thread keeps one connection for its lifetime. Flask request
+# threads hand theirs back to the idle pool on teardown so the next request
+# (often a brand new thread on the dev server) can reuse it.
+DB_POOL_ENABLED = True
+DB_POOL_MAX_IDLE = 8
+DB_BUSY_TIMEOUT_MS = 5000
+DB_PRAGMAS = [
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=67108864",   # 64 MB
+    "PRAGMA cache_size=-8000",     # ~8 MB page cache
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+]
+
+_thread_conn = threading.local()
+_pool_lock = threading.Lock()
+_idle_conns = []
+_all_conns = set()
+
+def _open_connection():
+    conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False, uri=True)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    _attach_archive(conn)
+    return conn
+
+def _attach_archive(conn, read_only=True):
+    if not ARCHIVE_ENABLED:
+        return
+    if not os.path.exists(ARCHIVE_DB):
+        sqlite3.connect(ARCHIVE_DB).close()  # empty file; ensure_archive() creates the tables
+    uri = "file:" + urllib.request.pathname2url(os.path.abspath(ARCHIVE_DB)) + ("?mode=ro" if read_only else "")
+    conn.execute("ATTACH DATABASE ? AS archive", (uri,))
+
+def get_db_connection():
+    """Returns this thread's pooled connection (opened and tuned on first use)."""
+    if not DB_POOL_ENABLED:
+        conn = sqlite3.connect(DB_NAME, uri=True)
+        conn.row_factory = sqlite3.Row
+        _attach_archive(conn)
+        return conn
+
+    conn = getattr(_thread_conn, 'conn', None)
+    if conn is not None:
+        return conn
+
+    with _pool_lock:
+        conn = _idle_conns.pop() if _idle_conns else None
+    if conn is None:
+        conn = _open_connection()
+        with _pool_lock:
+            _all_conns.add(conn)
+    _thread_conn.conn = conn
     return conn
 
+def release_db_connection():
+    """Gives the current thread's connection back to the idle pool."""
+    conn = getattr(_thread_conn, 'conn', None)
+    if conn is None: return
+    _thread_conn.conn = None
+
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if len(_idle_conns) < DB_POOL_MAX_IDLE:
+            _idle_conns.append(conn)
+            return
+        _all_conns.discard(conn)
+    conn.close()
+
+def close_all_connections():
+    """Closes every pooled connection. Registered with atexit."""
+    with _pool_lock:
+        conns = list(_all_conns)
+        _all_conns.clear()
+        _idle_conns.clear()
+    for conn in conns:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _thread_conn.conn = None
+
+atexit.register(close_all_connections)
+
+# --- DATA GENERATION ---
+# Bumped after every write to labels/shipments. Response caches remember the
+# generation they were built from and drop the entry once it moves on.
+_data_generation = 0
+_generation_lock = threading.Lock()
+
+def data_generation():
+    return _data_generation
+
+def bump_data_generation():
+    global _data_generation
+    with _generation_lock:
+        _data_generation += 1
+        generation = _data_generation
+    live_events.publish("stats_changed", {"generation": generation})
+
+# --- LABEL ROW CACHE ---
+# Recently looked-up label rows for the scan pages (GET /api/labels/<id>,
+# POST /api/labels/lookup). Unlike the response caches it is not dropped on
+# every generation bump (the printer bumps it all day); instead each write
+# to existing labels calls invalidate_labels() with the ids it touched,
+# after its commit.
+LABEL_CACHE_ENABLED = True
+LABEL_CACHE = result_cache.RowCache(max_entries=4096)
+LOOKUP_CHUNK = 500   # ids per IN (...); older SQLite builds allow 999 parameters
+
+def invalidate_labels(label_ids=None):
+    """Drops these ids from the label cache (all of them when None)."""
+    if label_ids is None:
+        LABEL_CACHE.clear()
+    else:
+        LABEL_CACHE.invalidate(label_ids)
+
 def init_db():
     with get_db_connection() as conn:
         # 1. Base Labels Table
@@ -40,7 +168,30 @@ def init_db():
                 created_at TEXT
             )
         """)
+        # 3. Print Jobs (drained by print_queue.PrintWorker)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS print_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                label_id INTEGER,
+                printer TEXT,
+                payload TEXT,
+                source TEXT,
+                state TEXT DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER DEFAULT 5,
+                next_attempt_at TEXT,
+                last_error TEXT,
+                created_at TEXT,
+                updated_at TEXT,
+                sent_at TEXT
+            )
+        """)
     ensure_schema_updates()
+    ensure_counters()
+    ensure_esp_scans()
+    ensure_archive()
+    ensure_stock_summary()
+    ensure_vouchers()
 
 def ensure_schema_updates():
     """Migrates existing DB to have new columns if they are missing."""
@@ -79,6 +230,17 @@ def ensure_schema_updates():
         except sqlite3.OperationalError:
             conn.execute("ALTER TABLE shipments ADD COLUMN challan_no TEXT")
             print("Migrated DB: Added challan_no to shipments")
+        try:
+            conn.execute("SELECT challan_no FROM labels LIMIT 1")
+        except sqlite3.OperationalError:
+            # Copy of shipments.challan_no, so inventory pages need no per-row lookup.
+            # Every place that sets or clears labels.shipment_id keeps it in sync.
+            conn.execute("ALTER TABLE labels ADD COLUMN challan_no TEXT")
+            conn.execute("""
+                UPDATE labels SET challan_no = (SELECT challan_no FROM shipments WHERE id = labels.shipment_id)
+                WHERE shipment_id IS NOT NULL
+            """)
+            print("Migrated DB: Added challan_no to labels")
 
         # Add unique index for challan_no. This is idempotent.
         # It allows multiple NULL or empty string values, but enforces uniqueness for actual values.
@@ -93,11 +255,456 @@ def ensure_schema_updates():
             print("   and ensure all non-empty 'challan_no' values in the 'shipments' table are unique.")
             print("   After fixing the data, restart the application to apply the unique constraint.")
             print("="*80 + "\n")
+    ensure_indexes()
 
-init_db()
+# --- MANAGED INDEXES ---
+# Every index the queries in this file rely on. ensure_indexes() creates the
+# missing ones and drops the superseded ones on startup.
+LABEL_INDEXES = {
+    "idx_labels_dispatch": "labels(dispatched_at, dispatched_by, created_at)",
+    "idx_labels_created": "labels(created_at)",
+    "idx_labels_attributes": "labels(pipe_name, size, color, pressure_class)",
+    "idx_labels_shipment": "labels(shipment_id)",
+    "idx_shipments_date": "shipments(created_at)",
+    "idx_print_jobs_state": "print_jobs(state, next_attempt_at)",
+}
+OBSOLETE_INDEXES = ["idx_labels_status"]  # labels(dispatched_at), covered by idx_labels_dispatch
+
+def ensure_indexes():
+    with get_db_connection() as conn:
+        for name in OBSOLETE_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        for name, target in LABEL_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    # Refresh planner statistics for the new indexes (cheap when nothing changed)
+    get_db_connection().execute("PRAGMA main.optimize")  # the read-only archive cannot be analyzed here
+
+# --- STOCK SUMMARY (materialized) ---
+# One row per (pipe_name, size, color, pressure_class, weight_g) with running
+# counts and weight sums, so get_stats() never aggregates the labels table.
+# Triggers on labels keep it current inside the same transaction as the
+# write, whichever code path (or fix script) changed the label.
+SUMMARY_KEY = ("pipe_name", "size", "color", "pressure_class", "weight_g")
+
+def _summary_bucket(row):
+    return " AND ".join(f"{col} IS {row}.{col}" for col in SUMMARY_KEY)
+
+def _summary_delta(row, sign):
+    """SET clause adding (sign=+) or removing (sign=-) one label to its bucket."""
+    rejected = f"({row}.dispatched_by IS 'rejected')"
+    stock = f"({row}.dispatched_at IS NULL AND {row}.dispatched_by IS NOT 'rejected')"
+    dispatched = f"({row}.dispatched_at IS NOT NULL AND {row}.dispatched_by IS NOT 'rejected')"
+    weight = f"IFNULL({row}.weight_g, 0)"
+    return f"""
+        total = total {sign} 1,
+        stock = stock {sign} {stock},
+        dispatched = dispatched {sign} {dispatched},
+        rejected = rejected {sign} {rejected},
+        total_weight = total_weight {sign} {weight},
+        stock_weight = stock_weight {sign} {stock} * {weight},
+        dispatched_weight = dispatched_weight {sign} {dispatched} * {weight},
+        rejected_weight = rejected_weight {sign} {rejected} * {weight}
+    """
+
+def _summary_ensure_bucket(row):
+    cols = ", ".join(SUMMARY_KEY)
+    vals = ", ".join(f"{row}.{col}" for col in SUMMARY_KEY)
+    return f"""
+        INSERT INTO stock_summary ({cols})
+        SELECT {vals} WHERE NOT EXISTS (SELECT 1 FROM stock_summary WHERE {_summary_bucket(row)});
+    """
+
+STOCK_SUMMARY_TRIGGERS = {
+    "trg_stock_summary_insert": f"""
+        AFTER INSERT ON labels BEGIN
+            {_summary_ensure_bucket("NEW")}
+            UPDATE stock_summary SET {_summary_delta("NEW", "+")} WHERE {_summary_bucket("NEW")};
+        END""",
+    "trg_stock_summary_delete": f"""
+        AFTER DELETE ON labels BEGIN
+            UPDATE stock_summary SET {_summary_delta("OLD", "-")} WHERE {_summary_bucket("OLD")};
+        END""",
+    "trg_stock_summary_update": f"""
+        AFTER UPDATE OF {", ".join(SUMMARY_KEY)}, dispatched_at, dispatched_by ON labels BEGIN
+            UPDATE stock_summary SET {_summary_delta("OLD", "-")} WHERE {_summary_bucket("OLD")};
+            {_summary_ensure_bucket("NEW")}
+            UPDATE stock_summary SET {_summary_delta("NEW", "+")} WHERE {_summary_bucket("NEW")};
+        END""",
+}
+
+def ensure_stock_summary():
+    with get_db_connection() as conn:
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='stock_summary'").fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stock_summary (
+                pipe_name TEXT, size TEXT, color TEXT, pressure_class TEXT, weight_g REAL,
+                total INTEGER DEFAULT 0, stock INTEGER DEFAULT 0,
+                dispatched INTEGER DEFAULT 0, rejected INTEGER DEFAULT 0,
+                total_weight REAL DEFAULT 0, stock_weight REAL DEFAULT 0,
+                dispatched_weight REAL DEFAULT 0, rejected_weight REAL DEFAULT 0
+            )
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_stock_summary_key ON stock_summary ({', '.join(SUMMARY_KEY)})")
+        for name, body in STOCK_SUMMARY_TRIGGERS.items():
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    if not exists:
+        rebuild_stock_summary()
+        print("Migrated DB: Built stock_summary from labels")
+
+def _stock_summary_from_labels(conn, source=None, where="1=1", params=()):
+    """The summary computed the slow way, straight from labels (archived ones included)."""
+    return conn.execute(f"""
+        SELECT {", ".join(SUMMARY_KEY)},
+               COUNT(*) as total,
+               SUM(dispatched_at IS NULL AND dispatched_by IS NOT 'rejected') as stock,
+               SUM(dispatched_at IS NOT NULL AND dispatched_by IS NOT 'rejected') as dispatched,
+               SUM(dispatched_by IS 'rejected') as rejected,
+               SUM(IFNULL(weight_g, 0)) as total_weight,
+               SUM((dispatched_at IS NULL AND dispatched_by IS NOT 'rejected') * IFNULL(weight_g, 0)) as stock_weight,
+               SUM((dispatched_at IS NOT NULL AND dispatched_by IS NOT 'rejected') * IFNULL(weight_g, 0)) as dispatched_weight,
+               SUM((dispatched_by IS 'rejected') * IFNULL(weight_g, 0)) as rejected_weight
+        FROM {source or _labels_with_archive()}
+        WHERE {where}
+        GROUP BY {", ".join(SUMMARY_KEY)}
+    """, params).fetchall()
+
+def rebuild_stock_summary():
+    """Recomputes stock_summary from scratch. Returns the number of buckets."""
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")  # no label writes between the read and the swap
+        rows = _stock_summary_from_labels(conn)
+        conn.execute("DELETE FROM stock_summary")
+        conn.executemany("INSERT INTO stock_summary VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", [tuple(r) for r in rows])
+    bump_data_generation()
+    return len(rows)
+
+def verify_stock_summary():
+    """Compares stock_summary with labels. Returns a list of mismatch descriptions."""
+    counters = ("total", "stock", "dispatched", "rejected",
+                "total_weight", "stock_weight", "dispatched_weight", "rejected_weight")
+    with get_db_connection() as conn:
+        expected = {tuple(r[c] for c in SUMMARY_KEY): r for r in _stock_summary_from_labels(conn)}
+        actual = {tuple(r[c] for c in SUMMARY_KEY): r for r in conn.execute("SELECT * FROM stock_summary WHERE total != 0")}
+
+    problems = []
+    for key in expected.keys() | actual.keys():
+        want, got = expected.get(key), actual.get(key)
+        for c in counters:
+            w = want[c] if want else 0
+            g = got[c] if got else 0
+            if abs((w or 0) - (g or 0)) > 1e-6 * max(1, abs(w or 0)):  # running float sums drift a little
+                problems.append(f"{key} {c}: labels={w} summary={g}")
+    return problems
+
+# --- PIPE COUNTERS ---
+# Printed-pipe counters, one per line/shift name ("default" is the one the
+# generate page shows). Incremented inside the mark_printed transaction;
+# every reset is kept in counter_resets. batch_no is the last batch number
+# handed out: labels reserve theirs when they are created, before they
+# print, so queued, unprinted or failed labels never share a number.
+DEFAULT_COUNTER = "default"
+LEGACY_COUNTER_FILE = "counter_memory.txt"
+
+def ensure_counters():
+    with get_db_connection() as conn:
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='counters'").fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT,
+                batch_no INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        try:
+            conn.execute("SELECT batch_no FROM counters LIMIT 1")
+        except sqlite3.OperationalError:
+            conn.execute("ALTER TABLE counters ADD COLUMN batch_no INTEGER NOT NULL DEFAULT 0")
+            print("Migrated DB: Added batch_no to counters")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS counter_resets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                old_value INTEGER,
+                reset_at TEXT,
+                reset_by TEXT,
+                reason TEXT
+            )
+        """)
+        if not exists:
+            # One-time import of the old file-based counter
+            value = 0
+            try:
+                with open(LEGACY_COUNTER_FILE) as f:
+                    value = int(f.read().strip())
+            except (OSError, ValueError):
+                pass
+            conn.execute("INSERT OR IGNORE INTO counters (name, value, updated_at) VALUES (?, ?, ?)",
+                         (DEFAULT_COUNTER, value, datetime.datetime.now().isoformat()))
+            print(f"Migrated DB: Added counters (default = {value})")
+
+# --- ESP SCAN RING ---
+# Every ID the ESP scanner pushes gets a row with an increasing seq. The
+# table keeps only the newest ESP_RING_SIZE rows; each scan page (consumer)
+# keeps its own cursor in esp_consumers, so a page that reloads or a server
+# restart does not lose or repeat scans. The same pipe pushed again within
+# ESP_DEDUP_SECONDS (the reader re-reading a QR) is dropped.
+ESP_RING_SIZE = 5000
+ESP_DEDUP_SECONDS = 3
+ESP_FETCH_LIMIT = 200
+
+def ensure_esp_scans():
+    with get_db_connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS esp_scans (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                pipe_id INTEGER NOT NULL,
+                received_at TEXT,
+                source TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_esp_scans_pipe ON esp_scans(pipe_id, received_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS esp_consumers (
+                name TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT
+            )
+        """)
 
-def import_base64(data):
-    return base64.b64encode(data).decode('utf-8')
+# --- ARCHIVE ---
+# archive_labels() moves dispatched/rejected labels older than
+# ARCHIVE_AFTER_DAYS from labels into the same table in ARCHIVE_DB, so the
+# hot table only holds recent history and stock. Archived rows are never
+# edited again. They stay visible: label_source() adds them to filtered
+# queries whose dates can reach them, lookups by id fall back to them, and
+# shipment pages and stock_summary count them.
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH_SIZE = 500    # labels per copy + delete transaction pair
+ARCHIVE_ELIGIBLE = ("((dispatched_at IS NOT NULL AND dispatched_at < :horizon) OR "
+                    "(dispatched_by = 'rejected' AND created_at < :horizon))")
+
+_label_columns = []       # main.labels columns, in order (after migrations)
+_archive_bounds = None    # cached archive_bounds()
+
+@contextlib.contextmanager
+def _archive_writer():
+    """Private connection with the archive attached read-write; explicit transactions."""
+    conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None, uri=True)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    try:
+        _attach_archive(conn, read_only=False)
+        yield conn
+    finally:
+        conn.close()
+
+def ensure_archive():
+    global _label_columns, _archive_bounds
+    with get_db_connection() as conn:
+        columns = conn.execute("PRAGMA main.table_info(labels)").fetchall()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archive_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                horizon TEXT,
+                state TEXT DEFAULT 'running',
+                last_id INTEGER DEFAULT 0,
+                moved INTEGER DEFAULT 0,
+                started_at TEXT,
+                updated_at TEXT,
+                finished_at TEXT,
+                error TEXT
+            )
+        """)
+    _label_columns = [c['name'] for c in columns]
+    _archive_bounds = None
+    if not ARCHIVE_ENABLED:
+        return
+    with _archive_writer() as db:
+        existing = [r['name'] for r in db.execute("PRAGMA archive.table_info(labels)")]
+        if not existing:
+            defs = ", ".join("id INTEGER PRIMARY KEY" if c['name'] == 'id' else f"{c['name']} {c['type']}" for c in columns)
+            db.execute(f"CREATE TABLE archive.labels ({defs})")
+            print(f"Migrated DB: Created archive labels table in {ARCHIVE_DB}")
+        else:
+            # labels only ever gains columns (ensure_schema_updates); mirror them
+            for c in columns:
+                if c['name'] not in existing:
+                    db.execute(f"ALTER TABLE archive.labels ADD COLUMN {c['name']} {c['type']}")
+                    print(f"Migrated DB: Added {c['name']} to archive labels")
+        db.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_created ON labels(created_at)")
+        db.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_dispatched ON labels(dispatched_at)")
+        db.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_shipment ON labels(shipment_id)")
+
+def archive_bounds():
+    """{"count", "created", "dispatched"} (newest created_at/dispatched_at in the archive), or None while it is empty."""
+    global _archive_bounds
+    if not ARCHIVE_ENABLED:
+        return None
+    if _archive_bounds is None:
+        # No `with`: this runs inside callers' transactions (rebuild_stock_summary,
+        # shipment edits) and must not commit them.
+        row = get_db_connection().execute("SELECT COUNT(*), MAX(created_at), MAX(dispatched_at) FROM archive.labels").fetchone()
+        _archive_bounds = {"count": row[0], "created": row[1], "dispatched": row[2]}
+    return _archive_bounds if _archive_bounds["count"] else None
+
+def _labels_with_archive():
+    """FROM target covering hot and archived labels (plain labels while the archive is empty)."""
+    if not archive_bounds():
+        return "labels"
+    cols = ", ".join(_label_columns)
+    return f"(SELECT {cols} FROM main.labels UNION ALL SELECT {cols} FROM archive.labels) labels"
+
+def _needs_archive(args):
+    """Whether a build_where_clause(args) filter can match archived labels."""
+    bounds = archive_bounds()
+    if not bounds:
+        return False
+    status = args.get('status')
+    report_type = args.get('report_type', 'inventory')
+    target_date = args.get('date')
+    if target_date and report_type == 'inventory':
+        if not _day_after(target_date):
+            return True
+        if status in ('stock', 'dispatched'):
+            # archived pipes all left on or before bounds["dispatched"]
+            newest = (bounds["dispatched"] or "")[:10]
+            return target_date < newest if status == 'stock' else target_date <= newest
+        return True  # created on or before the day
+    if status == 'stock':
+        return False  # the archive holds no stock
+    field = "dispatched" if report_type == 'dispatch' else "created"
+    from_date, to_date = args.get('from_date'), args.get('to_date')
+    lower = from_date if (from_date and to_date) else target_date
+    if not lower or not _day_after(lower):
+        return True
+    return lower <= (bounds[field] or "")[:10]
+
+def label_source(args):
+    """FROM target for a build_where_clause(args) filter: labels, plus the archive when the dates need it."""
+    return _labels_with_archive() if _needs_archive(args) else "labels"
+
+# --- VOUCHER ITEMS ---
+# Return and verification vouchers keep one row per pipe in *_voucher_items
+# (indexed by pipe and by voucher), so "which vouchers touched pipe X" and
+# "which sizes go missing" are index lookups instead of parsing every
+# voucher's JSON. The headers hold the rest of the voucher.
+#
+# return_vouchers and verification_vouchers are now views with the old
+# columns, the id lists rebuilt as JSON text in their original order, for
+# the history pages and anything else that reads them. They are read-only;
+# write through process_return_voucher() / create_verification_voucher().
+# A DB that still has them as tables is backfilled and converted once.
+VERIFY_ITEM_KINDS = ("expected", "scanned", "missing", "extra")
+
+def _id_list_json(items_table, where):
+    return f"""(SELECT json_group_array(pipe_id) FROM
+                (SELECT pipe_id FROM {items_table} i WHERE {where} ORDER BY position))"""
+
+def ensure_vouchers():
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")  # a half-converted voucher table is never committed
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS return_voucher_headers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                total_pipes INTEGER NOT NULL,
+                notes TEXT,
+                challan_source TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS return_voucher_items (
+                voucher_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                pipe_id INTEGER NOT NULL,
+                PRIMARY KEY (voucher_id, position)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_return_voucher_items_pipe ON return_voucher_items(pipe_id, voucher_id)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS verification_voucher_headers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT,
+                filter_info TEXT,
+                expected_count INTEGER,
+                scanned_count INTEGER,
+                missing_count INTEGER,
+                extra_count INTEGER,
+                notes TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS verification_voucher_items (
+                voucher_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                pipe_id INTEGER NOT NULL,
+                PRIMARY KEY (voucher_id, kind, position)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_verification_voucher_items_pipe ON verification_voucher_items(pipe_id, voucher_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_verification_voucher_items_kind ON verification_voucher_items(kind, pipe_id)")
+
+        legacy = {r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name IN ('return_vouchers', 'verification_vouchers')")}
+        if 'return_vouchers' in legacy:
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(return_vouchers)")}
+            optional = ", ".join(c if c in columns else "NULL" for c in ("notes", "challan_source"))  # older tables
+            conn.execute(f"""
+                INSERT INTO return_voucher_headers (id, created_at, total_pipes, notes, challan_source)
+                SELECT id, created_at, total_pipes, {optional} FROM return_vouchers
+            """)
+            conn.execute("""
+                INSERT INTO return_voucher_items (voucher_id, position, pipe_id)
+                SELECT r.id, j.key, j.value FROM return_vouchers r, json_each(r.pipe_ids_json) j
+                WHERE json_valid(r.pipe_ids_json) AND json_type(r.pipe_ids_json) = 'array' AND j.type != 'null'
+            """)
+            unreadable = conn.execute("""
+                SELECT COUNT(*) FROM return_vouchers
+                WHERE NOT json_valid(pipe_ids_json) OR json_type(pipe_ids_json) != 'array'
+            """).fetchone()[0]
+            count = conn.execute("SELECT COUNT(*) FROM return_vouchers").fetchone()[0]
+            conn.execute("DROP TABLE return_vouchers")
+            print(f"Migrated DB: {count} return vouchers -> return_voucher_items"
+                  + (f" ({unreadable} with unreadable pipe_ids_json kept without items)" if unreadable else ""))
+        if 'verification_vouchers' in legacy:
+            conn.execute("""
+                INSERT INTO verification_voucher_headers (id, created_at, filter_info, expected_count, scanned_count,
+                                                          missing_count, extra_count, notes)
+                SELECT id, created_at, filter_info, expected_count, scanned_count, missing_count, extra_count, notes
+                FROM verification_vouchers
+            """)
+            for kind in VERIFY_ITEM_KINDS:
+                conn.execute(f"""
+                    INSERT INTO verification_voucher_items (voucher_id, kind, position, pipe_id)
+                    SELECT v.id, '{kind}', j.key, j.value FROM verification_vouchers v, json_each(v.{kind}_ids) j
+                    WHERE json_valid(v.{kind}_ids) AND json_type(v.{kind}_ids) = 'array' AND j.type != 'null'
+                """)
+            count = conn.execute("SELECT COUNT(*) FROM verification_vouchers").fetchone()[0]
+            conn.execute("DROP TABLE verification_vouchers")
+            print(f"Migrated DB: {count} verification vouchers -> verification_voucher_items")
+
+        conn.execute(f"""
+            CREATE VIEW IF NOT EXISTS return_vouchers AS
+            SELECT h.id, h.created_at, h.total_pipes,
+                   {_id_list_json("return_voucher_items", "i.voucher_id = h.id")} AS pipe_ids_json,
+                   h.notes, h.challan_source
+            FROM return_voucher_headers h
+        """)
+        id_lists = ",\n".join(
+            _id_list_json("verification_voucher_items", f"i.voucher_id = h.id AND i.kind = '{kind}'") + f" AS {kind}_ids"
+            for kind in VERIFY_ITEM_KINDS)
+        conn.execute(f"""
+            CREATE VIEW IF NOT EXISTS verification_vouchers AS
+            SELECT h.id, h.created_at, h.filter_info, h.expected_count, h.scanned_count,
+                   h.missing_count, h.extra_count,
+                   {id_lists},
+                   h.notes
+            FROM verification_voucher_headers h
+        """)
+
+init_db()
 
 # --- CORE LOGIC ---
 def create_label_in_db(data):
@@ -113,64 +720,398 @@ def create_label_in_db(data):
                     (data['pipe_name'], data['size'], data['color'], data['weight_g'], length_m, batch, data.get('operator','OP-1'), created_at, pressure))
         new_id = cur.lastrowid
         conn.commit()
+        bump_data_generation()
         row = conn.execute("SELECT * FROM labels WHERE id=?", (new_id,)).fetchone()
         return dict(row)
 
 
-def generate_qr_for_label(label_id, created_at):
-    qr_img = qrcode.make(json.dumps({"id": label_id, "created_at": created_at}))
-    buf = io.BytesIO()
-    qr_img.save(buf, format="PNG")
-    return "data:image/png;base64," + import_base64(buf.getvalue())
-
 def get_label_by_id(label_id):
+    return get_labels_by_ids([label_id]).get(label_id)
+
+def get_labels_by_ids(label_ids):
+    """{id: label dict} for the ids that exist; LOOKUP_CHUNK ids per query."""
+    ids = list(dict.fromkeys(label_ids))
+    if LABEL_CACHE_ENABLED:
+        found, missing = LABEL_CACHE.get_many(ids)
+    else:
+        found, missing = {}, ids
+    if missing:
+        epoch = LABEL_CACHE.epoch()
+        loaded = {}
+        with get_db_connection() as conn:
+            for i in range(0, len(missing), LOOKUP_CHUNK):
+                chunk = missing[i:i + LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                for row in conn.execute(f"SELECT * FROM labels WHERE id IN ({placeholders})", chunk):
+                    loaded[row['id']] = dict(row)
+            archived = [i for i in missing if i not in loaded] if archive_bounds() else []
+            for i in range(0, len(archived), LOOKUP_CHUNK):
+                chunk = archived[i:i + LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                for row in conn.execute(f"SELECT * FROM archive.labels WHERE id IN ({placeholders})", chunk):
+                    loaded[row['id']] = dict(row, archived=True)
+        if LABEL_CACHE_ENABLED:
+            LABEL_CACHE.put_many(loaded, epoch)
+        found.update(loaded)
+    # copies, so callers can add keys without touching the cache
+    return {i: dict(found[i]) for i in ids if i in found}
+
+def mark_printed(label_id, counter=None):
+    return mark_labels_printed([label_id], counter)
+
+def mark_labels_printed(label_ids, counter=None):
+    """
+    One UPDATE for a whole print job (ids come from create_labels_batch,
+    <= MAX_BATCH_LABELS). With `counter`, that pipe counter goes up by
+    len(label_ids) in the same transaction; returns its new value.
+    """
+    now = datetime.datetime.now().isoformat()
+    placeholders = ",".join("?" * len(label_ids))
+    value = None
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f"UPDATE labels SET printed_at=? WHERE id IN ({placeholders})", [now, *label_ids])
+        if counter:
+            value = _increment_counter(conn, counter, len(label_ids), now)
+    invalidate_labels(label_ids)
+    bump_data_generation()
+    return value
+
+MAX_BATCH_LABELS = 500
+
+def create_labels_batch(data, count, counter=DEFAULT_COUNTER):
+    """
+    Inserts `count` identical labels in one transaction, numbered with the
+    next `count` batch numbers of `counter` (reserved in the same
+    transaction). Returns the new rows in order.
+    """
+    created_at = datetime.datetime.now().isoformat()
+    row = (data['pipe_name'], data['size'], data['color'], data['weight_g'], data.get('length_m', '6m'),
+           data.get('operator', 'OP-1'), created_at, data.get('pressure', ''))
     with get_db_connection() as conn:
-        row = conn.execute("SELECT * FROM labels WHERE id=?", (label_id,)).fetchone()
-    return dict(row) if row else None
+        conn.execute("BEGIN IMMEDIATE")
+        first_batch_no = _reserve_batch_numbers(conn, counter, count, created_at)
+        first_id = None
+        for i in range(count):
+            cur = conn.execute("""
+                INSERT INTO labels (pipe_name, size, color, weight_g, length_m, batch, operator, created_at, pressure_class)
+                VALUES (?,?,?,?,?,?,?,?,?)
+            """, row[:5] + (f"#{first_batch_no + i}",) + row[5:])
+            if first_id is None:
+                first_id = cur.lastrowid
+        rows = conn.execute("SELECT * FROM labels WHERE id BETWEEN ? AND ? ORDER BY id",
+                            (first_id, cur.lastrowid)).fetchall()
+    bump_data_generation()
+    return [dict(r) for r in rows]
+
+# --- PIPE COUNTER OPERATIONS ---
+def _increment_counter(conn, name, amount, now):
+    conn.execute("INSERT OR IGNORE INTO counters (name, value, updated_at) VALUES (?, 0, ?)", (name, now))
+    conn.execute("UPDATE counters SET value = value + ?, updated_at = ? WHERE name = ?", (amount, now, name))
+    return conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+
+def _reserve_batch_numbers(conn, name, count, now):
+    """First of `count` batch numbers nobody has had yet. Call inside a write transaction."""
+    conn.execute("INSERT OR IGNORE INTO counters (name, value, updated_at) VALUES (?, 0, ?)", (name, now))
+    # Printed labels that never reserved (older clients) still move the start up
+    conn.execute("UPDATE counters SET batch_no = MAX(batch_no, value) + ? WHERE name = ?", (count, name))
+    return conn.execute("SELECT batch_no FROM counters WHERE name = ?", (name,)).fetchone()[0] - count + 1
+
+def reserve_batch_number(name=DEFAULT_COUNTER):
+    """The next batch number of a counter, for one label."""
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        return _reserve_batch_numbers(conn, name, 1, datetime.datetime.now().isoformat())
+
+def get_counter(name=DEFAULT_COUNTER):
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
 
-def mark_printed(label_id):
+def get_counters():
     with get_db_connection() as conn:
-        conn.execute("UPDATE labels SET printed_at=? WHERE id=?", (datetime.datetime.now().isoformat(), label_id))
+        return [dict(r) for r in conn.execute("SELECT * FROM counters ORDER BY name")]
+
+def reset_counter(name=DEFAULT_COUNTER, reset_by=None, reason=None):
+    """Sets the counter to 0 and records the old value. Returns the old value."""
+    now = datetime.datetime.now().isoformat()
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        old_value = row[0] if row else 0
+        conn.execute("INSERT OR REPLACE INTO counters (name, value, updated_at) VALUES (?, 0, ?)", (name, now))
+        conn.execute("INSERT INTO counter_resets (name, old_value, reset_at, reset_by, reason) VALUES (?, ?, ?, ?, ?)",
+                     (name, old_value, now, reset_by, reason))
+    return old_value
+
+def get_counter_resets(name=None, limit=50):
+    sql, params = "SELECT * FROM counter_resets", []
+    if name:
+        sql += " WHERE name = ?"
+        params.append(name)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    with get_db_connection() as conn:
+        return [dict(r) for r in conn.execute(sql, params)]
+
+# --- ESP SCAN OPERATIONS ---
+def push_esp_scans(pipe_ids, source=None):
+    """
+    Appends scans to the ring in one transaction, skipping repeats inside
+    the dedup window. Returns {"accepted", "duplicates", "last_seq"}.
+    """
+    now = datetime.datetime.now()
+    window_start = (now - datetime.timedelta(seconds=ESP_DEDUP_SECONDS)).isoformat()
+    now = now.isoformat()
+    accepted = duplicates = 0
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for pipe_id in pipe_ids:
+            seen = conn.execute("SELECT 1 FROM esp_scans WHERE pipe_id = ? AND received_at >= ? LIMIT 1",
+                                (pipe_id, window_start)).fetchone()
+            if seen:
+                duplicates += 1
+                continue
+            conn.execute("INSERT INTO esp_scans (pipe_id, received_at, source) VALUES (?, ?, ?)",
+                         (pipe_id, now, source))
+            accepted += 1
+        last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM esp_scans").fetchone()[0]
+        if accepted:
+            conn.execute("DELETE FROM esp_scans WHERE seq <= ?", (last_seq - ESP_RING_SIZE,))
+    return {"accepted": accepted, "duplicates": duplicates, "last_seq": last_seq}
+
+def fetch_esp_scans(consumer, after=None, limit=ESP_FETCH_LIMIT):
+    """
+    Scans with seq > `after` for `consumer`; without `after` the consumer's
+    saved cursor is used (a new consumer starts at the current end, not at
+    the whole backlog). The cursor moves to the last seq returned.
+    Returns {"items": [{"seq", "id", "received_at"}], "last_seq", "dropped"},
+    where dropped counts scans that fell out of the ring before being read.
+    """
+    now = datetime.datetime.now().isoformat()
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        head, tail = conn.execute("SELECT MIN(seq), COALESCE(MAX(seq), 0) FROM esp_scans").fetchone()
+        if after is None:
+            row = conn.execute("SELECT last_seq FROM esp_consumers WHERE name = ?", (consumer,)).fetchone()
+            after = row[0] if row else tail
+        after = min(after, tail)  # a cursor from before a DB reset
+        rows = conn.execute("SELECT seq, pipe_id, received_at FROM esp_scans WHERE seq > ? ORDER BY seq LIMIT ?",
+                            (after, limit)).fetchall()
+        last_seq = rows[-1]['seq'] if rows else max(after, 0)
+        conn.execute("""
+            INSERT INTO esp_consumers (name, last_seq, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET last_seq = excluded.last_seq, updated_at = excluded.updated_at
+        """, (consumer, last_seq, now))
+    dropped = max(0, head - after - 1) if head is not None and after < tail else 0
+    return {"items": [{"seq": r['seq'], "id": r['pipe_id'], "received_at": r['received_at']} for r in rows],
+            "last_seq": last_seq, "dropped": dropped}
+
+# --- PRINT JOBS ---
+# States: queued -> rendering -> sent, or back to queued with a later
+# next_attempt_at after a failure, and failed once max_attempts is used up.
+PRINT_JOB_STATES = ("queued", "rendering", "sent", "failed")
+
+def enqueue_print_job(label, printer, source="api", max_attempts=5):
+    """
+    Queues `label` (the dict passed to the printer, or a list of them for a
+    multi-page job) and returns the job id.
+    """
+    now = datetime.datetime.now().isoformat()
+    first = label[0] if isinstance(label, list) else label
+    with get_db_connection() as conn:
+        cur = conn.execute("""
+            INSERT INTO print_jobs (label_id, printer, payload, source, state, max_attempts,
+                                    next_attempt_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)
+        """, (first.get('id'), printer, json.dumps(label), source, max_attempts, now, now, now))
+        return cur.lastrowid
+
+def claim_print_job():
+    """Moves the oldest due job to 'rendering' and returns it, or None."""
+    now = datetime.datetime.now().isoformat()
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("""
+            SELECT * FROM print_jobs WHERE state='queued' AND next_attempt_at <= ?
+            ORDER BY id LIMIT 1
+        """, (now,)).fetchone()
+        if not row:
+            return None
+        conn.execute("UPDATE print_jobs SET state='rendering', attempts=attempts+1, updated_at=? WHERE id=?",
+                     (now, row['id']))
+    job = dict(row)
+    job['attempts'] += 1
+    job['state'] = 'rendering'
+    job['payload'] = json.loads(job['payload'])
+    return job
+
+def next_print_job_due():
+    """Seconds until the next queued job may be claimed, or None if the queue is empty."""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT MIN(next_attempt_at) FROM print_jobs WHERE state='queued'").fetchone()
+    if not row[0]:
+        return None
+    due = datetime.datetime.fromisoformat(row[0]) - datetime.datetime.now()
+    return max(0.0, due.total_seconds())
+
+def complete_print_job(job_id):
+    now = datetime.datetime.now().isoformat()
+    with get_db_connection() as conn:
+        conn.execute("UPDATE print_jobs SET state='sent', last_error=NULL, sent_at=?, updated_at=? WHERE id=?",
+                     (now, now, job_id))
+
+def fail_print_job(job_id, error, retry_at=None):
+    """Re-queues the job for `retry_at` (a datetime), or marks it failed when None."""
+    now = datetime.datetime.now().isoformat()
+    with get_db_connection() as conn:
+        if retry_at:
+            conn.execute("UPDATE print_jobs SET state='queued', last_error=?, next_attempt_at=?, updated_at=? WHERE id=?",
+                         (error, retry_at.isoformat(), now, job_id))
+        else:
+            conn.execute("UPDATE print_jobs SET state='failed', last_error=?, updated_at=? WHERE id=?",
+                         (error, now, job_id))
+
+def retry_print_job(job_id):
+    """Puts a failed job back in the queue with a fresh set of attempts."""
+    now = datetime.datetime.now().isoformat()
+    with get_db_connection() as conn:
+        cur = conn.execute("""
+            UPDATE print_jobs SET state='queued', attempts=0, next_attempt_at=?, updated_at=?
+            WHERE id=? AND state='failed'
+        """, (now, now, job_id))
+        return cur.rowcount > 0
+
+def requeue_interrupted_print_jobs():
+    """Jobs left in 'rendering' by a crash or restart go back to the queue."""
+    now = datetime.datetime.now().isoformat()
+    with get_db_connection() as conn:
+        cur = conn.execute("UPDATE print_jobs SET state='queued', next_attempt_at=?, updated_at=? WHERE state='rendering'",
+                           (now, now))
+        return cur.rowcount
+
+def get_print_job(job_id):
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT * FROM print_jobs WHERE id=?", (job_id,)).fetchone()
+    return _print_job_dict(row) if row else None
+
+def get_print_jobs(state=None, limit=50):
+    sql, params = "SELECT * FROM print_jobs", []
+    if state:
+        sql += " WHERE state=?"
+        params.append(state)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    with get_db_connection() as conn:
+        jobs = [_print_job_dict(r) for r in conn.execute(sql, params)]
+        counts = dict(conn.execute("SELECT state, COUNT(*) FROM print_jobs GROUP BY state").fetchall())
+    return {"jobs": jobs, "counts": {s: counts.get(s, 0) for s in PRINT_JOB_STATES}}
+
+def _print_job_dict(row):
+    job = dict(row)
+    payload = json.loads(job.pop('payload') or 'null')  # the label snapshot; not needed by status pages
+    job['pages'] = len(payload) if isinstance(payload, list) else 1
+    return job
 
 # --- NEW DISPATCH LOGIC (BATCH) ---
+# --- SHIPMENTS ---
+# A challan is validated and written as one set: the scanned ids go into a
+# temp table, one join against labels finds the ones that cannot go on the
+# truck, and totals and the label UPDATE come from what is left. Nothing
+# from the client is trusted beyond the ids.
+SHIPMENT_REJECT_REASONS = ("invalid", "not_found", "archived", "rejected", "dispatched")
+_SHIPPABLE = "l.dispatched_at IS NULL AND l.shipment_id IS NULL AND l.dispatched_by IS NOT 'rejected'"
+
+def _shipment_pick_table(conn, ids):
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS shipment_pick (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.shipment_pick")
+    conn.executemany("INSERT OR IGNORE INTO temp.shipment_pick (id) VALUES (?)", [(i,) for i in ids])
+
 def create_shipment_record(meta, items):
     """
-    1. Creates a shipment record.
-    2. Marks all items as dispatched and links them to the shipment.
+    Creates the shipment and dispatches its pipes in one transaction.
+    `items` are the scanned labels (dicts with an 'id', or bare ids); only
+    pipes that are in stock and on no other challan are taken. Returns
+    {"shipment_id", "created_at", "total_pipes", "total_weight", "rejected"},
+    rejected being [{"id", "reason", "challan_no"}] (see SHIPMENT_REJECT_REASONS);
+    shipment_id is None when nothing could be dispatched.
     """
     timestamp = datetime.datetime.now().isoformat()
-    total_qty = len(items)
-    total_wt = sum(float(i['weight_g']) for i in items)
-    
+    challan_no = meta.get('challan_number') or meta.get('challan_no')
+    ids, rejected = [], []
+    for item in items:
+        raw = item.get('id') if isinstance(item, dict) else item
+        try:
+            ids.append(int(raw))
+        except (TypeError, ValueError):
+            rejected.append({"id": raw, "reason": "invalid", "challan_no": None})
+
+    archive_join, archive_case = "", ""
+    if archive_bounds():
+        archive_join = "LEFT JOIN archive.labels a ON a.id = p.id"
+        archive_case = "WHEN l.id IS NULL AND a.id IS NOT NULL THEN 'archived'"
+
     with get_db_connection() as conn:
-        cur = conn.cursor()
-        
-        # 1. Create Header
-        cur.execute("""
+        conn.execute("BEGIN IMMEDIATE")  # no other challan can take these pipes in between
+        _shipment_pick_table(conn, ids)
+
+        # 1. Validate: everything not in stock, or already on a challan
+        for row in conn.execute(f"""
+            SELECT p.id,
+                   CASE {archive_case}
+                        WHEN l.id IS NULL THEN 'not_found'
+                        WHEN l.dispatched_by IS 'rejected' THEN 'rejected'
+                        ELSE 'dispatched' END AS reason,
+                   l.challan_no
+            FROM temp.shipment_pick p
+            LEFT JOIN main.labels l ON l.id = p.id
+            {archive_join}
+            WHERE l.id IS NULL OR NOT ({_SHIPPABLE})
+            ORDER BY p.id
+        """):
+            rejected.append(dict(row))
+        if rejected:
+            conn.execute(f"""
+                DELETE FROM temp.shipment_pick
+                WHERE NOT EXISTS (SELECT 1 FROM main.labels l WHERE l.id = shipment_pick.id AND {_SHIPPABLE})
+            """)
+
+        # 2. Totals from the labels themselves
+        total_qty, total_wt = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(l.weight_g), 0)
+            FROM temp.shipment_pick p CROSS JOIN main.labels l ON l.id = p.id  -- CROSS: pick table outer, PK lookups
+        """).fetchone()
+        result = {"shipment_id": None, "created_at": timestamp, "total_pipes": total_qty,
+                  "total_weight": total_wt, "rejected": rejected}
+        if not total_qty:
+            conn.rollback()
+            return result
+
+        # 3. Header, then every pipe in one UPDATE
+        cur = conn.execute("""
             INSERT INTO shipments (customer_name, vehicle_no, customer_address, customer_mobile, driver_mobile, challan_no, total_pipes, total_weight, created_at)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (meta.get('customer'), meta.get('vehicle'), meta.get('address'), meta.get('customer_mobile'), meta.get('driver_mobile'), meta.get('challan_no'), total_qty, total_wt, timestamp))
-        shipment_id = cur.lastrowid
-        
-        # 2. Update all Labels
-        # Prepare data for a bulk update: (dispatched_at, dispatched_by, shipment_id, id)
-        update_data = [(timestamp, 'DispatchHub', shipment_id, i['id']) for i in items]
-        
-        # Use executemany for a single, efficient bulk update operation
-        cur.executemany("""
-            UPDATE labels 
-            SET dispatched_at=?, dispatched_by=?, shipment_id=? 
-            WHERE id=?
-        """, update_data)
-            
+        """, (meta.get('customer'), meta.get('vehicle'), meta.get('address'), meta.get('customer_mobile'), meta.get('driver_mobile'), challan_no, total_qty, total_wt, timestamp))
+        result["shipment_id"] = cur.lastrowid
+        conn.execute("""
+            UPDATE labels
+            SET dispatched_at=?, dispatched_by='DispatchHub', shipment_id=?, challan_no=?
+            WHERE id IN (SELECT id FROM temp.shipment_pick)
+        """, (timestamp, result["shipment_id"], challan_no))
+        dispatched = [r[0] for r in conn.execute("SELECT id FROM temp.shipment_pick")]
+        conn.execute("DELETE FROM temp.shipment_pick")
         conn.commit()
-        return shipment_id, timestamp
+    invalidate_labels(dispatched)
+    bump_data_generation()
+    return result
 
 def mark_dispatched(label_id, dispatched_by="Scanner"):
     # Legacy function for single scan (Scan Page)
     with get_db_connection() as conn:
         conn.execute("UPDATE labels SET dispatched_at=?, dispatched_by=? WHERE id=?", 
                      (datetime.datetime.now().isoformat(), dispatched_by, label_id))
+    invalidate_labels([label_id])
+    bump_data_generation()
 
 def get_shipment_history():
     with get_db_connection() as conn:
@@ -185,7 +1126,7 @@ def get_shipment_details(shipment_id):
         if not shipment: return None
         
         # 2. Get the ACTUAL pipes currently assigned to this shipment
-        pipes = conn.execute("SELECT * FROM labels WHERE shipment_id = ?", (shipment_id,)).fetchall()
+        pipes = conn.execute(f"SELECT * FROM {_labels_with_archive()} WHERE shipment_id = ?", (shipment_id,)).fetchall()
         
         # --- AUTO-REPAIR COUNTS ---
         real_count = len(pipes)
@@ -196,6 +1137,7 @@ def get_shipment_details(shipment_id):
             conn.execute("UPDATE shipments SET total_pipes=?, total_weight=? WHERE id=?", 
                          (real_count, real_weight, shipment_id))
             conn.commit()
+            bump_data_generation()
             
             # Update the variable so the UI sees the fixed number immediately
             shipment = dict(shipment)
@@ -218,19 +1160,148 @@ def delete_shipment(shipment_id):
         cur = conn.cursor()
         
         # 1. Find all labels for the shipment and return them to stock.
-        cur.execute("UPDATE labels SET dispatched_at = NULL, dispatched_by = NULL, shipment_id = NULL WHERE shipment_id = ?", (shipment_id,))
+        cur.execute("UPDATE labels SET dispatched_at = NULL, dispatched_by = NULL, shipment_id = NULL, challan_no = NULL WHERE shipment_id = ?", (shipment_id,))
         
         # 2. Delete the shipment record itself.
         cur.execute("DELETE FROM shipments WHERE id = ?", (shipment_id,))
         deleted_count = cur.rowcount
         conn.commit()
+        invalidate_labels()  # rare; not worth collecting the ids
+        bump_data_generation()
         return deleted_count > 0
 
-def run_cleanup():
+# --- ARCHIVE OPERATIONS ---
+_archive_lock = threading.Lock()
+
+def archive_labels(days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Moves eligible labels (ARCHIVE_ELIGIBLE with horizon = now - `days`) to
+    the archive, `batch_size` ids at a time. Each batch is
+      1. copied into archive.labels (archive file only),
+      2. deleted from labels where the copy is identical, with the run's
+         checkpoint (archive_runs.last_id) in the same transaction,
+      3. dropped from the archive again if the label changed in between.
+    An interrupted run is resumed by the next call with its own horizon.
+    Returns {"run_id", "horizon", "moved"}.
+    """
+    global _archive_bounds
+    if not ARCHIVE_ENABLED:
+        raise RuntimeError("archive is disabled")
+    if not _archive_lock.acquire(blocking=False):
+        raise RuntimeError("an archive run is already in progress")
+    try:
+        cols = ", ".join(_label_columns)
+        same = " AND ".join(f"a.{c} IS l.{c}" for c in _label_columns)
+        counters = ("total", "stock", "dispatched", "rejected",
+                    "total_weight", "stock_weight", "dispatched_weight", "rejected_weight")
+        now = datetime.datetime.now()
+        with _archive_writer() as db:
+            # Rows in both files come from a batch cut off between steps 1 and 2: the hot copy wins
+            db.execute("DELETE FROM archive.labels WHERE id IN (SELECT id FROM main.labels)")
+            run = db.execute("SELECT * FROM archive_runs WHERE state = 'running' ORDER BY id DESC LIMIT 1").fetchone()
+            if run:
+                run_id, horizon, last_id, moved = run['id'], run['horizon'], run['last_id'], run['moved']
+                print(f"📦 Resuming archive run #{run_id} after id {last_id}")
+            else:
+                horizon = (now - datetime.timedelta(days=days)).isoformat()
+                last_id = moved = 0
+                run_id = db.execute("INSERT INTO archive_runs (horizon, started_at, updated_at) VALUES (?, ?, ?)",
+                                    (horizon, now.isoformat(), now.isoformat())).lastrowid
+            try:
+                while True:
+                    ids = [r[0] for r in db.execute(
+                        f"SELECT id FROM main.labels WHERE id > :last AND {ARCHIVE_ELIGIBLE} ORDER BY id LIMIT :n",
+                        {"last": last_id, "horizon": horizon, "n": batch_size})]
+                    if not ids:
+                        break
+                    id_list = ",".join(str(int(i)) for i in ids)  # integers from the table itself
+
+                    db.execute("BEGIN")
+                    db.execute(f"""
+                        INSERT OR REPLACE INTO archive.labels ({cols})
+                        SELECT {cols} FROM main.labels WHERE id IN ({id_list}) AND {ARCHIVE_ELIGIBLE}
+                    """, {"horizon": horizon})
+                    db.execute("COMMIT")
+
+                    # Only rows still exactly as copied (so still eligible) leave labels
+                    db.execute("BEGIN IMMEDIATE")
+                    gone = [r[0] for r in db.execute(f"""
+                        SELECT l.id FROM main.labels l JOIN archive.labels a ON a.id = l.id
+                        WHERE l.id IN ({id_list}) AND {same}
+                    """)]
+                    if gone:
+                        gone_list = ",".join(str(i) for i in gone)
+                        db.execute(f"DELETE FROM main.labels WHERE id IN ({gone_list})")
+                        # The delete trigger took these out of stock_summary; they still count
+                        for row in _stock_summary_from_labels(db, "archive.labels", f"id IN ({gone_list})"):
+                            db.execute(f"""
+                                UPDATE stock_summary SET {", ".join(f"{c} = {c} + ?" for c in counters)}
+                                WHERE {" AND ".join(f"{k} IS ?" for k in SUMMARY_KEY)}
+                            """, [row[c] for c in counters] + [row[k] for k in SUMMARY_KEY])
+                    last_id, moved = ids[-1], moved + len(gone)
+                    db.execute("UPDATE archive_runs SET last_id = ?, moved = ?, updated_at = ? WHERE id = ?",
+                               (last_id, moved, datetime.datetime.now().isoformat(), run_id))
+                    db.execute("COMMIT")
+
+                    db.execute(f"DELETE FROM archive.labels WHERE id IN ({id_list}) AND id IN (SELECT id FROM main.labels)")
+                    _archive_bounds = None  # these labels are only in the archive now
+                    invalidate_labels(gone)
+                db.execute("UPDATE archive_runs SET state = 'done', finished_at = ?, updated_at = ? WHERE id = ?",
+                           (datetime.datetime.now().isoformat(), datetime.datetime.now().isoformat(), run_id))
+            except Exception as e:
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+                db.execute("UPDATE archive_runs SET error = ?, updated_at = ? WHERE id = ?",
+                           (str(e), datetime.datetime.now().isoformat(), run_id))
+                raise
+            finally:
+                _archive_bounds = None
+                bump_data_generation()
+        return {"run_id": run_id, "horizon": horizon, "moved": moved}
+    finally:
+        _archive_lock.release()
+
+def archive_running():
+    return _archive_lock.locked()
+
+def get_archive_status(limit=10):
     with get_db_connection() as conn:
-        conn.execute("DELETE FROM labels WHERE created_at < date('now', '-30 days')")
+        runs = [dict(r) for r in conn.execute("SELECT * FROM archive_runs ORDER BY id DESC LIMIT ?", (limit,))]
+        hot = conn.execute("SELECT COUNT(*) FROM main.labels").fetchone()[0]
+    bounds = archive_bounds() or {"count": 0, "created": None, "dispatched": None}
+    return {"running": archive_running(), "hot_labels": hot, "archived_labels": bounds["count"],
+            "archive_newest_created": bounds["created"], "archive_newest_dispatched": bounds["dispatched"],
+            "after_days": ARCHIVE_AFTER_DAYS, "archive_db": ARCHIVE_DB, "runs": runs}
 
 # --- FILTERING & REPORTING ---
+def _day_after(day):
+    """'2026-04-03' -> '2026-04-04'. None if the value is not a YYYY-MM-DD date."""
+    try:
+        return (datetime.date.fromisoformat(str(day)) + datetime.timedelta(days=1)).isoformat()
+    except ValueError:
+        return None
+
+def _hour_bound(day, hour):
+    """ISO string that sorts before every timestamp at or after `hour` on `day`."""
+    if hour >= 24: return _day_after(day)
+    return f"{day}T{max(hour, 0):02d}"
+
+def _add_date_equals(conditions, params, field, day, next_day):
+    """date(field) = day. Returns True when it could be written as an index range."""
+    if not next_day:
+        conditions.append(f"date({field}) = ?"); params.append(day)
+        return False
+    conditions.append(f"{field} >= ? AND {field} < ?")
+    params.extend([day, next_day])
+    return True
+
+def _add_date_upto(conditions, params, field, day, next_day):
+    """date(field) <= day"""
+    if not next_day:
+        conditions.append(f"date({field}) <= ?"); params.append(day)
+        return
+    conditions.append(f"{field} < ?"); params.append(next_day)
+
 def build_where_clause(args):
     conditions = ["1=1"]
     params = []
@@ -252,29 +1323,35 @@ def build_where_clause(args):
     time_range = args.get('time_range')
     status = args.get('status')
     
+    # Dates are compared as half-open ISO ranges (col >= 'D' AND col < 'D+1')
+    # instead of date(col) = ?, so the label indexes can be used.
+    next_day = _day_after(target_date) if target_date else None
+    day_bounds = {}  # field -> day, when a field is pinned to a single day
+
     # --- 🕒 TIME MACHINE LOGIC ---
     if target_date and report_type == 'inventory':
         if status == 'stock':
-            conditions.append("date(created_at) <= ?")
-            params.append(target_date)
-            conditions.append("(dispatched_at IS NULL OR date(dispatched_at) > ?)")
-            params.append(target_date)
+            _add_date_upto(conditions, params, "created_at", target_date, next_day)
+            if next_day:
+                conditions.append("(dispatched_at IS NULL OR dispatched_at >= ?)")
+                params.append(next_day)
+            else:
+                conditions.append("(dispatched_at IS NULL OR date(dispatched_at) > ?)")
+                params.append(target_date)
             conditions.append("(dispatched_by IS NULL OR dispatched_by != 'rejected')") # Hide rejected
             
         elif status == 'dispatched':
-            conditions.append("date(dispatched_at) = ?")
-            params.append(target_date)
+            if _add_date_equals(conditions, params, "dispatched_at", target_date, next_day):
+                day_bounds["dispatched_at"] = target_date
             conditions.append("(dispatched_by IS NULL OR dispatched_by != 'rejected')") # Hide rejected
             
         elif status == 'rejected':
             conditions.append("dispatched_by = 'rejected'")
-            conditions.append("date(created_at) <= ?")
-            params.append(target_date)
+            _add_date_upto(conditions, params, "created_at", target_date, next_day)
             
         else:
             # 'All' status
-            conditions.append("date(created_at) <= ?")
-            params.append(target_date)
+            _add_date_upto(conditions, params, "created_at", target_date, next_day)
     else:
         # --- NORMAL LOGIC ---
         if status == 'stock': 
@@ -287,20 +1364,34 @@ def build_where_clause(args):
         # Date logic defaults to created_at for everything except dispatch reports
         date_field = "dispatched_at" if report_type == 'dispatch' else "created_at"
         if from_date and to_date:
-            conditions.append(f"date({date_field}) >= ? AND date({date_field}) <= ?")
-            params.extend([from_date, to_date])
+            after_to = _day_after(to_date)
+            if _day_after(from_date) and after_to:
+                conditions.append(f"{date_field} >= ? AND {date_field} < ?")
+                params.extend([from_date, after_to])
+                if from_date == to_date:
+                    day_bounds[date_field] = from_date
+            else:
+                conditions.append(f"date({date_field}) >= ? AND date({date_field}) <= ?")
+                params.extend([from_date, to_date])
         elif target_date: 
-            conditions.append(f"date({date_field}) = ?"); params.append(target_date)
-
-    # --- TIME RANGE LOGIC (Hour by hour) ---
-    # ... (keep your existing time_range code here)
+            if _add_date_equals(conditions, params, date_field, target_date, next_day):
+                day_bounds[date_field] = target_date
 
     # --- TIME RANGE LOGIC (Hour by hour) ---
     if time_range:
         date_field = "dispatched_at" if (report_type == 'dispatch' or status == 'dispatched') else "created_at"
         try:
             start_h, end_h = map(int, time_range.split('-'))
-            if start_h < end_h:
+            day = day_bounds.get(date_field)
+            if day:
+                # Field is already pinned to one day: the hours become a range on it too
+                lo, hi = _hour_bound(day, start_h), _hour_bound(day, end_h)
+                if start_h < end_h:
+                    conditions.append(f"{date_field} >= ? AND {date_field} < ?")
+                else:
+                    conditions.append(f"({date_field} >= ? OR {date_field} < ?)")
+                params.append(lo); params.append(hi)
+            elif start_h < end_h:
                 conditions.append(f"CAST(strftime('%H', {date_field}) AS INT) >= ? AND CAST(strftime('%H', {date_field}) AS INT) < ?")
                 params.append(start_h); params.append(end_h)
             else:
@@ -311,21 +1402,34 @@ def build_where_clause(args):
     if report_type == 'dispatch': conditions.append("dispatched_at IS NOT NULL")
     
     return " AND ".join(conditions), params
+def _label_page_query(where, limit_clause, source="labels"):
+    """Detail rows, newest first. challan_no is read from the labels row itself."""
+    return f"""
+        SELECT * FROM {source}
+        WHERE {where}
+        ORDER BY created_at DESC, id DESC
+        {limit_clause}
+    """
+
 def fetch_inventory_data(args):
     where, params = build_where_clause(args)
+    source = label_source(args)
     
     if args.get('grouped') == 'true':
         # SUMMARY VIEW: No pagination needed (Groups all records)
         query = f"""
             SELECT pipe_name, size, color, pressure_class, weight_g,
                    COUNT(*) as count, SUM(weight_g) as total_weight, AVG(weight_g) as avg_weight 
-            FROM labels WHERE {where} 
+            FROM {source} WHERE {where} 
             GROUP BY pipe_name, size, color, pressure_class, weight_g
             ORDER BY pipe_name, size
         """
         with get_db_connection() as conn:
             rows = conn.execute(query, params).fetchall()
         return [dict(r) for r in rows]
+    elif 'cursor' in args:
+        # DETAIL VIEW (keyset): same cost for every page, see fetch_inventory_page
+        return fetch_inventory_page(where, params, args, source)
     else:
         # DETAIL VIEW: Time for Pagination!
         page = int(args.get('page', 1))
@@ -333,17 +1437,10 @@ def fetch_inventory_data(args):
         offset = (page - 1) * per_page
         
         # 1. Get the TOTAL count of pipes matching the filters
-        count_query = f"SELECT COUNT(*) FROM labels WHERE {where}"
+        count_query = f"SELECT COUNT(*) FROM {source} WHERE {where}"
         
         # 2. Get ONLY the specific 100 pipes for the current page
-        data_query = f"""
-            SELECT labels.*, 
-                   (SELECT challan_no FROM shipments WHERE id = labels.shipment_id) as challan_no 
-            FROM labels 
-            WHERE {where} 
-            ORDER BY created_at DESC 
-            LIMIT ? OFFSET ?
-        """
+        data_query = _label_page_query(where, "LIMIT ? OFFSET ?", source)
         
         with get_db_connection() as conn:
             total_records = conn.execute(count_query, params).fetchone()[0]
@@ -357,12 +1454,129 @@ def fetch_inventory_data(args):
             "per_page": per_page,
             "total_pages": (total_records + per_page - 1) // per_page if per_page > 0 else 1
         }
+
+# --- EXPORT ---
+# /api/export streams every matching row, so it reads through its own
+# connection (not the pooled one, which the request hands back on teardown
+# while the response is still being sent) with fetchmany().
+EXPORT_FETCH_ROWS = 500
+GROUPED_EXPORT_COLUMNS = ["pipe_name", "size", "color", "pressure_class", "weight_g",
+                          "count", "total_weight", "avg_weight"]
+
+def export_columns(args):
+    """Columns /api/export can return for these filters (grouped or detail)."""
+    if args.get('grouped') == 'true':
+        return list(GROUPED_EXPORT_COLUMNS)
+    with get_db_connection() as conn:
+        return [r['name'] for r in conn.execute("PRAGMA table_info(labels)")]
+
+def iter_export_rows(args, columns):
+    """
+    Yields row tuples for `columns` (a subset of export_columns(args)),
+    newest first for the detail view. Same filters as fetch_inventory_data,
+    without the paging.
+    """
+    where, params = build_where_clause(args)
+    source = label_source(args)
+    select = ", ".join(f'"{c}"' for c in columns)
+    if args.get('grouped') == 'true':
+        query = f"""
+            SELECT {select} FROM (
+                SELECT pipe_name, size, color, pressure_class, weight_g,
+                       COUNT(*) as count, SUM(weight_g) as total_weight, AVG(weight_g) as avg_weight
+                FROM {source} WHERE {where}
+                GROUP BY pipe_name, size, color, pressure_class, weight_g
+                ORDER BY pipe_name, size
+            )
+        """
+    else:
+        query = f"SELECT {select} FROM {source} WHERE {where} ORDER BY created_at DESC, id DESC"
+    conn = _open_connection()
+    try:
+        cur = conn.execute(query, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_ROWS)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+    finally:
+        conn.close()
+
+# --- KEYSET PAGINATION ---
+# Pages are keyed on (created_at, id) instead of OFFSET, so page 50 reads
+# exactly as many rows as page 1. The cursor is opaque to the client.
+COUNT_CACHE_TTL = 30  # seconds
+MAX_PAGE_SIZE = 1000  # per_page above this is capped; clients follow next_cursor
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+def _encode_cursor(row):
+    raw = json.dumps([row['created_at'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def _decode_cursor(cursor):
+    try:
+        created_at, label_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(created_at), int(label_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _cached_count(conn, where, params, source="labels"):
+    """COUNT(*) for a filter, reused for COUNT_CACHE_TTL seconds or until the next write."""
+    key = (data_generation(), source, where, tuple(params))
+    now = time.monotonic()
+    with _count_cache_lock:
+        hit = _count_cache.get(key)
+        if hit and now - hit[1] < COUNT_CACHE_TTL:
+            return hit[0]
+    total = conn.execute(f"SELECT COUNT(*) FROM {source} WHERE {where}", params).fetchone()[0]
+    with _count_cache_lock:
+        if len(_count_cache) > 256: _count_cache.clear()
+        _count_cache[key] = (total, now)
+    return total
+
+def fetch_inventory_page(where, params, args, source="labels"):
+    """
+    Cursor mode of the detail view. Pass cursor= (empty) for the first page and
+    the returned next_cursor for the following ones; next_cursor is None on
+    the last page. The total is only counted when with_total=true (or on the
+    first page) and is cached briefly.
+    """
+    per_page = int(args.get('per_page', 100))
+    if per_page < 1:
+        raise ValueError("per_page must be at least 1")
+    per_page = min(per_page, MAX_PAGE_SIZE)
+    cursor = args.get('cursor') or ''
+    want_total = args.get('with_total', 'true' if not cursor else 'false') == 'true'
+
+    page_where, page_params = where, list(params)
+    if cursor:
+        created_at, label_id = _decode_cursor(cursor)
+        page_where += " AND (created_at, id) < (?, ?)"
+        page_params += [created_at, label_id]
+
+    data_query = _label_page_query(page_where, "LIMIT ?", source)
+    with get_db_connection() as conn:
+        rows = conn.execute(data_query, page_params + [per_page + 1]).fetchall()
+        total = _cached_count(conn, where, params, source) if want_total else None
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    return {
+        "items": [dict(r) for r in rows],
+        "per_page": per_page,
+        "next_cursor": _encode_cursor(rows[-1]) if has_more else None,
+        "total": total
+    }
 def delete_label(label_id):
     """Permanently removes a pipe from the database."""
     with get_db_connection() as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM labels WHERE id = ?", (label_id,))
         conn.commit()
+        invalidate_labels([label_id])
+        bump_data_generation()
         return cur.rowcount > 0
 # --- ADD AT THE BOTTOM OF services.py ---
 
@@ -370,33 +1584,19 @@ def delete_label(label_id):
 
 def get_stats():
     with get_db_connection() as conn:
-        total = conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
-        
-        # Updated: Only count actual successful dispatches
-        dispatched = conn.execute("SELECT COUNT(*) FROM labels WHERE dispatched_at IS NOT NULL AND (dispatched_by IS NULL OR dispatched_by != 'rejected')").fetchone()[0]
-        
-        # Updated: Calculate accurate current stock (ignoring rejected)
-        current_stock = conn.execute("SELECT COUNT(*) FROM labels WHERE dispatched_at IS NULL AND (dispatched_by IS NULL OR dispatched_by != 'rejected')").fetchone()[0]
+        # Totals and the per-SKU summary come from the trigger-maintained stock_summary
+        totals = conn.execute("SELECT IFNULL(SUM(total), 0), IFNULL(SUM(dispatched), 0), IFNULL(SUM(stock), 0) FROM stock_summary").fetchone()
+        total, dispatched, current_stock = totals
         
         # --- 1. NORMAL STOCK SUMMARY ---
+        # weight_g is part of the key, so the average stock weight is weight_g itself
         stock_summ = conn.execute("""
             SELECT pipe_name, size, color, pressure_class, weight_g,
-                COUNT(*) as total, 
-                SUM(CASE 
-                        WHEN dispatched_at IS NULL 
-                        AND (dispatched_by IS NULL OR dispatched_by != 'rejected') 
-                        THEN 1 ELSE 0 END) as stock,
-
-                AVG(
-                        CASE 
-                            WHEN dispatched_at IS NULL 
-                            AND (dispatched_by IS NULL OR dispatched_by != 'rejected') 
-                            THEN weight_g 
-                        END
-                ) as avg_weight
-
-            FROM labels 
-            GROUP BY pipe_name, size, color, pressure_class, weight_g
+                   total, stock,
+                   CASE WHEN stock > 0 THEN weight_g END as avg_weight
+            FROM stock_summary
+            WHERE total > 0
+            ORDER BY pipe_name, size, color, pressure_class, weight_g
         """).fetchall()
         
         prod = conn.execute("SELECT date(created_at) as day, COUNT(*) as count FROM labels WHERE created_at >= date('now', '-7 days') GROUP BY day").fetchall()
@@ -450,13 +1650,19 @@ def add_extra_items_to_shipment(shipment_id, pipe_ids):
         # Mark them as Dispatched
         timestamp = datetime.datetime.now().isoformat()
         update_placeholders = ','.join(['?'] * len(valid_ids))
-        cur.execute(f"UPDATE labels SET dispatched_at=?, dispatched_by='EditAdd', shipment_id=? WHERE id IN ({update_placeholders})", (timestamp, shipment_id, *valid_ids))
+        cur.execute(f"""
+            UPDATE labels SET dispatched_at=?, dispatched_by='EditAdd', shipment_id=?,
+                              challan_no=(SELECT challan_no FROM shipments WHERE id = ?)
+            WHERE id IN ({update_placeholders})
+        """, (timestamp, shipment_id, shipment_id, *valid_ids))
         
         # Update Shipment Totals
-        stats = cur.execute("SELECT COUNT(*), SUM(weight_g) FROM labels WHERE shipment_id=?", (shipment_id,)).fetchone()
+        stats = cur.execute(f"SELECT COUNT(*), SUM(weight_g) FROM {_labels_with_archive()} WHERE shipment_id=?", (shipment_id,)).fetchone()
         cur.execute("UPDATE shipments SET total_pipes=?, total_weight=? WHERE id=?", (stats[0], stats[1] if stats[1] else 0, shipment_id))
         
         conn.commit()
+        invalidate_labels(valid_ids)
+        bump_data_generation()
         return True, f"Successfully added {len(valid_ids)} pipes."
 
 # --- 1. Get Full Shipment Details (Meta + Items) ---
@@ -467,7 +1673,7 @@ def get_shipment_full_details(challan_no):
         if not shipment: return None
         
         # Get the Pipes currently inside it
-        pipes = conn.execute("SELECT * FROM labels WHERE shipment_id = ?", (shipment['id'],)).fetchall()
+        pipes = conn.execute(f"SELECT * FROM {_labels_with_archive()} WHERE shipment_id = ?", (shipment['id'],)).fetchall()
         
         return {
             "meta": dict(shipment),
@@ -484,15 +1690,17 @@ def remove_pipe_from_shipment(pipe_id):
         s_id = pipe['shipment_id']
         
         # 2. "Undispatch" the pipe (Set to NULL)
-        conn.execute("UPDATE labels SET dispatched_at = NULL, dispatched_by = NULL, shipment_id = NULL WHERE id = ?", (pipe_id,))
+        conn.execute("UPDATE labels SET dispatched_at = NULL, dispatched_by = NULL, shipment_id = NULL, challan_no = NULL WHERE id = ?", (pipe_id,))
         
         # 3. Recalculate Shipment Totals
-        stats = conn.execute("SELECT COUNT(*), SUM(weight_g) FROM labels WHERE shipment_id=?", (s_id,)).fetchone()
+        stats = conn.execute(f"SELECT COUNT(*), SUM(weight_g) FROM {_labels_with_archive()} WHERE shipment_id=?", (s_id,)).fetchone()
         new_count = stats[0]
         new_weight = stats[1] if stats[1] else 0
         
         conn.execute("UPDATE shipments SET total_pipes=?, total_weight=? WHERE id=?", (new_count, new_weight, s_id))
         conn.commit()
+        invalidate_labels([pipe_id])
+        bump_data_generation()
         
         return True, "Pipe removed and stock restored."
 
@@ -535,56 +1743,36 @@ def process_return_voucher(pipe_ids):
             wt = row['wt'] if row['wt'] else 0
             cursor.execute("UPDATE shipments SET total_pipes = MAX(0, total_pipes - ?), total_weight = MAX(0, total_weight - ?) WHERE id = ?", (qty, wt, s_id))
         
-        # --- STEP 3: Create Voucher Record (WITH Challan info) ---
+        # --- STEP 3: Create Voucher Record (WITH Challan info), one item row per pipe ---
         timestamp = datetime.datetime.now().isoformat()
-        ids_string = json.dumps(pipe_ids)
         
         cursor.execute("""
-            INSERT INTO return_vouchers (created_at, total_pipes, pipe_ids_json, challan_source) 
-            VALUES (?, ?, ?, ?)
-        """, (timestamp, len(pipe_ids), ids_string, challan_source_str))
+            INSERT INTO return_voucher_headers (created_at, total_pipes, challan_source) 
+            VALUES (?, ?, ?)
+        """, (timestamp, len(pipe_ids), challan_source_str))
         
         new_voucher_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO return_voucher_items (voucher_id, position, pipe_id) VALUES (?, ?, ?)",
+                           [(new_voucher_id, n, pipe_id) for n, pipe_id in enumerate(pipe_ids)])
         
         # --- STEP 4: Reset Pipes (Back to Stock) ---
         cursor.execute(f"""
             UPDATE labels 
-            SET dispatched_at = NULL, shipment_id = NULL, dispatched_by = NULL 
+            SET dispatched_at = NULL, shipment_id = NULL, dispatched_by = NULL, challan_no = NULL 
             WHERE id IN ({placeholders})
         """, pipe_ids)
         
         conn.commit()
+        invalidate_labels(pipe_ids)
+        bump_data_generation()
         
         return True, new_voucher_id
 
-def _ensure_verify_table():
-    """Creates the verification_vouchers table if it doesn't exist."""
-    with get_db_connection() as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS verification_vouchers (
-                id              INTEGER PRIMARY KEY AUTOINCREMENT,
-                created_at      TEXT,
-                filter_info     TEXT,
-                expected_count  INTEGER,
-                scanned_count   INTEGER,
-                missing_count   INTEGER,
-                extra_count     INTEGER,
-                expected_ids    TEXT,
-                scanned_ids     TEXT,
-                missing_ids     TEXT,
-                extra_ids       TEXT,
-                notes           TEXT
-            )
-        """)
-
-
 def create_verification_voucher(payload):
     """
     Saves a verification session voucher.
     Returns the new voucher ID.
     """
-    _ensure_verify_table()
-
     timestamp     = datetime.datetime.now().isoformat()
     filter_info   = json.dumps(payload.get('filter', {}))
     expected_ids  = payload.get('expected_ids', [])
@@ -596,11 +1784,10 @@ def create_verification_voucher(payload):
     with get_db_connection() as conn:
         cur = conn.cursor()
         cur.execute("""
-            INSERT INTO verification_vouchers
+            INSERT INTO verification_voucher_headers
             (created_at, filter_info, expected_count, scanned_count,
-             missing_count, extra_count, expected_ids, scanned_ids,
-             missing_ids, extra_ids, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+             missing_count, extra_count, notes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         """, (
             timestamp,
             filter_info,
@@ -608,21 +1795,75 @@ def create_verification_voucher(payload):
             len(scanned_ids),
             len(missing_ids),
             len(extra_ids),
-            json.dumps(expected_ids),
-            json.dumps(scanned_ids),
-            json.dumps(missing_ids),
-            json.dumps(extra_ids),
             notes
         ))
+        voucher_id = cur.lastrowid
+        lists = {"expected": expected_ids, "scanned": scanned_ids, "missing": missing_ids, "extra": extra_ids}
+        cur.executemany("""
+            INSERT INTO verification_voucher_items (voucher_id, kind, position, pipe_id) VALUES (?, ?, ?, ?)
+        """, [(voucher_id, kind, n, pipe_id) for kind in VERIFY_ITEM_KINDS for n, pipe_id in enumerate(lists[kind])
+              if pipe_id is not None])
         conn.commit()
-        return cur.lastrowid
+        return voucher_id
 
 
 def get_verification_vouchers():
     """Returns all verification vouchers, newest first."""
-    _ensure_verify_table()
     with get_db_connection() as conn:
         rows = conn.execute(
             "SELECT * FROM verification_vouchers ORDER BY created_at DESC"
         ).fetchall()
-        return [dict(r) for r in rows]
\ No newline at end of file
+        return [dict(r) for r in rows]
+
+
+def get_pipe_voucher_history(pipe_id):
+    """
+    Every voucher one pipe appears on, newest first:
+    {"returns": [header...], "verifications": [header + "kinds"]}, kinds being
+    which of the voucher's lists (expected/scanned/missing/extra) hold the pipe.
+    """
+    with get_db_connection() as conn:
+        returns = conn.execute("""
+            SELECT h.* FROM return_voucher_items i JOIN return_voucher_headers h ON h.id = i.voucher_id
+            WHERE i.pipe_id = ? GROUP BY h.id ORDER BY h.id DESC
+        """, (pipe_id,)).fetchall()
+        verifications = conn.execute("""
+            SELECT h.*, group_concat(i.kind) AS kinds
+            FROM verification_voucher_items i JOIN verification_voucher_headers h ON h.id = i.voucher_id
+            WHERE i.pipe_id = ? GROUP BY h.id ORDER BY h.id DESC
+        """, (pipe_id,)).fetchall()
+    checks = []
+    for row in verifications:
+        check = dict(row)
+        kinds = set(check['kinds'].split(","))
+        check['kinds'] = [k for k in VERIFY_ITEM_KINDS if k in kinds]
+        checks.append(check)
+    return {"returns": [dict(r) for r in returns], "verifications": checks}
+
+
+def get_missing_by_sku(args=None, limit=50):
+    """
+    How often pipes went missing in verifications, per (pipe_name, size,
+    color, pressure_class), most missed first. `args` may narrow it to one
+    SKU with name/size/color/pressure, like the inventory filters. Pipes
+    that have since been archived are not counted.
+    """
+    args = args or {}
+    conditions, params = ["i.kind = 'missing'"], []
+    for key, col in (('name', 'pipe_name'), ('size', 'size'), ('color', 'color'), ('pressure', 'pressure_class')):
+        if args.get(key):
+            conditions.append(f"l.{col} = ?")
+            params.append(args.get(key))
+    with get_db_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT l.pipe_name, l.size, l.color, l.pressure_class,
+                   COUNT(*) AS missing, COUNT(DISTINCT i.pipe_id) AS pipes,
+                   COUNT(DISTINCT i.voucher_id) AS vouchers, MAX(h.created_at) AS last_missing_at
+            FROM verification_voucher_items i
+            JOIN labels l ON l.id = i.pipe_id
+            JOIN verification_voucher_headers h ON h.id = i.voucher_id
+            WHERE {" AND ".join(conditions)}
+            GROUP BY l.pipe_name, l.size, l.color, l.pressure_class
+            ORDER BY missing DESC LIMIT ?
+        """, params + [limit]).fetchall()
+    return [dict(r) for r in rows]
@@ -0,0 +1,156 @@
+import datetime
+import json
+import os
+import threading
+
+# --- GLOBAL SETTINGS STORE ---
+# The shared generate-page settings (chips, weight, auto_enabled) live in
+# memory with a version number that goes up on every change. Reads never
+# touch the disk or take a lock: (version, settings) is one tuple that
+# writers replace, never mutate.
+#
+# On disk:
+#   global_settings.json          snapshot {"version": n, "settings": {...}},
+#                                 replaced atomically (temp file + rename)
+#   global_settings.json.journal  one JSON line per change, appended and
+#                                 fsynced BEFORE the snapshot is replaced;
+#                                 its first line is a full checkpoint
+# Startup loads the snapshot and replays newer journal lines. A snapshot
+# that does not parse is kept as *.corrupt-<time> and the settings are
+# rebuilt from the journal alone.
+JOURNAL_COMPACT_LINES = 500
+
+
+class SettingsStore:
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self._state = (0, {})
+        self._journal_lines = 0
+        self._journal_torn = False
+        self._write_lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._load()
+
+    # --- reads ---
+    @property
+    def version(self):
+        return self._state[0]
+
+    def get(self):
+        """(version, settings copy)."""
+        version, settings = self._state
+        return version, dict(settings)
+
+    def wait_for_change(self, since_version, timeout):
+        """Blocks until the version is above `since_version` or `timeout` passes. Returns get()."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._state[0] > since_version, timeout)
+        return self.get()
+
+    # --- writes ---
+    def update(self, changes):
+        """Merges `changes` in, persists them, and returns (version, settings)."""
+        if not isinstance(changes, dict):
+            raise ValueError("settings update must be a JSON object")
+        with self._write_lock:
+            version = self._state[0] + 1
+            merged = dict(self._state[1])
+            merged.update(changes)
+            self._append_journal({"v": version, "set": changes,
+                                  "at": datetime.datetime.now().isoformat()})
+            self._write_snapshot(version, merged)
+            with self._changed:
+                self._state = (version, merged)
+                self._changed.notify_all()
+            if self._journal_lines >= JOURNAL_COMPACT_LINES:
+                self._compact_journal()
+            return version, dict(merged)
+
+    # --- persistence ---
+    def _load(self):
+        version, settings, legacy = 0, {}, False
+        try:
+            with open(self.path) as f:
+                content = f.read().strip()
+            if content:
+                data = json.loads(content)
+                if isinstance(data, dict) and "version" in data and isinstance(data.get("settings"), dict):
+                    version, settings = int(data["version"]), data["settings"]
+                elif isinstance(data, dict):
+                    version, settings, legacy = 1, data, True  # old flat global_settings.json
+                else:
+                    raise ValueError("settings file is not a JSON object")
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            kept = f"{self.path}.corrupt-{datetime.datetime.now():%Y%m%d-%H%M%S}"
+            try:
+                os.replace(self.path, kept)
+            except OSError:
+                kept = None
+            print(f"⚠️ Settings file corrupted ({e}). Kept as {kept}; recovering from journal.")
+
+        version, settings, replayed = self._replay_journal(version, settings)
+        self._state = (version, settings)
+        if replayed or legacy or not os.path.exists(self.path):
+            self._write_snapshot(version, settings)
+        if replayed:
+            print(f"Recovered settings: replayed {replayed} journal entr{'y' if replayed == 1 else 'ies'} (version {version})")
+        if self._journal_lines == 0 or self._journal_torn:
+            # rewrite so the next append does not land on a torn line
+            self._compact_journal()
+
+    def _replay_journal(self, version, settings):
+        replayed = 0
+        self._journal_lines = 0
+        self._journal_torn = False
+        try:
+            with open(self.journal_path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return version, settings, 0
+        settings = dict(settings)
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                self._journal_torn = True  # torn last line from a crash mid-append
+                continue
+            self._journal_lines += 1
+            if entry.get("v", 0) <= version:
+                continue
+            if "state" in entry:
+                settings = dict(entry["state"])
+            else:
+                settings.update(entry.get("set", {}))
+            version = entry["v"]
+            replayed += 1
+        return version, settings, replayed
+
+    def _append_journal(self, entry):
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_lines += 1
+
+    def _write_snapshot(self, version, settings):
+        _atomic_write(self.path, json.dumps({"version": version, "settings": settings}))
+
+    def _compact_journal(self):
+        # A single checkpoint line with the full state replaces the history
+        version, settings = self._state
+        checkpoint = {"v": version, "state": settings,
+                      "at": datetime.datetime.now().isoformat()}
+        _atomic_write(self.journal_path, json.dumps(checkpoint) + "\n")
+        self._journal_lines = 1
+
+
+def _atomic_write(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
@@ -61,6 +61,25 @@ async function authenticate(isAuto = false) {
 }
 
 // --- UTILITIES ---
+// Walks /api/inventory with keyset cursors until the last page.
+// Every request costs the same no matter how deep it is.
+async function fetchAllInventoryPages(params, pageSize = 500) {
+    let items = [];
+    let cursor = '';
+    do {
+        const pageParams = new URLSearchParams(params);
+        pageParams.set('per_page', pageSize);
+        pageParams.set('cursor', cursor);
+        pageParams.set('with_total', 'false');
+        const res = await fetch(`/api/inventory?${pageParams}`, { headers: AUTH_HEADER });
+        if (!res.ok) throw new Error("Server error");
+        const data = await res.json();
+        items = items.concat(data.items);
+        cursor = data.next_cursor;
+    } while (cursor);
+    return items;
+}
+
 function printContent(html, title, subtitle='') {
     const win = window.open('', '', 'height=800,width=1000');
     win.document.write(`<html><head><title>${title}</title><style>@page { size: A4; margin: 20mm; } body { font-family: sans-serif; color: #333; } table { width: 100%; border-collapse: collapse; font-size: 12px; } th, td { border: 1px solid #ddd; padding: 8px; text-align: left; } th { background-color: #f8fafc; } h1 { text-align: center; font-size: 20px; }</style></head><body><h1>${title}</h1><p style="text-align:center;">${subtitle}</p>${html}</body></html>`);
@@ -89,5 +108,10 @@ async function downloadFileWithAuth(url, filename) {
     }
 }
 
-function downloadBackup() { downloadFileWithAuth('/api/backup', 'pvc_factory.db'); }
-async function cleanData() { if(confirm("⚠️ Delete 30+ day old data?")) await fetch('/api/cleanup', { method: 'POST', headers: AUTH_HEADER }); showToast("Cleanup Done"); }
\ No newline at end of file
+function downloadBackup() { downloadFileWithAuth('/api/backup', 'pvc_factory-backup.tar.gz'); }
+async function cleanData() {
+    if (!confirm("📦 Move dispatched/rejected pipes older than 180 days to the archive?\n(They stay searchable in reports.)")) return;
+    const res = await fetch('/api/cleanup', { method: 'POST', headers: AUTH_HEADER });
+    const data = await res.json();
+    showToast(data.success ? "Archiving started" : (data.error || "Archive failed"), !data.success);
+}
\ No newline at end of file
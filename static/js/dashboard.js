@@ -22,18 +22,44 @@ function checkUrlFilters() {
     }
 }
 
+// Stats are pushed as 'stats_changed' events; the 10s poll only runs while
+// the event stream is down.
+let liveSubscription = null;
+let statsRefreshTimer = null;
+let statsRefreshPending = false;
+
+async function refreshStats() {
+    if(document.hidden) { statsRefreshPending = true; return; }
+    statsRefreshPending = false;
+    try {
+        const res = await fetch('/api/stats_summary', { headers: AUTH_HEADER });
+        if(res.ok) {
+            const data = await res.json();
+            updateDashboardUI(data);
+        }
+    } catch(e) { console.log("Silent refresh failed"); }
+}
+
+// A burst of writes (a shipment, a print run) becomes one refresh
+function scheduleStatsRefresh() {
+    if(statsRefreshTimer) return;
+    statsRefreshTimer = setTimeout(() => { statsRefreshTimer = null; refreshStats(); }, 1000);
+}
+
+document.addEventListener('visibilitychange', () => {
+    if(!document.hidden && statsRefreshPending) refreshStats();
+});
+
 function startLiveUpdates() {
-    if(pollingInterval) clearInterval(pollingInterval);
-    pollingInterval = setInterval(async () => {
-        if(document.hidden) return; 
-        try {
-            const res = await fetch('/api/stats_summary', { headers: AUTH_HEADER });
-            if(res.ok) {
-                const data = await res.json();
-                updateDashboardUI(data);
-            }
-        } catch(e) { console.log("Silent refresh failed"); }
-    }, 10000); 
+    if(liveSubscription) liveSubscription.close();
+    liveSubscription = subscribeLive(['stats_changed'], { stats_changed: scheduleStatsRefresh }, {
+        start: () => {
+            if(pollingInterval) clearInterval(pollingInterval);
+            pollingInterval = setInterval(refreshStats, 10000);
+        },
+        stop: () => { clearInterval(pollingInterval); pollingInterval = null; },
+        resync: scheduleStatsRefresh
+    });
 }
 
 function showTab(tabId) {
@@ -434,17 +460,12 @@ async function openDeadStockWindow(brand, size, color, pressure) {
         pressure: pressure || '', 
         status: 'stock',
         dead_stock: 'true', 
-        grouped: 'false',
-        page: 1,           
-        per_page: 1000     
+        grouped: 'false'
     });
 
     try {
-        const res = await fetch(`/api/inventory?${params}`, { headers: AUTH_HEADER });
-        if (!res.ok) throw new Error("Server error");
-        
-        const freshData = await res.json();
-        renderDetailTable(freshData.items, false);
+        const items = await fetchAllInventoryPages(params);
+        renderDetailTable(items, false);
         
         const paginationEl = document.getElementById('pagination-controls');
         if (paginationEl) paginationEl.style.display = 'none';
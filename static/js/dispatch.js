@@ -296,7 +296,8 @@ document.addEventListener('DOMContentLoaded', function() {
         setTimeout(() => scanStatus.textContent = '', 4000);
     }
 
-    async function handleScan(qrData) {
+    // `known`: {id: label} from lookupLabels() when a batch was resolved up front
+    async function handleScan(qrData, known) {
         let pipeId = null;
         const trimmedData = String(qrData || '').trim();
 
@@ -346,10 +347,12 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         try {
-            const response = await fetch(`/api/labels/${pipeId}`);
-            if (!response.ok) throw new Error(`Pipe ID ${pipeId} not found in database.`);
-            
-            const item = await response.json();
+            let item = known ? known[pipeId] : undefined;
+            if (!item) {
+                const response = await fetch(`/api/labels/${pipeId}`);
+                if (!response.ok) throw new Error(`Pipe ID ${pipeId} not found in database.`);
+                item = await response.json();
+            }
 
             // --- FIX 1: DOUBLE CHECK (The Safety Guard) ---
             if (scannedIds.has(item.id)) {
@@ -587,21 +590,57 @@ document.addEventListener('DOMContentLoaded', function() {
     scanInput.focus();
 
     // ================= ESP AUTO SCAN =================
+    async function lookupLabels(ids) {
+        try {
+            const res = await fetch('/api/labels/lookup', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ids })
+            });
+            if (!res.ok) return null;
+            const data = await res.json();
+            const byId = {};
+            for (const label of data.labels) byId[label.id] = label;
+            return byId;
+        } catch (e) {
+            return null;  // handleScan falls back to one GET per pipe
+        }
+    }
+
+    // Our own cursor in the server's scan ring; null = resume where this page's consumer left off
+    let espAfter = null;
+    let espFetching = false;
+    let espPending = false;   // an esp_scans event arrived mid-fetch
+
     async function fetchESP() {
+        if (espFetching) { espPending = true; return; }  // the running fetch goes round again
+        espFetching = true;
         try {
-            const res = await fetch('/api/esp/fetch');
-            const ids = await res.json();
-            for (let id of ids) {
-                // Directly use existing scan logic
-                handleScan(String(id));
-            }
+            do {
+                espPending = false;
+                let url = '/api/esp/fetch?consumer=dispatch';
+                if (espAfter !== null) url += `&after=${espAfter}`;
+                const res = await fetch(url);
+                const data = await res.json();
+                if (data.dropped) console.log(`ESP: ${data.dropped} scans dropped from the ring before they were read`);
+                // One lookup for the whole batch instead of a GET per pipe
+                const known = data.items.length > 1 ? await lookupLabels(data.items.map(item => item.id)) : null;
+                for (let item of data.items) {
+                    // Directly use existing scan logic
+                    await handleScan(String(item.id), known);
+                }
+                espAfter = data.last_seq;
+            } while (espPending);  // scans pushed while this one ran
         } catch (e) {
             console.log("ESP Fetch Error:", e);
+        } finally {
+            espFetching = false;
         }
     }
 
     let espMode = false;
     let espInterval = null;
+    let espSubscription = null;
     const espBtn = document.getElementById('esp-toggle-btn');
 
     function loadEspState() {
@@ -621,8 +660,13 @@ document.addEventListener('DOMContentLoaded', function() {
         espBtn.classList.remove("btn-outline-primary");
         espBtn.classList.add("btn-success");
 
-        // Start polling
-        espInterval = setInterval(fetchESP, 1000);
+        // Scans are pushed as 'esp_scans' events; poll every 1s only while the stream is down
+        if (espSubscription) espSubscription.close();
+        espSubscription = subscribeLive(['esp_scans'], { esp_scans: fetchESP }, {
+            start: () => { espInterval = setInterval(fetchESP, 1000); },
+            stop: () => { clearInterval(espInterval); espInterval = null; },
+            resync: fetchESP
+        });
 
         setStatus("ESP Mode Activated", "success");
     }
@@ -635,6 +679,10 @@ document.addEventListener('DOMContentLoaded', function() {
         espBtn.classList.remove("btn-success");
         espBtn.classList.add("btn-outline-primary");
 
+        if (espSubscription) {
+            espSubscription.close();
+            espSubscription = null;
+        }
         if (espInterval) {
             clearInterval(espInterval);
             espInterval = null;
@@ -104,7 +104,7 @@ function getCurrentSettingsObj() {
         color: document.getElementById('color').value,
         pressure: document.getElementById('pressure').value,
         operator: document.getElementById('operator').value,
-        batch: "", // batch will be set to #<counter+1> when printing
+        batch: "", // the server assigns the counter's next free batch number
         weight_g: document.getElementById('weight_g').value || "0.000"
     };
 }
@@ -150,12 +150,34 @@ function loadCustoms() {
 }
 
 // --- COUNTER LOGIC ---
-setInterval(fetchCounter, 5000); // Check every 5 secs (Optimized)
+// Counter and settings changes are pushed over /api/events; the old
+// 5s / 12s polling only runs while that stream is down.
+let counterInterval = null;
+let settingsInterval = null;
+
+subscribeLive(['counter', 'settings'], {
+    counter: (data) => { if (!data.name || data.name === 'default') showCounter(data.count); },
+    settings: (remote) => applyRemoteSettings(remote)
+}, {
+    start: () => {
+        counterInterval = setInterval(fetchCounter, 5000);
+        settingsInterval = setInterval(pollSettings, 12000);
+    },
+    stop: () => {
+        clearInterval(counterInterval); counterInterval = null;
+        clearInterval(settingsInterval); settingsInterval = null;
+    },
+    resync: () => { fetchCounter(); pollSettings(); }
+});
+
+function showCounter(count) {
+    document.getElementById('pipeCounterDisplay').innerText = count;
+}
 
 async function fetchCounter() {
     try {
         const res = await fetch('/api/counter');
-        document.getElementById('pipeCounterDisplay').innerText = (await res.json()).count;
+        showCounter((await res.json()).count);
     } catch (e) {}
 }
 function loadCounter() { fetchCounter(); }
@@ -189,9 +211,9 @@ function clearWeight() {
 
 function submitForm() { document.getElementById('realSubmitBtn').click(); }
 
-function updatePreview(qrBase64 = null) {
+function updatePreview(qrUrl = null) {
     const s = getCurrentSettingsObj();
-    let qrHtml = qrBase64 ? `<img src="${qrBase64}">` : `<span style="color:#ccc; font-size:12px;">QR Code</span>`;
+    let qrHtml = qrUrl ? `<img src="${qrUrl}">` : `<span style="color:#ccc; font-size:12px;">QR Code</span>`;
 
     document.getElementById('previewArea').innerHTML = `
     <div class="label-visual">
@@ -215,25 +237,11 @@ document.getElementById('labelForm').addEventListener('submit', async (e) => {
 
     let payload = getCurrentSettingsObj();
     try {
-        // Get current counter and use next number for batch
-        try {
-            const cntRes = await fetch('/api/counter');
-            if (cntRes.ok) {
-                const cntData = await cntRes.json();
-                payload.batch = `#${cntData.count + 1}`;
-            } else {
-                payload.batch = payload.batch || '#1';
-            }
-        } catch (e) {
-            payload.batch = payload.batch || '#1';
-        }
-
         const res = await fetch('/api/labels', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(payload) });
         const data = await res.json();
         if (data.success) {
-            updatePreview(data.qr_image);
+            updatePreview(data.qr_url);
             await fetch('/api/print', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({ id: data.label.id, pressure: payload.pressure }) });
-            fetchCounter();
         }
     } catch (e) { alert("Error Printing"); }
 });
@@ -270,33 +278,42 @@ function updateAutoButtons(isOn) {
 }
 
 // --- LIVE SYNC (Also syncs Auto Button status) ---
-setInterval(function() {
-    fetch('/api/settings/get')
-        .then(res => res.json())
-        .then(remote => {
-            // Sync Chips
-            const fields = ['name', 'size', 'pressure', 'color', 'operator'];
-            fields.forEach(type => {
-                let inputId = (type === 'name') ? 'pipe_name' : type;
-                let currentVal = document.getElementById(inputId).value;
-                if (remote[type] && remote[type] !== currentVal) select(type, null, remote[type]);
-            });
+function applyRemoteSettings(remote) {
+    // Sync Chips
+    const fields = ['name', 'size', 'pressure', 'color', 'operator'];
+    fields.forEach(type => {
+        let inputId = (type === 'name') ? 'pipe_name' : type;
+        let currentVal = document.getElementById(inputId).value;
+        if (remote[type] && remote[type] !== currentVal) select(type, null, remote[type]);
+    });
 
-            // Sync Weight
-            let currentWt = document.getElementById('weight_g').value;
-            if (remote.weight && remote.weight !== currentWt && document.activeElement.id !== 'weight_g') {
-                document.getElementById('weight_g').value = remote.weight;
-                updatePreview();
-            }
+    // Sync Weight
+    let currentWt = document.getElementById('weight_g').value;
+    if (remote.weight && remote.weight !== currentWt && document.activeElement.id !== 'weight_g') {
+        document.getElementById('weight_g').value = remote.weight;
+        updatePreview();
+    }
 
-            // Sync Auto Button (Taaki doosre device pe dikhe)
-            if (remote.auto_enabled !== undefined && remote.auto_enabled !== isAutoEnabled) {
-                isAutoEnabled = remote.auto_enabled;
-                updateAutoButtons(isAutoEnabled);
-            }
+    // Sync Auto Button (Taaki doosre device pe dikhe)
+    if (remote.auto_enabled !== undefined && remote.auto_enabled !== isAutoEnabled) {
+        isAutoEnabled = remote.auto_enabled;
+        updateAutoButtons(isAutoEnabled);
+    }
+}
+
+// Conditional GET: the server answers 304 (no body) until the version changes
+let settingsEtag = null;
+function pollSettings() {
+    const headers = settingsEtag ? { 'If-None-Match': settingsEtag } : {};
+    fetch('/api/settings/get', { headers: headers, cache: 'no-store' })
+        .then(res => {
+            if (res.status === 304) return null;
+            settingsEtag = res.headers.get('ETag');
+            return res.json();
         })
+        .then(remote => { if (remote) applyRemoteSettings(remote); })
         .catch(e => {});
-}, 12000);
+}
 let idleTimer;
 const lockOverlay = document.getElementById('touch-lock-overlay');
 
@@ -318,15 +318,12 @@ async function drillDown(brand, size, color, targetPressure = null, targetWeight
         report_type: fetchReportType,   
         date: fetchDate,                
         time_range: fetchTimeRange,     
-        grouped: 'false',  
-        page: 1,           
-        per_page: 1000     
+        grouped: 'false'
     });
 
     try {
-        const res = await fetch(`/api/inventory?${params}`, { headers: AUTH_HEADER });
-        const freshData = await res.json();
-        renderDetailTable(freshData.items, false);
+        const items = await fetchAllInventoryPages(params);
+        renderDetailTable(items, false);
         
         const paginationEl = document.getElementById('pagination-controls');
         if (paginationEl) paginationEl.style.display = 'none';
@@ -488,8 +485,8 @@ function printInventory() {
     printContent(content, "Inventory List", filters);
 }
 
-function downloadInventoryCSV() {
-    const params = newSearchParams({
+function downloadInventoryCSV(format = 'csv') {
+    const params = new URLSearchParams({
         name: document.getElementById('f_name').value,
         size: document.getElementById('f_size').value,
         color: document.getElementById('f_color').value,
@@ -499,9 +496,10 @@ function downloadInventoryCSV() {
         report_type: currentReportType,
         date: document.getElementById('rep_date').value,
         time_range: document.getElementById('rep_range').value,
-        grouped: (currentReportType === 'production') ? 'true' : 'false'
+        grouped: (currentReportType === 'production') ? 'true' : 'false',
+        format: format
     });
-    downloadFileWithAuth(`/api/export?${params}`, 'report.csv');
+    downloadFileWithAuth(`/api/export?${params}`, `report.${format}`);
 }
 // --- NEW HELPER: Jump to Verification Hub ---
 function openVerify(brand, size, color, pressure, weight) {
@@ -0,0 +1,37 @@
+// --- LIVE UPDATES (Server-Sent Events) ---
+// subscribeLive(['counter'], { counter: data => ... }, { start, stop, resync })
+//
+// Opens /api/events for the topics and calls the handler for each event.
+// While the stream is down the page's old polling runs (fallback.start),
+// and it is stopped again once the stream reconnects (fallback.stop).
+// fallback.resync (optional) runs on every (re)connect to pick up anything
+// missed while disconnected.
+function subscribeLive(topics, handlers, fallback) {
+    let polling = false;
+    const startPolling = () => { if (!polling) { polling = true; fallback.start(); } };
+    const stopPolling = () => { if (polling) { polling = false; fallback.stop(); } };
+
+    if (!window.EventSource) {
+        startPolling();
+        return { close: stopPolling };
+    }
+
+    const source = new EventSource('/api/events?topics=' + topics.join(','));
+    source.onopen = () => {
+        stopPolling();
+        if (fallback.resync) fallback.resync();
+    };
+    // EventSource keeps retrying by itself; poll in the meantime
+    source.onerror = () => startPolling();
+
+    topics.forEach(topic => {
+        source.addEventListener(topic, (e) => {
+            try { handlers[topic](JSON.parse(e.data)); }
+            catch (err) { console.log("Live event error:", topic, err); }
+        });
+    });
+
+    return {
+        close: () => { source.close(); stopPolling(); }
+    };
+}
@@ -211,5 +211,5 @@ function recalcShipmentTotal() {
     document.getElementById('totalVisiblePipes').innerText = total;
 }
 
-function downloadCSV() { downloadInventoryCSV(); }
+function downloadCSV(format) { downloadInventoryCSV(format); }
 function printReportPDF() { const content = document.getElementById('reportTable').outerHTML; printContent(content, document.getElementById('reportTitle').innerText); }
\ No newline at end of file
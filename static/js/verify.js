@@ -7,6 +7,11 @@ let extraArr      = [];
 let logArr        = [];          
 let returnQueue   = [];          
 let espTimer      = null;
+let espSubscription = null;
+let espAfter      = null;   // cursor in the server's scan ring
+let espFetching   = false;
+let espPending    = false;   // an esp_scans event arrived mid-fetch
+let knownLabels   = {};      // extras resolved in bulk by fetchESP, used once by processScan
 let sessionStart  = Date.now();
 let filterParams  = {};
 let logIdCounter  = 0;
@@ -43,13 +48,21 @@ document.addEventListener('DOMContentLoaded', () => {
 async function loadPipes() {
   const p = new URLSearchParams(filterParams);
   p.set('status', 'stock');
-  p.set('per_page', '5000');
-  p.set('page', '1');
+  p.set('per_page', '1000');
+  p.set('with_total', 'false');
 
   try {
-    const res  = await fetch('/api/verify/pipes?' + p.toString());
-    const data = await res.json();
-    allPipes   = data.items || [];
+    // Keyset pages: follow next_cursor until the server says we're done
+    let items = [];
+    let cursor = '';
+    do {
+      p.set('cursor', cursor);
+      const res  = await fetch('/api/verify/pipes?' + p.toString());
+      const data = await res.json();
+      items  = items.concat(data.items || []);
+      cursor = data.next_cursor;
+    } while (cursor);
+    allPipes = items;
 
     if (!allPipes.length) {
       document.getElementById('pipeBody').innerHTML =
@@ -168,10 +181,13 @@ async function processScan() {
         const token = localStorage.getItem('admin_token');
         const headers = token ? { 'Authorization': 'Basic ' + token } : {};
         
-        const res = await fetch(`/api/labels/${id}`, { headers: headers });
-        if (!res.ok) throw new Error("Not found");
-        
-        const item = await res.json();
+        let item = knownLabels[id];
+        delete knownLabels[id];
+        if (!item) {
+            const res = await fetch(`/api/labels/${id}`, { headers: headers });
+            if (!res.ok) throw new Error("Not found");
+            item = await res.json();
+        }
         extraArr.push(id);
         
         let errText = "⚠ Not in Filter";
@@ -300,25 +316,58 @@ function updateStats() {
 /* ════════════════════════════════════════════
    ESP MODE
 ════════════════════════════════════════════ */
-async function fetchESP() {
+async function lookupExtras(ids, headers) {
     try {
-        const token = localStorage.getItem('admin_token');
-        const headers = token ? { 'Authorization': 'Basic ' + token } : {};
-        const res = await fetch('/api/esp/fetch', { headers: headers });
-        const ids = await res.json();
-        for (let id of ids) {
-            document.getElementById('scanInput').value = String(id);
-            processScan();
-        }
+        const res = await fetch('/api/labels/lookup', {
+            method: 'POST',
+            headers: Object.assign({ 'Content-Type': 'application/json' }, headers),
+            body: JSON.stringify({ ids })
+        });
+        if (!res.ok) return;
+        const data = await res.json();
+        for (const label of data.labels) knownLabels[label.id] = label;
     } catch (e) { }
 }
 
+async function fetchESP() {
+    if (espFetching) { espPending = true; return; }  // the running fetch goes round again
+    espFetching = true;
+    try {
+        do {
+            espPending = false;
+            const token = localStorage.getItem('admin_token');
+            const headers = token ? { 'Authorization': 'Basic ' + token } : {};
+            let url = '/api/esp/fetch?consumer=verify';
+            if (espAfter !== null) url += `&after=${espAfter}`;
+            const res = await fetch(url, { headers: headers });
+            const data = await res.json();
+            // Pipes outside the loaded filter are looked up in one request
+            const extras = data.items.map(item => item.id).filter(id => !allPipes.some(p => p.id === id));
+            if (extras.length > 1) await lookupExtras(extras, headers);
+            for (let item of data.items) {
+                document.getElementById('scanInput').value = String(item.id);
+                await processScan();
+            }
+            espAfter = data.last_seq;
+        } while (espPending);  // scans pushed while this one ran
+    } catch (e) {
+    } finally {
+        espFetching = false;
+    }
+}
+
 function toggleEsp(el) {
   const status = document.getElementById('espStatus');
   if (el.checked) {
-    espTimer = setInterval(fetchESP, 1000);
+    // Scans arrive as 'esp_scans' events; the 1s poll only runs while the stream is down
+    espSubscription = subscribeLive(['esp_scans'], { esp_scans: fetchESP }, {
+      start: () => { espTimer = setInterval(fetchESP, 1000); },
+      stop:  () => { clearInterval(espTimer); espTimer = null; },
+      resync: fetchESP
+    });
     status.classList.add('active');
   } else {
+    if (espSubscription) { espSubscription.close(); espSubscription = null; }
     clearInterval(espTimer); espTimer = null;
     status.classList.remove('active');
   }